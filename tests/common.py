@@ -0,0 +1,91 @@
+"""Helpers feeding PIM lines to the pulse protocol in tests."""
+
+import asyncio
+from binascii import unhexlify
+
+from upb.pulse import UPBPulse
+from upb.util import cksum
+
+
+def frame(network, destination, source, mdid, data=b'', link=False):
+    packet = bytes([(7 + len(data)) | (0x80 if link else 0), 0, network, destination, source, mdid]) + data
+    return packet + bytes([cksum(packet)])
+
+
+def crumb_lines(packet, transmitted=False):
+    """Return the PIM lines reporting a packet two bits at a time."""
+    if transmitted:
+        packet = b'\x00' + packet
+    lines = [b'X0']
+    for seq, position in enumerate(range(len(packet) * 4)):
+        bits = (packet[position // 4] >> (6 - 2 * (position % 4))) & 0x03
+        seq_digit = b'%X' % (seq & 0x0f)
+        if transmitted:
+            lines.append(b'T' + bytes([0x30 + bits]) + seq_digit)
+        else:
+            lines.append(bytes([0x30 + bits]) + b'0' + seq_digit)
+    lines.append(b'A0')
+    return lines
+
+
+def feed(core, lines):
+    events = []
+    for line in lines:
+        events += core.receive_line(line)
+    return events
+
+
+def of_type(events, event_type):
+    return [event for event in events if type(event) is event_type]
+
+
+class FakeProtocol:
+
+    def __init__(self):
+        self.written = []
+
+    def write_packet(self, packet):
+        self.written.append(packet)
+
+
+def attach_pulse(client):
+    """Give a client a released pulse writing to a FakeProtocol, like setup() without a connection."""
+    client.pulse = UPBPulse(
+        register_callback=client.handle_register_update,
+        signature_callback=client.handle_signature_update,
+        message_callback=client.handle_message,
+        airtime_budget=client.airtime_budget,
+        queue_limits=client.queue_limits,
+        packet_callback=client.handle_packet,
+        loop=client.loop,
+        logger=client.logger)
+    client.pulse.protocol = FakeProtocol()
+    client.pulse.release()
+    return client.pulse
+
+
+def sent_packets(protocol):
+    """Return the packets of the PIM commands written to a FakeProtocol."""
+    lines = b''.join(protocol.written).split(b'\r')[:-1]
+    return [unhexlify(line[1:]) for line in lines]
+
+
+def receive(pulse, *packets, transmitted=False):
+    for packet in packets:
+        for line in crumb_lines(packet, transmitted):
+            pulse.line_received(line)
+
+
+def switch_registers(*presets):
+    """Return the registers of a PCS WS1 dimmer with (link id, level, fade rate) presets."""
+    registers = bytearray(256)
+    registers[6:10] = b'\x00\x01\x00\x01'
+    for index, preset in enumerate(presets):
+        registers[0x40 + index * 3:0x43 + index * 3] = bytes(preset)
+    return registers
+
+
+async def settle(steps=5):
+    """Let tasks run until they wait on something outside the event loop."""
+    for _ in range(steps):
+        await asyncio.sleep(0)
@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from upb.const import PimCommand, UpbPriority
+from upb.core import UPBPulseCore
+from upb.util import encode_goto
+from tests.common import attach_pulse, settle
+
+
+class PriorityTest(unittest.TestCase):
+
+    def test_priority_order(self):
+        core = UPBPulseCore()
+        core.send(1, PimCommand.UPB_NETWORK_TRANSMIT, encode_goto(1, 6, 50))
+        core.send(2, PimCommand.UPB_NETWORK_TRANSMIT, encode_goto(1, 7, 50), UpbPriority.LOW)
+        core.send(3, PimCommand.UPB_NETWORK_TRANSMIT, encode_goto(1, 8, 50), UpbPriority.HIGH)
+        core.send(4, PimCommand.UPB_NETWORK_TRANSMIT, encode_goto(1, 9, 50), UpbPriority.HIGH)
+        self.assertEqual(core.queued(UpbPriority.HIGH), 2)
+        order = []
+        while core.active_token is not None:
+            order.append(core.active_token)
+            core.cancel(core.active_token)
+        self.assertEqual(order, [1, 3, 4, 2])
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_queue_limit(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None, queue_limits={UpbPriority.LOW: 2})
+            pulse = attach_pulse(client)
+            requests = [asyncio.ensure_future(pulse.send_packet(encode_goto(1, device, 10), UpbPriority.LOW))
+                        for device in range(1, 4)]
+            asyncio.ensure_future(pulse.send_packet(encode_goto(1, 9, 10)))
+            await settle()
+            self.assertEqual(pulse.pending[UpbPriority.LOW], 2)
+            self.assertEqual(pulse.pending[UpbPriority.NORMAL], 1)
+            self.assertEqual(len(pulse.admission[UpbPriority.LOW]), 1)
+            # A finished request lets the waiting producer in
+            requests[0].cancel()
+            await settle()
+            self.assertEqual(pulse.pending[UpbPriority.LOW], 2)
+            self.assertEqual(len(pulse.admission[UpbPriority.LOW]), 0)
+            pulse.stop()
+
+        asyncio.run(run())
+
+    def test_pause_writing(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            pulse = attach_pulse(client)
+            pulse.pause_writing()
+            normal = asyncio.ensure_future(pulse.send_packet(encode_goto(1, 5, 10)))
+            urgent = asyncio.ensure_future(pulse.send_packet(encode_goto(1, 6, 10), UpbPriority.URGENT))
+            await settle()
+            self.assertEqual(pulse.pending[UpbPriority.NORMAL], 0)
+            self.assertEqual(pulse.pending[UpbPriority.URGENT], 1)
+            pulse.resume_writing()
+            await settle()
+            self.assertEqual(pulse.pending[UpbPriority.NORMAL], 1)
+            pulse.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+
+from upb.airtime import UPBAirtimeBudget, UPBLineUsage, packet_airtime
+from upb.client import UPBClient
+from upb.const import UpbPriority
+from upb.util import encode_goto, encode_signal_strength_request
+from tests.common import attach_pulse
+
+
+class PacketAirtimeTest(unittest.TestCase):
+
+    def test_packet_airtime(self):
+        # 7 byte packet, no repeater and one copy: preamble, data and gap bits at 240 bits/s
+        packet = encode_signal_strength_request(1, 5)
+        self.assertAlmostEqual(packet_airtime(packet), (12 + 7 * 8 + 20) / 240)
+        repeated = bytes([packet[0] | 0x40, packet[1] | 0x0c]) + packet[2:]
+        self.assertAlmostEqual(packet_airtime(repeated), 4 * 3 * packet_airtime(packet))
+
+
+class UPBAirtimeBudgetTest(unittest.TestCase):
+
+    def test_burst_then_throttle(self):
+        async def run():
+            budget = UPBAirtimeBudget(share=1.0, burst=0.05)
+            self.assertTrue(budget.try_acquire(0.04))
+            self.assertFalse(budget.try_acquire(0.04))
+            await asyncio.wait_for(budget.acquire(0.04), 1)
+            return budget
+
+        budget = asyncio.run(run())
+        self.assertGreater(budget.throttled, 0)
+        self.assertAlmostEqual(budget.airtime_used, 0.08)
+
+    def test_priority_order(self):
+        async def run():
+            budget = UPBAirtimeBudget(share=1.0, burst=0.02)
+            budget.try_acquire(0.02)
+            order = []
+
+            async def waiter(name, priority):
+                await budget.acquire(0.01, priority)
+                order.append(name)
+            tasks = [asyncio.ensure_future(waiter('low', UpbPriority.LOW))]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.ensure_future(waiter('urgent', UpbPriority.URGENT)))
+            await asyncio.wait_for(asyncio.gather(*tasks), 1)
+            return order
+
+        self.assertEqual(asyncio.run(run()), ['urgent', 'low'])
+
+    def test_cancelled_waiter_takes_nothing(self):
+        async def run():
+            budget = UPBAirtimeBudget(share=1.0, burst=0.02)
+            budget.try_acquire(0.02)
+            waiter = asyncio.ensure_future(budget.acquire(0.02))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.wait_for(budget.acquire(0.01), 1)
+            return budget
+
+        self.assertAlmostEqual(asyncio.run(run()).airtime_used, 0.03)
+
+
+class UPBLineUsageTest(unittest.TestCase):
+
+    def test_smoothing(self):
+        usage = UPBLineUsage(smoothing=0.5)
+        self.assertEqual(usage.update(10, 10), 0.25)
+        self.assertEqual(usage.update(10, 10), 0.25)
+        self.assertEqual(usage.update(10, 20), 0.625)
+
+
+class PulseAirtimeTest(unittest.TestCase):
+
+    def test_admission_before_airtime(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=1.0, airtime_burst=5.0, queue_limits={UpbPriority.LOW: 1})
+            pulse = attach_pulse(client)
+            first = asyncio.ensure_future(pulse.send_packet(encode_goto(1, 5, 10), UpbPriority.LOW))
+            await asyncio.sleep(0)
+            used = client.airtime_budget.airtime_used
+            second = asyncio.ensure_future(pulse.send_packet(encode_goto(1, 6, 10), UpbPriority.LOW))
+            await asyncio.sleep(0)
+            # Parked behind the full queue without spending airtime
+            self.assertEqual(client.airtime_budget.airtime_used, used)
+            second.cancel()
+            await asyncio.sleep(0)
+            self.assertEqual(client.airtime_budget.airtime_used, used)
+            first.cancel()
+
+        asyncio.run(run())
+
+    def test_utilization_read_has_no_side_effect(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            pulse = attach_pulse(client)
+            pulse.line_received(b'-')
+            pulse.line_received(b'X0')
+            pulse.line_received(b'100')
+            self.assertEqual(pulse.utilization, 0.0)
+            sample = pulse.sample_utilization()
+            self.assertGreater(sample, 0.0)
+            self.assertEqual(pulse.utilization, sample)
+            self.assertEqual(pulse.utilization, sample)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+from upb import util
+from upb.util import validate_checksums, NUMPY_BATCH_MIN
+from tests.common import frame
+
+
+def packed_frames(count):
+    """Return a buffer, offsets and the expected results of valid, corrupt and short frames."""
+    buffer = bytearray()
+    offsets = []
+    expected = []
+    for index in range(count):
+        packet = bytearray(frame(1, 7, index & 0xff, 0x22, bytes([index & 0xff])))
+        if index % 3 == 1:
+            packet[-1] ^= 0x01
+        elif index % 5 == 2:
+            # Control word length below the 7 byte minimum
+            packet[0] = (packet[0] & 0xe0) | 5
+        offsets.append(len(buffer))
+        expected.append(index % 3 != 1 and index % 5 != 2)
+        buffer += packet
+    # The last frame claims more bytes than the buffer holds
+    offsets.append(len(buffer))
+    expected.append(False)
+    buffer += frame(1, 7, 5, 0x22, b'\x64')[0:6]
+    return bytes(buffer), offsets, expected
+
+
+class ValidateChecksumsTest(unittest.TestCase):
+
+    def test_small_batch(self):
+        buffer, offsets, expected = packed_frames(8)
+        self.assertEqual(validate_checksums(buffer, offsets), expected)
+        self.assertEqual(validate_checksums(b'', []), [])
+
+    def test_pure_python(self):
+        buffer, offsets, expected = packed_frames(NUMPY_BATCH_MIN * 2)
+        with mock.patch.object(util, 'numpy', None):
+            self.assertEqual(validate_checksums(buffer, offsets), expected)
+
+    @unittest.skipIf(util.numpy is None, "numpy is not installed")
+    def test_numpy_matches_pure_python(self):
+        buffer, offsets, expected = packed_frames(NUMPY_BATCH_MIN * 2)
+        # Repeated offsets are checked independently
+        offsets = offsets + offsets[0:3]
+        expected = expected + expected[0:3]
+        result = validate_checksums(bytearray(buffer), offsets)
+        self.assertIs(type(result[0]), bool)
+        self.assertEqual(result, expected)
+        with mock.patch.object(util, 'numpy', None):
+            self.assertEqual(validate_checksums(buffer, offsets), result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from upb.util import encode_setuptime_request
+from tests.common import frame, attach_pulse, sent_packets, receive, settle
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def run_client(self, test, **kwargs):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None, **kwargs)
+            return await test(client, attach_pulse(client))
+        return asyncio.run(run())
+
+    def test_shared_request(self):
+        async def test(client, pulse):
+            requests = [asyncio.ensure_future(client.get_setup_time(1, 5)) for _ in range(3)]
+            await settle()
+            self.assertEqual(sent_packets(pulse.protocol), [encode_setuptime_request(1, 5)])
+            receive(pulse, encode_setuptime_request(1, 5), transmitted=True)
+            receive(pulse, frame(1, 0xff, 5, 0x85, b'\x00\x10'))
+            results = await asyncio.wait_for(asyncio.gather(*requests), 1)
+            self.assertEqual(client.inflight, {})
+            return [result['setup_mode_timer'] for result in results]
+
+        self.assertEqual(self.run_client(test), [0x10] * 3)
+
+    def test_cached_response(self):
+        async def test(client, pulse):
+            request = asyncio.ensure_future(client.get_setup_time(1, 5))
+            await settle()
+            receive(pulse, encode_setuptime_request(1, 5), transmitted=True)
+            receive(pulse, frame(1, 0xff, 5, 0x85, b'\x00\x10'))
+            await asyncio.wait_for(request, 1)
+            await client.get_setup_time(1, 5)
+            sent = len(sent_packets(pulse.protocol))
+            client.invalidate_cache(1, 5)
+            asyncio.ensure_future(client.get_setup_time(1, 5))
+            await settle()
+            return sent, len(sent_packets(pulse.protocol))
+
+        self.assertEqual(self.run_client(test, cache_ttl=60), (1, 2))
+
+    def test_cancel(self):
+        async def test(client, pulse):
+            first = asyncio.ensure_future(client.get_setup_time(1, 5))
+            second = asyncio.ensure_future(client.get_setup_time(1, 5))
+            queued = asyncio.ensure_future(client.get_setup_time(1, 6))
+            await settle()
+            # One caller giving up leaves the request to the other
+            first.cancel()
+            await settle()
+            self.assertIn((1, 5, 'setuptime'), client.inflight)
+            self.assertEqual(pulse.core.queued(), 1)
+            second.cancel()
+            queued.cancel()
+            await settle()
+            self.assertEqual(client.inflight, {})
+            self.assertEqual(pulse.core.queued(), 0)
+            self.assertFalse(pulse.core.in_transaction)
+
+        self.run_client(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from upb.const import PimCommand
+from upb.core import UPBPulseCore, MessageReceived, TransactionComplete
+from upb.util import encode_signal_strength_request, encode_goto, encode_activate_link, encode_report_state
+from tests.common import frame, crumb_lines, feed, of_type, attach_pulse, sent_packets, receive
+
+
+class ReplyMatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = UPBPulseCore()
+        self.request = encode_signal_strength_request(1, 5)
+        self.core.send(1, PimCommand.UPB_NETWORK_TRANSMIT, self.request)
+        feed(self.core, crumb_lines(self.request, transmitted=True))
+
+    def test_reply_from_other_device_does_not_complete(self):
+        events = feed(self.core, crumb_lines(frame(1, 0xff, 9, 0x89, b'\x40')))
+        self.assertFalse(of_type(events, TransactionComplete))
+        # Unrelated traffic is not tagged with the active transaction
+        self.assertIsNone(of_type(events, MessageReceived)[0].token)
+        self.assertTrue(self.core.in_transaction)
+
+    def test_other_report_from_device_does_not_complete(self):
+        for report in (frame(1, 0xff, 5, 0x86, b'\x40'), frame(1, 0xff, 5, 0x90, b'\x00\x01')):
+            events = feed(self.core, crumb_lines(report))
+            self.assertFalse(of_type(events, TransactionComplete))
+            self.assertIsNone(of_type(events, MessageReceived)[0].token)
+        events = feed(self.core, crumb_lines(frame(1, 0xff, 5, 0x89, b'\x40')))
+        self.assertEqual(of_type(events, MessageReceived)[0].token, 1)
+        self.assertEqual(of_type(events, TransactionComplete)[0].result['signal_strength'], 0x40)
+
+    def test_commands_without_reply_complete_on_transmit(self):
+        self.core.cancel(1)
+        for token, packet in enumerate((encode_goto(1, 7, 50), encode_activate_link(1, 3),
+                                        encode_report_state(1, 3, link=True)), 2):
+            self.core.send(token, PimCommand.UPB_NETWORK_TRANSMIT, packet)
+            events = feed(self.core, crumb_lines(packet, transmitted=True))
+            self.assertEqual(of_type(events, TransactionComplete)[0].token, token)
+
+
+class DeviceControlTest(unittest.TestCase):
+
+    def test_report_state(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            pulse = attach_pulse(client)
+            request = asyncio.ensure_future(client.report_state(1, 5))
+            await asyncio.sleep(0)
+            packet = sent_packets(pulse.protocol)[-1]
+            self.assertEqual(packet, encode_report_state(1, 5))
+            receive(pulse, packet, transmitted=True)
+            # A signal strength report from the device does not answer the request
+            receive(pulse, frame(1, 0xff, 5, 0x89, b'\x40'), frame(1, 0xff, 5, 0x86, b'\x64\x00'))
+            return await asyncio.wait_for(request, 1)
+
+        self.assertEqual(asyncio.run(run()), [0x64, 0x00])
+
+
+if __name__ == '__main__':
+    unittest.main()
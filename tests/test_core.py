@@ -0,0 +1,87 @@
+import unittest
+
+from upb.const import PimCommand
+from upb.core import UPBPulseCore, MessageReceived, MessageTransmitted, MessageInvalid, \
+    PacketSent, PimAccept, PimBusy, TransactionComplete
+from upb.util import encode_setuptime_request
+from tests.common import frame, crumb_lines, feed, of_type
+
+
+class UPBPulseCoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core = UPBPulseCore()
+        self.request = encode_setuptime_request(1, 5)
+
+    def send_request(self, token=1):
+        events = self.core.send(token, PimCommand.UPB_NETWORK_TRANSMIT, self.request)
+        self.assertEqual(of_type(events, PacketSent)[0].token, token)
+        self.core.data_to_send()
+
+    def test_received_message(self):
+        events = feed(self.core, crumb_lines(frame(1, 7, 5, 0x22, b'\x64')))
+        received = of_type(events, MessageReceived)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].response['destination_id'], 7)
+        self.assertTrue(received[0].response['crc_ok'])
+        self.assertIsNone(received[0].token)
+
+    def test_nak_ends_message(self):
+        lines = crumb_lines(frame(1, 7, 5, 0x22, b'\x64'))
+        lines[-1] = b'N0'
+        self.assertEqual(len(of_type(feed(self.core, lines), MessageReceived)), 1)
+
+    def test_crc_mismatch(self):
+        packet = bytearray(frame(1, 7, 5, 0x22, b'\x64'))
+        packet[-1] ^= 0xff
+        received = of_type(feed(self.core, crumb_lines(bytes(packet))), MessageReceived)
+        self.assertFalse(received[0].response['crc_ok'])
+
+    def test_accept_and_reply(self):
+        self.send_request()
+        self.assertEqual(of_type(self.core.receive_line(b'PA'), PimAccept)[0].token, 1)
+        events = feed(self.core, crumb_lines(self.request, transmitted=True))
+        self.assertEqual(of_type(events, MessageTransmitted)[0].token, 1)
+        self.assertFalse(of_type(events, TransactionComplete))
+        events = feed(self.core, crumb_lines(frame(1, 0xff, 5, 0x85, b'\x01\x02')))
+        complete = of_type(events, TransactionComplete)
+        self.assertEqual(complete[0].token, 1)
+        self.assertEqual(complete[0].result['setup_mode_timer'], 2)
+        self.assertFalse(self.core.in_transaction)
+
+    def test_busy_resends(self):
+        self.send_request()
+        events = self.core.receive_line(b'PB')
+        self.assertEqual(of_type(events, PimBusy)[0].token, 1)
+        self.assertTrue(of_type(events, PacketSent)[0].resend)
+        self.assertTrue(self.core.data_to_send())
+
+    def test_timeout_resends(self):
+        self.send_request()
+        events = self.core.timeout()
+        self.assertTrue(of_type(events, PacketSent)[0].resend)
+        self.assertTrue(self.core.in_transaction)
+
+    def test_pim_read(self):
+        self.core.send(1, PimCommand.UPB_PIM_READ, b'\x00\x02\xfe')
+        self.assertEqual(self.core.data_to_send(), b'\x12' + b'0002FE' + b'\r')
+        complete = of_type(self.core.receive_line(b'PR00012A'), TransactionComplete)
+        self.assertEqual(complete[0], TransactionComplete(1, b'\x01\x2a'))
+
+    def test_short_frames(self):
+        for packet in (b'\x0a\x00\x01', frame(1, 0xff, 5, 0x8f, b'\x01\x02'), frame(1, 7, 5, 0x22)[0:5]):
+            events = feed(self.core, crumb_lines(packet))
+            self.assertFalse(of_type(events, MessageReceived))
+            invalid = of_type(events, MessageInvalid)
+            self.assertEqual(len(invalid), 1)
+            self.assertFalse(invalid[0].response['crc_ok'])
+
+    def test_short_transmitted_frame(self):
+        self.send_request()
+        events = feed(self.core, crumb_lines(b'\x07', transmitted=True))
+        self.assertTrue(of_type(events, MessageInvalid)[0].transmitted)
+        self.assertTrue(self.core.in_transaction)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import io
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from upb.util import cksum
+from upb.tools.decode import iter_chunks, decode_chunk, decode_chunks
+from tests.common import frame, crumb_lines
+
+
+def capture(*messages):
+    lines = [b'-']
+    for message in messages:
+        lines += message + [b'-']
+    return b'\r\n'.join(lines) + b'\r\n'
+
+
+def decode(data, chunk_lines, block_size=1 << 20):
+    chunks = iter_chunks(io.BytesIO(data), chunk_lines, block_size)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        return [record for records in decode_chunks(executor, chunks, 2) for record in records]
+
+
+class DecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = capture(*[crumb_lines(frame(1, device, 5, 0x22, bytes([device]))) for device in range(1, 9)])
+
+    def test_chunks_split_at_message_start(self):
+        chunks = list(iter_chunks(io.BytesIO(self.data), 10, block_size=7))
+        self.assertGreater(len(chunks), 1)
+        line = 0
+        for start, lines in chunks:
+            self.assertEqual(start, line)
+            if start:
+                self.assertEqual(lines[0], b'X0')
+            line += len(lines)
+        self.assertEqual([line for start, lines in chunks for line in lines],
+                         self.data.replace(b'\n', b'\r').split(b'\r'))
+
+    def test_records_in_capture_order(self):
+        records = decode(self.data, 10)
+        self.assertEqual([record['destination_id'] for record in records], list(range(1, 9)))
+        self.assertTrue(all(record['crc_ok'] and record['valid'] for record in records))
+        self.assertEqual(records, decode(self.data, 1000))
+        self.assertEqual(records, decode(self.data, 1))
+
+    def test_repeats_independent_of_chunk_size(self):
+        message = bytearray(frame(1, 2, 5, 0x22, b'\x01'))
+        copies = []
+        for seq in range(4):
+            message[1] = 0x0c | seq
+            message[-1] = cksum(message[0:-1])
+            copies.append(crumb_lines(bytes(message)))
+        data = capture(*(copies * 5))
+        records = decode(data, 1000)
+        self.assertEqual(len(records), 20)
+        for chunk_lines in (1, 20, 100):
+            self.assertEqual(decode(data, chunk_lines), records)
+
+    def test_bad_frames(self):
+        corrupt = bytearray(frame(1, 2, 5, 0x22, b'\x01'))
+        corrupt[-1] ^= 0xff
+        data = capture(crumb_lines(bytes(corrupt)), [b'PRZZ'], crumb_lines(b'\x0a\x00\x01'),
+                       crumb_lines(frame(1, 3, 5, 0x22, b'\x01'), transmitted=True))
+        records = decode_chunk((0, data.replace(b'\n', b'').split(b'\r')))
+        self.assertEqual([record['direction'] for record in records], ['rx', 'error', 'rx', 'tx'])
+        self.assertFalse(records[0]['crc_ok'])
+        self.assertTrue(records[0]['valid'])
+        self.assertIn('error', records[1])
+        self.assertFalse(records[2]['valid'])
+        self.assertTrue(records[3]['crc_ok'])
+        self.assertEqual(records[3]['destination_id'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
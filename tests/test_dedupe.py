@@ -0,0 +1,54 @@
+import unittest
+
+from upb.core import UPBPulseCore, MessageReceived
+from upb.util import cksum
+from tests.common import frame, crumb_lines, feed, of_type
+
+
+def copy(packet, seq, corrupt=False):
+    packet = bytearray(packet)
+    packet[1] = (packet[1] & 0xf0) | 0x0c | seq
+    packet[-1] = cksum(packet[0:-1])
+    if corrupt:
+        packet[-1] ^= 0xff
+    return bytes(packet)
+
+
+class DedupeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.core = UPBPulseCore(dedupe_window=1.0, clock=lambda: self.now)
+        self.message = frame(1, 7, 5, 0x22, b'\x64')
+
+    def received(self, *packets):
+        lines = []
+        for packet in packets:
+            lines += crumb_lines(packet)
+        return of_type(feed(self.core, lines), MessageReceived)
+
+    def test_repeats_suppressed(self):
+        received = self.received(*[copy(self.message, seq) for seq in range(4)])
+        self.assertEqual(len(received), 1)
+        self.assertTrue(received[0].response['crc_ok'])
+        self.assertEqual((self.core.received, self.core.duplicates), (4, 3))
+
+    def test_new_message_after_window(self):
+        self.assertEqual(len(self.received(copy(self.message, 0), copy(self.message, 1))), 1)
+        # Sent again later, and a first copy is never a repeat
+        self.now = 2.0
+        self.assertEqual(len(self.received(copy(self.message, 1))), 1)
+        self.assertEqual(len(self.received(copy(self.message, 0))), 1)
+
+    def test_corrupt_copy_does_not_claim_key(self):
+        received = self.received(copy(self.message, 0, corrupt=True), copy(self.message, 1), copy(self.message, 2))
+        self.assertEqual([message.response['crc_ok'] for message in received], [False, True])
+        self.assertEqual(self.core.duplicates, 1)
+
+    def test_disabled(self):
+        self.core = UPBPulseCore(dedupe_window=None)
+        self.assertEqual(len(self.received(*[copy(self.message, seq) for seq in range(4)])), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from upb.tools.dumpreg import parse_device_list, read_archive, write_archive, dump_device
+
+
+class FakeDevice:
+
+    def __init__(self):
+        self.registers = bytearray(256)
+
+
+class FakeClient:
+
+    def __init__(self, signatures):
+        self.signatures = signatures
+        self.devices = {}
+        self.dumped = []
+
+    def get_device(self, network, device):
+        return self.devices.setdefault((network, device), FakeDevice())
+
+    async def update_signature(self, network, device):
+        signature = self.signatures[device]
+        if isinstance(signature, Exception):
+            raise signature
+        if signature is None:
+            await asyncio.sleep(1)
+        return signature
+
+    async def update_registers(self, network, device, signature=None):
+        self.dumped.append(device)
+        self.get_device(network, device).registers[0:2] = bytes([network, device])
+
+    def handle_register_update(self, network, device, start, data):
+        self.get_device(network, device).registers[start:start + len(data)] = data
+
+
+class DumpRegTest(unittest.TestCase):
+
+    def test_parse_device_list(self):
+        self.assertEqual(parse_device_list('1-3,5,2:7,1', 1), [(1, 1), (1, 2), (1, 3), (1, 5), (2, 7)])
+
+    def test_archive_round_trip(self):
+        results = {(1, 2): {'network': 1, 'device': 2, 'id_checksum': 1, 'setup_checksum': 2,
+                            'ct_bytes': 256, 'registers': bytes(range(256)), 'status': 'dumped'}}
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, 'dump.json')
+            write_archive(path, results)
+            self.assertEqual(read_archive(path), results)
+
+    def test_dump_device_status(self):
+        previous = {(1, 2): {'id_checksum': 1, 'setup_checksum': 2, 'ct_bytes': 256, 'registers': b'\x07' * 256}}
+        client = FakeClient({2: (1, 2, 256), 3: (1, 2, 256), 4: KeyError('signature'), 5: None})
+
+        async def run():
+            semaphore = asyncio.Semaphore(2)
+            return await asyncio.gather(*[dump_device(client, 1, device, previous, semaphore, 0.05)
+                                          for device in range(2, 6)])
+
+        with self.assertLogs('upb.tools.dumpreg', level='ERROR'):
+            entries = asyncio.run(run())
+        self.assertEqual([entry['status'] for entry in entries], ['unchanged', 'dumped', 'error', 'timeout'])
+        self.assertEqual(entries[0]['registers'], b'\x07' * 256)
+        self.assertEqual(entries[1]['registers'][0:2], b'\x01\x03')
+        self.assertIn('KeyError', entries[2]['error'])
+        self.assertEqual(client.dumped, [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from upb.history import UPBMessageHistory, PACKET_SLOT
+from tests.common import frame
+
+
+class UPBMessageHistoryTest(unittest.TestCase):
+
+    def test_get_round_trip(self):
+        history = UPBMessageHistory(4)
+        packet = frame(1, 7, 5, 0x22, b'\x64')
+        seq = history.add(packet, transmitted=True, timestamp=10.0)
+        self.assertEqual(history.get(seq), (0, 10.0, packet, True))
+        self.assertIsNone(history.add(b'\x00\x01'))
+        self.assertIsNone(history.get(1))
+
+    def test_long_packet_truncated(self):
+        history = UPBMessageHistory(2)
+        packet = frame(1, 7, 5, 0x22, bytes(30))
+        seq = history.add(packet)
+        self.assertEqual(history.get(seq)[2], packet[0:PACKET_SLOT])
+
+    def test_recent_wraps(self):
+        history = UPBMessageHistory(3)
+        for device in range(5):
+            history.add(frame(1, 7, device, 0x22), timestamp=device)
+        self.assertEqual(len(history), 3)
+        self.assertEqual([entry[0] for entry in history.recent(10)], [4, 3, 2])
+        self.assertIsNone(history.get(1))
+
+    def test_device_links(self):
+        history = UPBMessageHistory(8)
+        history.add(frame(1, 7, 5, 0x22))
+        history.add(frame(1, 9, 6, 0x22))
+        history.add(frame(1, 7, 5, 0x22))
+        history.add(frame(1, 7, 6, 0x20, link=True))
+        self.assertEqual([entry[0] for entry in history.from_device(1, 5, 10)], [2, 0])
+        self.assertEqual([entry[0] for entry in history.from_device(1, 6, 1)], [3])
+        self.assertEqual([entry[0] for entry in history.to_device(1, 7, 10)], [2, 0])
+        self.assertEqual([entry[0] for entry in history.to_device(1, 7, 10, link=True)], [3])
+        self.assertEqual(history.from_device(2, 5, 10), [])
+
+    def test_links_across_wraparound(self):
+        history = UPBMessageHistory(4)
+        history.add(frame(1, 7, 5, 0x22))
+        for _ in range(3):
+            history.add(frame(1, 9, 6, 0x22))
+        history.add(frame(1, 7, 5, 0x22))
+        # The first frame of device 5 was overwritten by the last one
+        self.assertEqual([entry[0] for entry in history.from_device(1, 5, 10)], [4])
+        for _ in range(4):
+            history.add(frame(1, 9, 6, 0x22))
+        # Device 5 is older than the whole buffer
+        self.assertEqual(history.from_device(1, 5, 10), [])
+        self.assertEqual([entry[0] for entry in history.from_device(1, 6, 10)], [8, 7, 6, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from tests.common import switch_registers
+
+
+class UPBLinkIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = UPBClient('localhost', airtime_share=None, loop=self.loop)
+        self.client.handle_register_update(1, 5, 0, switch_registers((3, 100, 2), (4, 50, 0)))
+        self.client.handle_register_update(1, 6, 0, switch_registers((3, 80, 2)))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_members(self):
+        index = self.client.link_index
+        self.assertEqual(index.members(1, 3), {(1, 5, None): (100, 2), (1, 6, None): (80, 2)})
+        self.assertEqual(index.predict(1, 4), {(1, 5, None): 50})
+        self.assertEqual(index.device_link_ids(1, 5), {3, 4})
+        self.assertEqual(set(index.network_links(1)), {3, 4})
+        self.assertEqual(index.network_links(2), {})
+
+    def test_register_update_reindexes(self):
+        self.client.handle_register_update(1, 6, 0x40, bytes((4, 20, 0)))
+        index = self.client.link_index
+        self.assertEqual(index.members(1, 3), {(1, 5, None): (100, 2)})
+        self.assertEqual(index.members(1, 4), {(1, 5, None): (50, 0), (1, 6, None): (20, 0)})
+        self.assertEqual(index.predict(1, 4), {(1, 5, None): 50, (1, 6, None): 20})
+
+    def test_signature_clears_presets(self):
+        # Registers from ct_bytes on are cleared, so is the second preset
+        self.client.handle_signature_update(1, 5, 0, 0, 0x43)
+        index = self.client.link_index
+        self.assertEqual(index.device_link_ids(1, 5), {3})
+        self.assertEqual(index.members(1, 4), {})
+
+    def test_plan_levels(self):
+        links, remaining = self.client.plan_levels({(1, 5, None): 100, (1, 6, None): 80, (1, 7, None): 10})
+        self.assertEqual(links, [(1, 3)])
+        self.assertEqual(remaining, {(1, 7, None): 10})
+        links, remaining = self.client.plan_levels({(1, 5, None): 100, (1, 6, None): 70})
+        self.assertEqual(links, [])
+        self.assertEqual(len(remaining), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
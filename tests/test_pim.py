@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+from binascii import hexlify
+
+from upb.client import UPBClient
+from upb.const import UpbReg
+from upb.util import cksum
+from tests.common import attach_pulse, sent_packets, settle
+
+
+def register_report(start, values):
+    """Return the PIM line reporting registers, values are followed by a checksum."""
+    data = bytes([start]) + values
+    return b'PR' + hexlify(data + bytes([cksum(data)])).upper()
+
+
+class PimReadTest(unittest.TestCase):
+
+    def test_read_range(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            pulse = attach_pulse(client)
+            self.assertIsNone(pulse.pim_mirror(0x00, 20))
+            read = asyncio.ensure_future(pulse.pim_read_range(0x00, 20))
+            await settle()
+            pulse.line_received(register_report(0x00, bytes(range(16))))
+            await settle()
+            pulse.line_received(register_report(0x10, bytes(range(16, 20))))
+            result = await asyncio.wait_for(read, 1)
+            return result, sent_packets(pulse.protocol), pulse
+
+        result, packets, pulse = asyncio.run(run())
+        self.assertEqual(result, bytes(range(20)))
+        self.assertEqual([packet[0:2] for packet in packets], [b'\x00\x10', b'\x10\x04'])
+        self.assertEqual(pulse.pim_mirror(0x04, 16), bytes(range(4, 20)))
+        self.assertIsNone(pulse.pim_mirror(0x10, 5))
+
+    def test_write_updates_mirror(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            pulse = attach_pulse(client)
+            write = asyncio.ensure_future(pulse.pim_memory_write(UpbReg.UPB_REG_PIMOPTIONS, 0x03))
+            await settle()
+            pulse.line_received(b'PA')
+            await asyncio.wait_for(write, 1)
+            return pulse
+
+        pulse = asyncio.run(run())
+        self.assertEqual(pulse.pim_mirror(UpbReg.UPB_REG_PIMOPTIONS, 1), b'\x03')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+from time import monotonic
+
+from upb.links import UPBLinkIndex
+from upb.poll import UPBPollScheduler
+
+
+class FakeDevice:
+
+    def __init__(self, network, device, links):
+        self.network_id = network
+        self.device_id = device
+        self.links = links
+
+    def link_presets(self):
+        return [(None, link, 100, 0) for link in self.links]
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.link_index = UPBLinkIndex()
+        self.is_connected = True
+        self.scheduler = None
+        self.levels = {}
+        self.polled = []
+
+    async def report_state(self, network, device, priority):
+        self.polled.append((network, device))
+        level = self.levels.get((network, device))
+        if level is None:
+            await asyncio.sleep(1)
+        self.scheduler.handle_state(network, device, None, level, 'report')
+        return [level]
+
+    async def report_link_state(self, network, link, priority):
+        self.polled.append((network, 'link', link))
+
+
+class UPBPollSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = FakeClient()
+        self.scheduler = UPBPollScheduler(self.client, min_interval=10, max_interval=80, staleness=900,
+                                          coalesce_window=5, timeout=0.05, loop=self.loop)
+        self.client.scheduler = self.scheduler
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_pop_due_skips_stale_entries(self):
+        for device in (1, 2, 3):
+            self.scheduler.add_device(1, device)
+        self.scheduler.remove_device(1, 3)
+        # Rescheduled entries leave their old heap entry behind
+        self.scheduler._schedule((1, 2), monotonic() + 100)
+        self.assertEqual(self.scheduler._pop_due(monotonic()), [(1, 1)])
+        self.assertEqual(self.scheduler._pop_due(monotonic() + 100), [(1, 2)])
+        self.assertEqual(self.scheduler.heap, [])
+
+    def test_plan_links(self):
+        for device, links in ((1, (7,)), (2, (7, 8)), (3, (8,)), (4, (7,))):
+            self.client.link_index.update_device(FakeDevice(1, device, links))
+        links, direct = self.scheduler._plan_links([(1, 1), (1, 2), (1, 3), (1, 5)])
+        # Link 8 covers as many due devices as link 7 but wakes none that are not due
+        self.assertEqual(links, [(1, 8, {(1, 2), (1, 3)})])
+        self.assertEqual(direct, [(1, 1), (1, 5)])
+
+    def test_interval_adapts(self):
+        self.scheduler.add_device(1, 1)
+        entry = self.scheduler.entries[(1, 1)]
+        self.client.levels[(1, 1)] = 0
+        for interval in (20, 40, 80, 80):
+            self.loop.run_until_complete(self.scheduler.poll([(1, 1)]))
+            self.assertEqual(entry.interval, interval)
+        self.client.levels[(1, 1)] = 100
+        self.loop.run_until_complete(self.scheduler.poll([(1, 1)]))
+        self.assertEqual(entry.interval, 40)
+        self.assertEqual(entry.changes, 1)
+        self.assertAlmostEqual(entry.due, monotonic() + 40, delta=1)
+
+    def test_no_reply_retries_on_min_interval(self):
+        self.scheduler.add_device(1, 1)
+        entry = self.scheduler.entries[(1, 1)]
+        entry.interval = 80
+        with self.assertLogs('upb.poll', level='WARNING'):
+            self.loop.run_until_complete(self.scheduler.poll([(1, 1)]))
+        self.assertEqual(entry.interval, 10)
+        self.assertEqual(self.scheduler.device_polls, 1)
+
+    def test_schedule_defers_poll(self):
+        self.scheduler.add_device(1, 1)
+        self.scheduler.handle_state(1, 1, None, 100, 'schedule')
+        entry = self.scheduler.entries[(1, 1)]
+        self.assertEqual(entry.levels, {None: 100})
+        self.assertEqual(self.scheduler._pop_due(monotonic()), [])
+        self.assertGreater(entry.due, monotonic() + 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
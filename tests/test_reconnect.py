@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from upb.const import PimCommand, UpbPriority
+from upb.core import UPBPulseCore, PacketSent
+from upb.util import encode_goto, encode_setuptime_request
+from tests.common import of_type, attach_pulse, sent_packets, settle
+
+
+class ReconnectTest(unittest.TestCase):
+
+    def test_active_command_requeued(self):
+        core = UPBPulseCore()
+        core.send(1, PimCommand.UPB_NETWORK_TRANSMIT, encode_goto(1, 5, 10))
+        core.send(2, PimCommand.UPB_NETWORK_TRANSMIT, encode_goto(1, 6, 10))
+        core.data_to_send()
+        core.connection_lost()
+        self.assertFalse(core.in_transaction)
+        self.assertEqual(core.queued(), 2)
+        core.send(3, PimCommand.UPB_PIM_READ, b'\x00\x01\xff', UpbPriority.URGENT)
+        self.assertEqual(core.data_to_send(), b'')
+        # Only urgent commands go out until the PIM is released
+        events = core.connection_made()
+        self.assertEqual([event.token for event in of_type(events, PacketSent)], [3])
+        self.assertEqual(core.data_to_send(), b'\x120001FF\r')
+        core.receive_line(b'PR0001FE')
+        self.assertEqual(core.data_to_send(), b'')
+        events = core.release()
+        self.assertEqual([event.token for event in of_type(events, PacketSent)], [1])
+
+    def test_stop_cancels_pending_requests(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None, queue_limits={UpbPriority.LOW: 1})
+            pulse = attach_pulse(client)
+            active = asyncio.ensure_future(client.get_setup_time(1, 5))
+            await settle()
+            queued = asyncio.ensure_future(pulse.send_packet(encode_goto(1, 6, 10), UpbPriority.LOW))
+            waiting = asyncio.ensure_future(pulse.send_packet(encode_goto(1, 7, 10), UpbPriority.LOW))
+            await settle()
+            self.assertEqual(sent_packets(pulse.protocol), [encode_setuptime_request(1, 5)])
+            client.stop()
+            await settle()
+            self.assertTrue(all(request.cancelled() for request in (active, queued, waiting)))
+            self.assertEqual(sent_packets(pulse.protocol), [encode_setuptime_request(1, 5)])
+            return pulse
+
+        pulse = asyncio.run(run())
+        self.assertEqual(pulse.core.queued(), 0)
+        self.assertFalse(pulse.core.in_transaction)
+        self.assertEqual(pulse.futures, {})
+        self.assertEqual(pulse.pending[UpbPriority.LOW], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from tests.common import switch_registers
+
+
+def named(room, name, firmware=(1, 0)):
+    registers = switch_registers()
+    registers[0x0a:0x0c] = bytes(firmware)
+    registers[0x20:0x20 + len(room)] = room
+    registers[0x30:0x30 + len(name)] = name
+    return registers
+
+
+class UPBDeviceRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = UPBClient('localhost', airtime_share=None, loop=self.loop)
+        self.registry = self.client.devices
+        self.client.handle_register_update(1, 5, 0, named(b'Kitchen', b'Lights'))
+        self.client.handle_register_update(1, 6, 0, named(b'Kitchen', b'Fan', (2, 1)))
+        self.client.handle_register_update(2, 5, 0, named(b'Garage', b'Lights'))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def keys(self, devices):
+        return [(device.network_id, device.device_id) for device in devices]
+
+    def test_find(self):
+        self.assertEqual(self.keys(self.registry.find(room='Kitchen')), [(1, 5), (1, 6)])
+        self.assertEqual(self.keys(self.registry.find(kind='Switch', name='Lights')), [(1, 5), (2, 5)])
+        self.assertEqual(self.keys(self.registry.find(network=2, room='Kitchen')), [])
+        self.assertEqual(len(self.registry.find()), 3)
+        self.assertEqual(sorted(self.registry.values('room')), ['Garage', 'Kitchen'])
+        with self.assertRaises(ValueError):
+            self.registry.find(colour='red')
+
+    def test_firmware_below(self):
+        self.assertEqual(self.keys(self.registry.firmware_below(2)), [(1, 5), (2, 5)])
+        self.assertEqual(self.keys(self.registry.firmware_below((2, 2))), [(1, 5), (1, 6), (2, 5)])
+
+    def test_reindex_on_register_update(self):
+        self.client.handle_register_update(1, 5, 0x20, b'Hall'.ljust(16, b'\x00'))
+        self.assertEqual(self.keys(self.registry.find(room='Kitchen')), [(1, 6)])
+        self.assertEqual(self.keys(self.registry.find(room='Hall')), [(1, 5)])
+        self.client.handle_register_update(1, 6, 0x20, b'Hall'.ljust(16, b'\x00'))
+        self.assertNotIn('Kitchen', self.registry.values('room'))
+
+    def test_registers_past_upbid_ignored(self):
+        indexed = dict(self.registry.indexed)
+        self.client.handle_register_update(1, 5, 0x40, bytes((3, 100, 2)))
+        self.assertEqual(self.registry.indexed, indexed)
+
+    def test_remove(self):
+        device = self.registry.remove(1, 5)
+        self.assertEqual((device.network_id, device.device_id), (1, 5))
+        self.assertNotIn((1, 5), self.registry)
+        self.assertEqual(self.keys(self.registry.find(name='Lights')), [(2, 5)])
+        self.assertIsNone(self.registry.remove(1, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from upb.client import UPBClient
+from upb.const import MdidSet, MdidDeviceControlCmd
+from upb.sink import UPBSQLiteSink
+from tests.common import frame
+
+
+def message(device):
+    return {'network_id': 1, 'device_id': device, 'destination_id': 7, 'link': False,
+            'mdid_set': MdidSet.MDID_DEVICE_CONTROL_COMMANDS,
+            'mdid_cmd': MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO,
+            'packet': frame(1, 7, device, 0x22, b'\x64')}
+
+
+class FailingSink(UPBSQLiteSink):
+    """Sink whose next failures writes raise, every write takes delay seconds."""
+
+    def __init__(self, path, failures=0, delay=0, **kwargs):
+        super().__init__(path, **kwargs)
+        self.failures = failures
+        self.delay = delay
+
+    def _write(self, messages, states, purge_before):
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            if self.db is None:
+                self._open()
+            raise sqlite3.OperationalError("database is locked")
+        super()._write(messages, states, purge_before)
+
+
+class UPBSQLiteSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'traffic.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rows(self, table):
+        with sqlite3.connect(self.path) as db:
+            return db.execute(f"SELECT * FROM {table}").fetchall()
+
+    def test_start_stop(self):
+        async def run():
+            client = UPBClient('localhost')
+            sink = UPBSQLiteSink(self.path, flush_interval=60)
+            sink.start(client)
+            client.router.dispatch(message(5), False)
+            client.handle_state_update(1, 5, None, 100, 'report')
+            await sink.stop()
+            self.assertEqual(len(client.router), 0)
+            self.assertEqual(client.state_callbacks, [])
+            return sink
+        sink = asyncio.run(run())
+        self.assertEqual(sink.written, 2)
+        self.assertIsNone(sink.db)
+        messages = self.rows('messages')
+        self.assertEqual(messages[0][1:], (1, 5, 7, 0, MdidSet.MDID_DEVICE_CONTROL_COMMANDS,
+                                            MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO, 0, frame(1, 7, 5, 0x22, b'\x64')))
+        self.assertEqual(self.rows('states')[0][1:], (1, 5, None, 100, 'report'))
+
+    def test_stop_during_failed_flush(self):
+        async def run():
+            client = UPBClient('localhost')
+            sink = FailingSink(self.path, failures=1, delay=0.1, flush_size=1)
+            sink.start(client)
+            client.router.dispatch(message(5), False)
+            # Let the run loop take the row and start writing it
+            await asyncio.sleep(0.02)
+            self.assertEqual(sink.messages, [])
+            with self.assertLogs('upb.sink', level='ERROR'):
+                await sink.stop()
+            return sink
+        sink = asyncio.run(run())
+        self.assertEqual(sink.written, 1)
+        self.assertEqual(len(self.rows('messages')), 1)
+
+    def test_requeue_drops_oldest(self):
+        async def run():
+            sink = FailingSink(self.path, failures=1, max_buffered=2)
+            for device in range(3):
+                sink.handle_message(message(device), False)
+            with self.assertRaises(sqlite3.Error), self.assertLogs('upb.sink', level='WARNING'):
+                await sink.flush()
+            self.assertEqual([row[2] for row in sink.messages], [1, 2])
+            self.assertEqual(sink.dropped, 1)
+            await sink.flush()
+            await sink.stop()
+            return sink
+        sink = asyncio.run(run())
+        self.assertEqual(sink.written, 2)
+        self.assertEqual([row[2] for row in self.rows('messages')], [1, 2])
+
+    def test_stop_closes_after_error(self):
+        async def run():
+            sink = FailingSink(self.path, failures=1)
+            sink.handle_message(message(5), False)
+            with self.assertRaises(sqlite3.Error):
+                await sink.stop()
+            return sink
+        sink = asyncio.run(run())
+        self.assertIsNone(sink.db)
+        self.assertEqual(len(sink.messages), 1)
+
+    def test_retention(self):
+        async def run():
+            sink = UPBSQLiteSink(self.path, retention=60)
+            sink.handle_message(message(5), False)
+            sink.messages[0] = (time.time() - 120,) + sink.messages[0][1:]
+            sink.handle_message(message(6), False)
+            await sink.stop()
+        asyncio.run(run())
+        self.assertEqual([row[2] for row in self.rows('messages')], [6])
+
+
+if __name__ == '__main__':
+    unittest.main()
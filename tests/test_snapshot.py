@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from upb.snapshot import UPBSnapshot, write_snapshot, read_snapshot, SNAPSHOT_HEADER
+from tests.common import switch_registers
+
+
+class UPBSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'network.upbs')
+        self.entries = [
+            {'network': 2, 'device': 1, 'id_checksum': None, 'setup_checksum': None, 'ct_bytes': None,
+             'registers': bytes(range(256))},
+            {'network': 1, 'device': 5, 'id_checksum': 0x1234, 'setup_checksum': 0x5678, 'ct_bytes': 0x43,
+             'registers': bytes(switch_registers((3, 100, 2)))},
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        write_snapshot(self.path, self.entries)
+        entries = read_snapshot(self.path)
+        self.assertEqual(list(entries), [(1, 5), (2, 1)])
+        self.assertEqual(entries[(2, 1)], self.entries[0])
+        self.assertEqual(entries[(1, 5)], self.entries[1])
+
+    def test_random_access(self):
+        write_snapshot(self.path, self.entries)
+        with UPBSnapshot(self.path) as snapshot:
+            self.assertEqual(len(snapshot), 2)
+            self.assertIn((2, 1), snapshot)
+            self.assertNotIn((2, 2), snapshot)
+            self.assertEqual(snapshot.get(1, 5)['ct_bytes'], 0x43)
+            self.assertIsNone(snapshot.get(1, 6))
+
+    def test_corrupt(self):
+        write_snapshot(self.path, self.entries)
+        with open(self.path, 'r+b') as snapshot:
+            snapshot.seek(SNAPSHOT_HEADER.size + 20)
+            snapshot.write(b'\xff')
+        with self.assertRaises(ValueError):
+            read_snapshot(self.path)
+
+    def test_invalid_file_closed(self):
+        for content in (b'UPB', b'JUNK' + bytes(SNAPSHOT_HEADER.size)):
+            with open(self.path, 'wb') as snapshot:
+                snapshot.write(content)
+            opened = []
+            real_open = open
+
+            def tracking_open(*args, **kwargs):
+                opened.append(real_open(*args, **kwargs))
+                return opened[-1]
+            with mock.patch('builtins.open', tracking_open), self.assertRaises(ValueError):
+                UPBSnapshot(self.path)
+            self.assertTrue(opened[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from upb.client import UPBClient
+from upb.store import UPBRegisterStore
+from tests.common import switch_registers
+
+
+class UPBRegisterStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'registers.upbr')
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        self.directory.cleanup()
+
+    def client(self, store):
+        return UPBClient('localhost', airtime_share=None, loop=self.loop, register_store=store)
+
+    def test_slots(self):
+        store = UPBRegisterStore()
+        registers = store.registers(2, 7)
+        registers[0:2] = b'\x02\x07'
+        self.assertEqual(store.devices(), [(2, 7)])
+        self.assertIsNone(store.signature(2, 7))
+        store.set_signature(2, 7, 0x1234, 0x5678, 0x90)
+        self.assertEqual(store.signature(2, 7), (0x1234, 0x5678, 0x90))
+        registers.release()
+        store.close()
+
+    def test_persists_across_clients(self):
+        client = self.client(UPBRegisterStore(self.path))
+        client.handle_register_update(1, 5, 0, switch_registers((3, 100, 2)))
+        client.handle_signature_update(1, 5, 0x1111, 0x2222, 0x80)
+        client.close_register_store()
+        self.assertIsNone(client.register_store)
+        # Registers stay usable after the store is closed
+        self.assertEqual(client.get_device(1, 5).registers[0x40:0x43], b'\x03\x64\x02')
+
+        client = self.client(UPBRegisterStore(self.path))
+        device = client.get_device(1, 5)
+        self.assertEqual(bytes(device.registers[2:]), bytes(switch_registers((3, 100, 2))[2:]))
+        self.assertEqual(client.register_store.signature(1, 5), (0x1111, 0x2222, 0x80))
+        self.assertEqual(client.link_index.members(1, 3), {(1, 5, None): (100, 2)})
+        client.close_register_store()
+
+    def test_close_with_attached_registers(self):
+        store = UPBRegisterStore(self.path)
+        client = self.client(store)
+        client.get_device(1, 5)
+        with self.assertRaises(BufferError):
+            store.close()
+        client.devices.detach_store()
+        store.close()
+        self.assertIsNone(store.fd)
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as store_file:
+            store_file.write(b'not a store')
+        with self.assertRaises(ValueError):
+            UPBRegisterStore(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
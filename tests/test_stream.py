@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+from upb.const import MdidSet, MdidDeviceControlCmd
+from upb.stream import UPBMessageStream, DROP_OLDEST, DROP_NEWEST, BLOCK
+from upb.subscribe import UPBSubscriptionRouter
+
+
+def message(device):
+    return {'network_id': 1, 'device_id': device, 'destination_id': 7, 'link': False,
+            'mdid_set': MdidSet.MDID_DEVICE_CONTROL_COMMANDS,
+            'mdid_cmd': MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO}
+
+
+async def collect(stream):
+    return [response['device_id'] async for response in stream]
+
+
+class UPBMessageStreamTest(unittest.TestCase):
+
+    def stream(self, policy, count, **kwargs):
+        async def run():
+            router = UPBSubscriptionRouter()
+            stream = UPBMessageStream(router, 2, policy, **kwargs)
+            for device in range(count):
+                router.dispatch(message(device), False)
+            router.dispatch(message(99), True)
+            stream.close()
+            self.assertEqual(len(router), 0)
+            return stream, await asyncio.wait_for(collect(stream), 1)
+        return asyncio.run(run())
+
+    def test_drop_oldest(self):
+        stream, received = self.stream(DROP_OLDEST, 5)
+        self.assertEqual(received, [3, 4])
+        self.assertEqual((stream.received, stream.dropped), (5, 3))
+
+    def test_drop_newest(self):
+        stream, received = self.stream(DROP_NEWEST, 5)
+        self.assertEqual(received, [0, 1])
+        self.assertEqual(stream.dropped, 3)
+
+    def test_block_is_bounded(self):
+        stream, received = self.stream(BLOCK, 7, overflow_size=3)
+        self.assertEqual(received, [0, 1, 2, 3, 4])
+        self.assertEqual((stream.blocked, stream.dropped), (3, 2))
+
+    def test_block_default_overflow(self):
+        stream, received = self.stream(BLOCK, 4)
+        self.assertEqual(received, [0, 1, 2, 3])
+        self.assertEqual(stream.dropped, 0)
+
+    def test_include_transmitted(self):
+        stream, received = self.stream(DROP_OLDEST, 1, include_transmitted=True)
+        self.assertEqual(received, [0, 99])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            UPBMessageStream(UPBSubscriptionRouter(), policy='wait')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from upb.client import UPBClient
+from upb.const import MdidSet, MdidDeviceControlCmd
+from upb.subscribe import UPBSubscriptionRouter
+from tests.common import frame, attach_pulse, sent_packets, receive, settle
+
+
+def message(device, destination, mdid_cmd=MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO, link=False):
+    return {'network_id': 1, 'device_id': device, 'destination_id': destination, 'link': link,
+            'mdid_set': MdidSet.MDID_DEVICE_CONTROL_COMMANDS, 'mdid_cmd': mdid_cmd}
+
+
+class UPBSubscriptionRouterTest(unittest.TestCase):
+
+    def test_filters(self):
+        router = UPBSubscriptionRouter()
+        calls = []
+
+        def subscriber(name):
+            return lambda response, transmitted: calls.append(name)
+        router.subscribe(subscriber('all'))
+        router.subscribe(subscriber('source'), network=1, source=5)
+        router.subscribe(subscriber('link'), link=7)
+        router.subscribe(subscriber('destination'), destination=7)
+        activate = (MdidSet.MDID_DEVICE_CONTROL_COMMANDS, MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_ACTIVATELINK)
+        router.subscribe(subscriber('mdid'), mdid=activate)
+        router.dispatch(message(5, 7), False)
+        self.assertEqual(sorted(calls), ['all', 'destination', 'source'])
+        calls.clear()
+        router.dispatch(message(6, 7, MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_ACTIVATELINK, link=True), False)
+        self.assertEqual(sorted(calls), ['all', 'link', 'mdid'])
+        with self.assertRaises(ValueError):
+            router.subscribe(subscriber('both'), destination=7, link=7)
+
+    def test_cancel(self):
+        router = UPBSubscriptionRouter()
+        calls = []
+        subscription = router.subscribe(lambda response, transmitted: calls.append(response), source=5)
+        other = router.subscribe(lambda response, transmitted: subscription.cancel(), source=5)
+        # Cancelling during a dispatch does not disturb it
+        router.dispatch(message(5, 7), False)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(subscription.active)
+        other.cancel()
+        self.assertEqual((len(router), router.index, router.masks), (0, {}, {}))
+
+    def test_subscriber_exception(self):
+        router = UPBSubscriptionRouter()
+        calls = []
+
+        def fail(response, transmitted):
+            raise RuntimeError("subscriber failed")
+        router.subscribe(fail)
+        router.subscribe(lambda response, transmitted: calls.append(response))
+        with self.assertLogs('upb.subscribe', level='ERROR'):
+            router.dispatch(message(5, 7), False)
+        self.assertEqual(len(calls), 1)
+
+    def test_subscriber_exception_does_not_block_request(self):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            pulse = attach_pulse(client)
+
+            def fail(*args):
+                raise RuntimeError("subscriber failed")
+            client.subscribe(fail)
+            client.state_callbacks.append(fail)
+            request = asyncio.ensure_future(client.get_signal_strength(1, 5))
+            await settle()
+            with self.assertLogs('upb', level='ERROR'):
+                receive(pulse, sent_packets(pulse.protocol)[-1], transmitted=True)
+                receive(pulse, frame(1, 0xff, 9, 0x86, b'\x40'), frame(1, 0xff, 5, 0x89, b'\x40'))
+            return await asyncio.wait_for(request, 1)
+
+        self.assertEqual(asyncio.run(run()), 0x40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import concurrent.futures
+import logging
+import socket
+import threading
+import unittest
+from binascii import hexlify, unhexlify
+
+from upb.const import PimCommand
+from upb.sync import UPBSyncClient
+from upb.util import cksum, encode_goto
+from tests.common import crumb_lines
+
+
+class FakePim:
+    """TCP server answering PIM commands like a PIM with blank registers, or not at all."""
+
+    def __init__(self, silent=False):
+        self.silent = silent
+        self.packets = []
+        self.closed = threading.Event()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def reply(self, line):
+        cmd, packet = line[0], unhexlify(line[1:])
+        self.packets.append((cmd, packet))
+        if cmd == PimCommand.UPB_PIM_READ:
+            data = bytes([packet[0]]) + bytes(packet[1])
+            return b'PR' + hexlify(data + bytes([cksum(data)])).upper() + b'\r'
+        if cmd == PimCommand.UPB_PIM_WRITE:
+            return b'PA\r'
+        return b'PA\r' + b'\r'.join(crumb_lines(packet, transmitted=True)) + b'\r'
+
+    def serve(self):
+        connection, address = self.server.accept()
+        buffer = b''
+        while True:
+            data = connection.recv(1024)
+            if not data:
+                break
+            lines = (buffer + data).split(b'\r')
+            buffer = lines.pop()
+            for line in lines:
+                if not self.silent:
+                    connection.sendall(self.reply(line))
+        connection.close()
+        self.server.close()
+        self.closed.set()
+
+
+class UPBSyncClientTest(unittest.TestCase):
+
+    def test_requests(self):
+        pim = FakePim()
+        with UPBSyncClient('127.0.0.1', pim.port, request_timeout=5, airtime_share=None) as client:
+            client.goto(1, 5, 50)
+            future = client.submit('goto', 1, 6, 20)
+            future.result(5)
+            self.assertEqual(client.run(lambda: client.client.is_connected), True)
+        self.assertTrue(pim.closed.wait(5))
+        self.assertEqual([packet for cmd, packet in pim.packets if cmd == PimCommand.UPB_NETWORK_TRANSMIT],
+                         [encode_goto(1, 5, 50), encode_goto(1, 6, 20)])
+
+    def test_connect_timeout_closes_connection(self):
+        pim = FakePim(silent=True)
+        with self.assertLogs('asyncio', level='DEBUG') as logs:
+            logging.getLogger('asyncio').debug('checking for destroyed tasks')
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                UPBSyncClient('127.0.0.1', pim.port, request_timeout=0.3, airtime_share=None)
+        self.assertTrue(pim.closed.wait(5))
+        self.assertFalse([line for line in logs.output if 'destroyed' in line and 'pending' in line])
+
+
+if __name__ == '__main__':
+    unittest.main()
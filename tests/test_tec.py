@@ -0,0 +1,206 @@
+import asyncio
+import unittest
+from datetime import date, datetime
+
+from upb.client import UPBClient
+from upb.register import TECFlash, TimedEvent
+from upb.tec import UPBTECSchedule, UPBTECEvaluator, UPBTimedEvent, TEC_FLASH_SIZE, decode_extended_registers
+from upb.util import encode_extended_register_request
+from tests.common import frame, attach_pulse, sent_packets, receive, settle, switch_registers
+
+
+def tec_flash():
+    flash = bytearray(TEC_FLASH_SIZE)
+    tec = TECFlash.from_buffer(flash)
+    tec.jan_1_sunrise_hours, tec.jan_1_sunrise_minutes = 7, 30
+    tec.jan_1_sunset_hours, tec.jan_1_sunset_minutes = 16, 45
+    # Sunrise one minute later and sunset one minute earlier on January 2
+    tec.suntime_table[1] = 0x1f
+    tec.dst_start_month, tec.dst_start_day, tec.dst_stop_month, tec.dst_stop_day = 3, 10, 11, 3
+    tec.dst_table[0].start_month, tec.dst_table[0].start_day = 3, 12
+    tec.dst_table[0].end_month, tec.dst_table[0].end_day = 11, 5
+    tec.dst_table[1].start_month, tec.dst_table[1].start_day = 10, 1
+    tec.dst_table[1].end_month, tec.dst_table[1].end_day = 4, 1
+    del tec
+    return flash
+
+
+def tec_registers(*events):
+    """Return the registers of a PCS TEC with (time1, time2, minute, vary, link, mdid) events."""
+    registers = bytearray(256)
+    registers[6:10] = b'\x00\x01\x00\x1a'
+    registers[0x47] = len(events)
+    for index, event in enumerate(events):
+        registers[0x48 + index * 8:0x4e + index * 8] = bytes(event)
+    return registers
+
+
+def register_report(network, device, address, values):
+    return frame(network, 0xff, device, 0x90, address.to_bytes(2, 'big') + values)
+
+
+class UPBTECScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = UPBTECSchedule(tec_flash())
+
+    def test_sun_times(self):
+        self.assertEqual(self.schedule.sun_times(date(2006, 1, 1)), (450, 1005))
+        self.assertEqual(self.schedule.sun_times(date(2006, 1, 2)), (451, 1004))
+        self.assertEqual(self.schedule.sun_times(date(2006, 2, 28)), (451, 1004))
+        # Shifted by an hour during DST
+        self.assertEqual(self.schedule.sun_times(date(2006, 7, 1)), (511, 1064))
+
+    def test_dst(self):
+        self.assertEqual(self.schedule.dst_days(2006), (71, 309))
+        self.assertFalse(self.schedule.is_dst(date(2006, 3, 11)))
+        self.assertTrue(self.schedule.is_dst(date(2006, 3, 12)))
+        self.assertFalse(self.schedule.is_dst(date(2006, 11, 5)))
+        # Southern hemisphere DST spans the new year
+        self.assertTrue(self.schedule.is_dst(date(2007, 12, 25)))
+        self.assertFalse(self.schedule.is_dst(date(2007, 6, 1)))
+        # Unset table entries have no DST, years past the table use the current dates
+        self.assertIsNone(self.schedule.dst_days(2008))
+        self.assertEqual(self.schedule.dst_days(2040), (69, 307))
+
+    def test_decode_extended_registers(self):
+        response = {'setup_register': 0x03, 'register_val': b'\x0f\x01\x02'}
+        self.assertEqual(decode_extended_registers(response), (0x30f, b'\x01\x02'))
+
+
+class ExtendedReadTest(unittest.TestCase):
+
+    def run_client(self, test):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            return await test(client, attach_pulse(client))
+        return asyncio.run(run())
+
+    def test_chunked_read(self):
+        async def test(client, pulse):
+            read = asyncio.ensure_future(client.read_extended_registers(1, 5, 0x300, 20))
+            await settle()
+            self.assertEqual(client.extended_reads, {(1, 5): 1})
+            for address, count in ((0x300, 15), (0x30f, 5)):
+                request = encode_extended_register_request(1, 5, address, count)
+                self.assertEqual(sent_packets(pulse.protocol)[-1], request)
+                receive(pulse, request, transmitted=True)
+                receive(pulse, register_report(1, 5, address, bytes(range(address & 0xff, (address & 0xff) + count))))
+                # The next chunk goes out on the following idle line
+                pulse.line_received(b'-')
+                await settle()
+            data = await asyncio.wait_for(read, 1)
+            self.assertEqual(client.extended_reads, {})
+            # The reports were not taken for registers at their first address byte
+            self.assertEqual(bytes(client.get_device(1, 5).registers[2:20]), bytes(18))
+            return data
+
+        self.assertEqual(self.run_client(test), bytes(range(20)))
+
+    def test_overlapping_reads(self):
+        async def test(client, pulse):
+            first = asyncio.ensure_future(client.read_extended_registers(1, 5, 0x300, 4))
+            second = asyncio.ensure_future(client.read_extended_registers(1, 5, 0x400, 4))
+            await settle()
+            self.assertEqual(client.extended_reads, {(1, 5): 2})
+            receive(pulse, sent_packets(pulse.protocol)[-1], transmitted=True)
+            receive(pulse, register_report(1, 5, 0x300, b'\x01\x02\x03\x04'))
+            self.assertEqual(await asyncio.wait_for(first, 1), b'\x01\x02\x03\x04')
+            # The other read still keeps reports out of the registers
+            self.assertEqual(client.extended_reads, {(1, 5): 1})
+            second.cancel()
+            await settle()
+            self.assertEqual(client.extended_reads, {})
+
+        self.run_client(test)
+
+    def test_failed_chunk_cancels_the_rest(self):
+        async def test(client, pulse):
+            read = asyncio.ensure_future(client.read_extended_registers(1, 5, 0x300, 30))
+            await settle()
+            self.assertEqual(pulse.core.queued(), 1)
+            next(iter(pulse.futures.values())).cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await asyncio.wait_for(read, 1)
+            await settle()
+            self.assertEqual((pulse.core.queued(), pulse.core.in_transaction), (0, False))
+            self.assertEqual(client.extended_reads, {})
+
+        self.run_client(test)
+
+
+class UPBTimedEventTest(unittest.TestCase):
+
+    def event(self, *fields):
+        return UPBTimedEvent(1, 9, 0, TimedEvent.from_buffer_copy(bytes(fields) + bytes(2)))
+
+    def test_clock_event(self):
+        # Weekdays at 7:30, 2026-10-16 is a Friday
+        event = self.event(0x3e, 7, 30, 0, 3, 0x20)
+        self.assertEqual(event.next_fire(datetime(2026, 10, 16, 8, 0)), datetime(2026, 10, 19, 7, 30))
+        self.assertEqual(event.next_fire(datetime(2026, 10, 19, 7, 0)), datetime(2026, 10, 19, 7, 30))
+        self.assertIsNone(self.event(0, 7, 30, 0, 3, 0x20).next_fire(datetime(2026, 10, 16)))
+
+    def test_sun_event(self):
+        # Every day 15 minutes before sunset
+        event = self.event(0x7f, 0xa0, 15, 0, 3, 0x20)
+        self.assertEqual(event.offset, -15)
+        schedule = UPBTECSchedule(tec_flash())
+        self.assertEqual(event.next_fire(datetime(2027, 1, 1, 12, 0), schedule), datetime(2027, 1, 1, 16, 30))
+        self.assertEqual(event.next_fire(datetime(2027, 1, 1, 17, 0), schedule), datetime(2027, 1, 2, 16, 29))
+        # Without the sun table of the controller it cannot be evaluated
+        self.assertIsNone(event.next_fire(datetime(2027, 1, 1, 12, 0)))
+
+
+class UPBTECEvaluatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2026, 10, 19, 7, 0)
+        self.states = []
+
+    def run_evaluator(self, test):
+        async def run():
+            client = UPBClient('localhost', airtime_share=None)
+            client.handle_register_update(1, 5, 0, switch_registers((3, 100, 2)))
+            client.handle_register_update(1, 9, 0, tec_registers((0x7f, 7, 30, 0, 3, 0x20),
+                                                                 (0x7f, 22, 0, 0, 3, 0x21)))
+            client.state_callbacks.append(lambda *args: self.states.append(args))
+            evaluator = UPBTECEvaluator(client, clock=lambda: self.now)
+            return await test(client, evaluator)
+        return asyncio.run(run())
+
+    def test_predict(self):
+        async def test(client, evaluator):
+            evaluator.add_controller(1, 9)
+            until = datetime(2026, 10, 20)
+            self.assertEqual([(fire, event.index) for fire, event in evaluator.upcoming(until)],
+                             [(datetime(2026, 10, 19, 7, 30), 0), (datetime(2026, 10, 19, 22, 0), 1)])
+            self.assertEqual(evaluator.predict(until), {(1, 5, None): (datetime(2026, 10, 19, 7, 30), 100)})
+            evaluator.remove_controller(1, 9)
+            self.assertEqual(evaluator.upcoming(until), [])
+            with self.assertRaises(ValueError):
+                evaluator.add_controller(1, 5)
+
+        self.run_evaluator(test)
+
+    def test_fire(self):
+        async def test(client, evaluator):
+            evaluator.add_controller(1, 9)
+            evaluator.start()
+            await settle()
+            self.assertEqual(evaluator.fired, 0)
+            self.now = datetime(2026, 10, 19, 22, 0)
+            evaluator.wakeup.set()
+            await settle()
+            evaluator.stop()
+            self.assertEqual(evaluator.fired, 2)
+            # Both events are scheduled again for the next day
+            self.assertEqual([fire for fire, event in evaluator.upcoming(datetime(2026, 10, 21))],
+                             [datetime(2026, 10, 20, 7, 30), datetime(2026, 10, 20, 22, 0)])
+
+        self.run_evaluator(test)
+        self.assertEqual(self.states, [(1, 5, None, 100, 'schedule'), (1, 5, None, 0, 'schedule')])
+
+
+if __name__ == '__main__':
+    unittest.main()
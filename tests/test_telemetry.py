@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+
+from upb.const import MdidSet, MdidCoreReport
+from upb.telemetry import UPBRingBuffer, UPBTelemetryTier, UPBTelemetrySampler
+
+
+class FakePulse:
+
+    def __init__(self, utilization):
+        self.utilization = utilization
+
+    def sample_utilization(self):
+        return self.utilization
+
+
+class FakeClient:
+
+    def __init__(self, utilization=0.0):
+        self.pulse = FakePulse(utilization)
+        self.message_callbacks = []
+        self.requests = []
+
+    async def get_signal_strength(self, network, device, priority):
+        self.requests.append(('signal', network, device))
+        return 40
+
+    async def get_noise_level(self, network, device, priority):
+        self.requests.append(('noise', network, device))
+        return 3
+
+
+def report(device, mdid_cmd, **values):
+    return dict(network_id=1, device_id=device, mdid_set=MdidSet.MDID_CORE_REPORTS, mdid_cmd=mdid_cmd, **values)
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_wraparound(self):
+        ring = UPBRingBuffer(3)
+        for value in range(2):
+            ring.append(value)
+        self.assertEqual(ring.values(), [0, 1])
+        for value in range(2, 5):
+            ring.append(value)
+        self.assertEqual(ring.values(), [2, 3, 4])
+        self.assertEqual(len(ring), 3)
+
+    def test_tier(self):
+        tier = UPBTelemetryTier(60, 2)
+        for timestamp, value in ((0, 1), (30, 3), (60, 5), (125, 7), (130, 9)):
+            tier.add(timestamp, value)
+        self.assertEqual(tier.samples(), [(0, 1, 3, 2), (60, 5, 5, 5), (120, 7, 9, 8)])
+        tier.add(200, 1)
+        # Only the two newest stored periods are kept
+        self.assertEqual([sample[0] for sample in tier.samples()], [60, 120, 180])
+
+
+class UPBTelemetrySamplerTest(unittest.TestCase):
+
+    def test_handle_message(self):
+        async def run():
+            sampler = UPBTelemetrySampler(FakeClient())
+            sampler.handle_message(report(5, MdidCoreReport.MDID_DEVICE_CORE_REPORT_SIGNALSTRENGTH,
+                                          signal_strength=40), False)
+            sampler.handle_message(report(5, MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESIGNATURE,
+                                          device_signal=42, device_noise=2), False)
+            sampler.handle_message(report(6, MdidCoreReport.MDID_DEVICE_CORE_REPORT_NOISELEVEL,
+                                          noise_level=9), True)
+            return sampler.series
+
+        series = asyncio.run(run())
+        self.assertEqual(set(series), {(1, 5, 'signal'), (1, 5, 'noise')})
+        self.assertEqual([value for timestamp, value in series[(1, 5, 'signal')].samples()], [40, 42])
+
+    def test_sample_device(self):
+        async def run():
+            client = FakeClient()
+            sampler = UPBTelemetrySampler(client, airtime_share=1.0)
+            await asyncio.wait_for(sampler.sample_device(1, 5), 1)
+            return client.requests
+
+        self.assertEqual(asyncio.run(run()), [('signal', 1, 5), ('noise', 1, 5)])
+
+    def test_busy_line_gives_up(self):
+        async def run():
+            client = FakeClient(utilization=1.0)
+            sampler = UPBTelemetrySampler(client, interval=1, quiet_timeout=0.05)
+            with self.assertLogs('upb.telemetry', level='WARNING'):
+                await asyncio.wait_for(sampler.sample_device(1, 5), 1)
+            return client.requests
+
+        self.assertEqual(asyncio.run(run()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from upb.const import UpbTraceEvent
+from upb.trace import UPBTraceRecorder
+
+
+class UPBTraceRecorderTest(unittest.TestCase):
+
+    def test_maxlen_keeps_newest(self):
+        recorder = UPBTraceRecorder(maxlen=3)
+        for txn in range(5):
+            recorder(UpbTraceEvent.PULSE_ENQUEUE, float(txn), txn, None)
+        self.assertEqual([txn for event, timestamp, txn in recorder.events], [2, 3, 4])
+        recorder.clear()
+        self.assertEqual(len(recorder.events), 0)
+
+    def test_timelines_and_folded(self):
+        recorder = UPBTraceRecorder()
+        recorder(UpbTraceEvent.PULSE_ENQUEUE, 1.0, 1, None)
+        recorder(UpbTraceEvent.PULSE_DECODED, 1.2, None, None)
+        recorder(UpbTraceEvent.PULSE_WRITE, 1.5, 1, None)
+        recorder(UpbTraceEvent.PULSE_RESOLVED, 2.0, 1, None)
+        timeline = recorder.timelines()[(0x00, 1)]
+        self.assertEqual([event for event, timestamp in timeline],
+                         [UpbTraceEvent.PULSE_ENQUEUE, UpbTraceEvent.PULSE_WRITE, UpbTraceEvent.PULSE_RESOLVED])
+        self.assertEqual(recorder.folded().splitlines(),
+                         ['PULSE_ENQUEUE;PULSE_WRITE 500000', 'PULSE_WRITE;PULSE_RESOLVED 500000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
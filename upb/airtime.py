@@ -0,0 +1,122 @@
+"""
+Powerline airtime estimation and transmit budgeting
+"""
+
+import asyncio
+import heapq
+from time import monotonic
+
+from upb.const import UpbPriority
+
+# Pulse position modulation carries two bits per half cycle of a 60Hz line
+UPB_BIT_RATE = 240.0
+# Preamble and start code ahead of every packet
+FRAME_OVERHEAD_BITS = 12
+# Acknowledgement pulse slot and minimum idle gap after every packet
+FRAME_GAP_BITS = 20
+# Number of times a repeater retransmits each copy for each repeater request
+REPEATER_COPIES = {0: 0, 1: 1, 2: 2, 3: 4}
+
+
+def packet_airtime(packet):
+    """Estimate the seconds of line time a transmit packet occupies."""
+    packet_len = packet[0] & 0x1f
+    repeater = (packet[0] >> 5) & 0x03
+    transmit_cnt = (packet[1] >> 2) & 0x03
+    frame_bits = FRAME_OVERHEAD_BITS + packet_len * 8 + FRAME_GAP_BITS
+    copies = (transmit_cnt + 1) * (1 + REPEATER_COPIES[repeater])
+    return copies * frame_bits / UPB_BIT_RATE
+
+
+class UPBAirtimeBudget:
+    """Token bucket of transmit airtime.
+
+    The bucket refills with share seconds of airtime per second and holds at
+    most burst seconds, so sustained traffic is limited to share of the line.
+    Waiters are served by UpbPriority and then in arrival order, so urgent
+    commands are never stuck behind low priority traffic.
+    """
+
+    def __init__(self, share=0.5, burst=5.0, loop=None):
+        if loop:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+        self.share = share
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.waiters = []
+        self.waiter_count = 0
+        self.timer = None
+        self.airtime_used = 0.0
+        self.throttled = 0.0
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.share)
+        self.updated = now
+
+    def try_acquire(self, airtime):
+        """Take airtime from the bucket if it is available now."""
+        self._refill()
+        # Packets larger than the whole bucket are let through once it is full
+        if self.tokens >= min(airtime, self.burst):
+            self.tokens -= airtime
+            self.airtime_used += airtime
+            return True
+        return False
+
+    async def acquire(self, airtime, priority=UpbPriority.NORMAL):
+        """Wait until airtime is available and take it."""
+        if not self.waiters and self.try_acquire(airtime):
+            return
+        fut = self.loop.create_future()
+        self.waiter_count += 1
+        heapq.heappush(self.waiters, (priority, self.waiter_count, airtime, fut))
+        if self.waiters[0][3] is fut:
+            self._wake()
+        try:
+            await fut
+        finally:
+            if fut.cancelled():
+                # Cancelled waiters are dropped when they reach the head
+                self._wake()
+
+    def _wake(self):
+        """Grant airtime to waiters in priority order and wait for the next refill."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.waiters:
+            priority, count, airtime, fut = self.waiters[0]
+            if fut.done():
+                heapq.heappop(self.waiters)
+            elif self.try_acquire(airtime):
+                heapq.heappop(self.waiters)
+                fut.set_result(None)
+            else:
+                delay = (min(airtime, self.burst) - self.tokens) / self.share
+                self.throttled += delay
+                self.timer = self.loop.call_later(delay, self._wake)
+                return
+
+
+class UPBLineUsage:
+    """Estimate line utilization from the PIM idle and busy line counters."""
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self.idle_lines = 0
+        self.busy_lines = 0
+        self.utilization = 0.0
+
+    def update(self, idle_lines, busy_lines):
+        idle = idle_lines - self.idle_lines
+        busy = busy_lines - self.busy_lines
+        self.idle_lines = idle_lines
+        self.busy_lines = busy_lines
+        if idle + busy > 0:
+            sample = busy / (idle + busy)
+            self.utilization += self.smoothing * (sample - self.utilization)
+        return self.utilization
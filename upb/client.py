@@ -1,12 +1,24 @@
 import asyncio
 import logging
 from pprint import pformat
-from collections import defaultdict
 from struct import unpack
-from upb.const import UpbReg
+from time import monotonic
+from upb.airtime import UPBAirtimeBudget
+from upb.const import UpbReg, UpbPriority, MdidSet, MdidDeviceControlCmd, MdidCoreReport
 from upb.pulse import UPBPulse
-from upb.util import cksum, hexdump, encode_register_request, encode_signature_request, encode_startsetup_request, encode_setuptime_request
-from upb.device import UPBDevice
+from upb.util import cksum, hexdump, encode_register_request, encode_signature_request, encode_startsetup_request, encode_setuptime_request, \
+    encode_activate_link, encode_deactivate_link, encode_goto, encode_fade_start, encode_fade_stop, encode_blink, \
+    encode_report_state, encode_signal_strength_request, encode_noise_level_request, encode_device_status_request, \
+    encode_extended_register_request
+from upb.registry import UPBDeviceRegistry
+from upb.snapshot import write_snapshot, read_snapshot
+from upb.tec import UPBTECSchedule, UPBTECEvaluator, TEC_FLASH_START, TEC_FLASH_SIZE, TEC_FLASH_RANGES, EXTENDED_READ_MAX, decode_extended_registers
+from upb.history import UPBMessageHistory
+from upb.links import UPBLinkIndex
+from upb.memory import UPBKindTEC
+from upb.poll import UPBPollScheduler
+from upb.subscribe import UPBSubscriptionRouter
+from upb.stream import UPBMessageStream, DROP_OLDEST
 from upb.proto.tcp_socket import UPBTCPProto
 from upb.proto.pulseworx_gateway import PulseworxGatewayProto
 
@@ -15,7 +27,9 @@ class UPBClient:
     def __init__(self, host, port=2101, disconnect_callback=None,
                  reconnect_callback=None, loop=None, logger=None,
                  timeout=10, reconnect_interval=10,
-                 username=None, password=None):
+                 username=None, password=None, trace_callback=None,
+                 airtime_share=0.5, airtime_burst=5.0, cache_ttl=0, queue_limits=None,
+                 history_size=0, register_store=None):
         """Initialize the UPB client wrapper."""
         if loop:
             self.loop = loop
@@ -38,7 +52,32 @@ class UPBClient:
         self.reconnect_interval = reconnect_interval
         self.disconnect_callback = disconnect_callback
         self.reconnect_callback = reconnect_callback
-        self.devices = defaultdict(dict)
+        self.trace_callback = trace_callback
+        if airtime_share is not None:
+            self.airtime_budget = UPBAirtimeBudget(airtime_share, airtime_burst, loop=self.loop)
+        else:
+            self.airtime_budget = None
+        self.register_store = register_store
+        self.devices = UPBDeviceRegistry(self, logger=self.logger, store=register_store)
+        self.link_index = UPBLinkIndex()
+        self.state_callbacks = []
+        self.message_callbacks = []
+        self.router = UPBSubscriptionRouter(logger=self.logger)
+        if history_size:
+            self.history = UPBMessageHistory(history_size)
+        else:
+            self.history = None
+        self.poller = None
+        self.tec_evaluator = None
+        self.reconnect_task = None
+        self.queue_limits = queue_limits
+        self.inflight = {}
+        self.cache_ttl = cache_ttl
+        self.response_cache = {}
+        self.extended_reads = {}
+        self.tec_schedules = {}
+        if register_store is not None:
+            self.load_register_store()
         if self.username is not None and self.password is not None:
             self.proto_type = "pulseworx_gateway"
         else:
@@ -46,19 +85,27 @@ class UPBClient:
 
     async def setup(self):
         """Set up the connection with automatic retry."""
-        while True:
+        if self.pulse is None:
+            # The pulse and its queue outlive connections, requests survive a reconnect
             self.pulse = UPBPulse(
                 register_callback=self.handle_register_update,
                 signature_callback=self.handle_signature_update,
-                disconnect_callback=self.handle_disconnect_callback,
+                disconnect_callback=self.handle_connection_lost,
+                trace_callback=self.trace_callback,
+                message_callback=self.handle_message,
+                airtime_budget=self.airtime_budget,
+                queue_limits=self.queue_limits,
+                packet_callback=self.handle_packet,
                 logger=self.logger)
+        while True:
             self.logger.info(f"proto_type: {self.proto_type}")
             if self.proto_type == "pulseworx_gateway":
                 fut = self.loop.create_connection(
                     lambda: PulseworxGatewayProto(
                         self.pulse,
                         username=self.username, password=self.password,
-                        loop=self.loop, logger=self.logger),
+                        loop=self.loop, logger=self.logger,
+                        trace_callback=self.trace_callback),
                     host=self.host,
                     port=self.port)
             elif self.proto_type == "tcp_socket":
@@ -83,31 +130,52 @@ class UPBClient:
                 await self.pim_init()
                 if self.proto_type == "pulseworx_gateway":
                     await self.protocol.client_start_pulse()
+                self.pulse.release()
                 if self.reconnect_callback:
                     self.reconnect_callback()
                 break
             await asyncio.sleep(self.reconnect_interval)
 
     async def pim_init(self):
+        # Network, product, firmware and serial number identify the PIM
+        identity = self.pulse.pim_mirror(UpbReg.UPB_REG_NETWORKID, UpbReg.UPB_REG_NETWORKNAME)
+        mode = self.pulse.pim_mirror(UpbReg.UPB_REG_PIMOPTIONS, 1)
+        if identity is not None and mode is not None:
+            # Reconnecting to the same PIM in the same mode needs no init
+            current = await self.pulse.pim_read_range(UpbReg.UPB_REG_NETWORKID, UpbReg.UPB_REG_NETWORKNAME, priority=UpbPriority.URGENT)
+            if current == identity and \
+                    await self.pulse.pim_read_range(UpbReg.UPB_REG_PIMOPTIONS, 1, priority=UpbPriority.URGENT) == mode:
+                self.logger.debug("PIM unchanged, skipping init")
+                return
         pim_info = await self.pim_info()
         self.logger.debug(pformat(pim_info))
         result = await self.pim_set_mode()
 
     async def pim_info(self):
+        """Read the PIM identity, options and noise floor in three range reads."""
+        await self.pulse.pim_read_range(UpbReg.UPB_REG_NETWORKID, UpbReg.UPB_REG_NETWORKNAME, priority=UpbPriority.URGENT)
+        await self.pulse.pim_read_range(UpbReg.UPB_REG_PIMOPTIONS, 1, priority=UpbPriority.URGENT)
+        await self.pulse.pim_read_range(UpbReg.UPB_REG_SIGNALSTRENGTH, 3, priority=UpbPriority.URGENT)
+        return self.pim_decode_info()
+
+    def pim_decode_info(self):
+        """Decode PIM information from the register mirror."""
+        mirror = self.pulse.pim_registers
         info = {}
-        info['firmware_version'] = await self.pim_get_firmware_version()
-        info['mode'] = await self.pim_get_mode()
-        info['manufacturer'] = await self.pim_get_manufacturer()
-        info['network'] = await self.pim_get_network()
-        info['product'] = await self.pim_get_product()
-        info['options'] = await self.pim_get_options()
+        info['firmware_version'] = bytes(mirror[UpbReg.UPB_REG_FIRMWAREVERSION:UpbReg.UPB_REG_FIRMWAREVERSION + 2])
+        info['mode'] = mirror[UpbReg.UPB_REG_PIMOPTIONS]
+        info['manufacturer'] = bytes(mirror[UpbReg.UPB_REG_MANUFACTURERID:UpbReg.UPB_REG_MANUFACTURERID + 2])
+        info['network'] = bytes(mirror[UpbReg.UPB_REG_NETWORKID:UpbReg.UPB_REG_NETWORKID + 1])
+        info['product'] = bytes(mirror[UpbReg.UPB_REG_PRODUCTID:UpbReg.UPB_REG_PRODUCTID + 2])
+        info['serial_number'] = bytes(mirror[UpbReg.UPB_REG_SERIALNUMBER:UpbReg.UPB_REG_NETWORKNAME])
+        info['options'] = mirror[UpbReg.UPB_REG_UPBOPTIONS]
         info['pulse'] = (info['options'] & 0x02) == 0
-        info['upb_version'] = await self.pim_get_upb_version()
-        info['noisefloor'] = await self.pim_get_noisefloor()
+        info['upb_version'] = mirror[UpbReg.UPB_REG_UPBVERSION]
+        info['noisefloor'] = mirror[UpbReg.UPB_REG_NOISEFLOOR]
         return info
 
     async def pim_set_mode(self):
-        mode = await self.pulse.pim_memory_write(UpbReg.UPB_REG_PIMOPTIONS, 0xf0)
+        mode = await self.pulse.pim_memory_write(UpbReg.UPB_REG_PIMOPTIONS, 0xf0, priority=UpbPriority.URGENT)
         return mode
 
     async def pim_get_firmware_version(self):
@@ -138,32 +206,178 @@ class UPBClient:
         upb_version = await self.pulse.pim_memory_read(UpbReg.UPB_REG_UPBVERSION)
         return upb_version[0]
 
-    async def pim_get_noisefloor(self):
-        noisefloor = await self.pulse.pim_memory_read(UpbReg.UPB_REG_NOISEFLOOR)
+    async def pim_get_noisefloor(self, priority=UpbPriority.NORMAL):
+        noisefloor = await self.pulse.pim_memory_read(UpbReg.UPB_REG_NOISEFLOOR, priority)
         return noisefloor[0]
 
     def stop(self):
         """Shut down transport."""
         self.reconnect = False
         self.logger.debug("Shutting down.")
+        self.stop_polling()
+        self.stop_tec_evaluator()
+        if self.pulse is not None:
+            self.pulse.stop()
         if self.transport:
             self.transport.close()
 
+    def subscribe(self, callback, network=None, source=None, destination=None, link=None, mdid=None):
+        """Call callback(response, transmitted) for decoded messages matching the filters."""
+        return self.router.subscribe(callback, network, source, destination, link, mdid)
+
+    def messages(self, maxsize=256, policy=DROP_OLDEST, include_transmitted=False,
+                 network=None, source=None, destination=None, link=None, mdid=None, overflow_size=None):
+        """Return an async iterator of decoded messages matching the filters."""
+        return UPBMessageStream(self.router, maxsize, policy, include_transmitted,
+                                network, source, destination, link, mdid, overflow_size)
+
+    def start_polling(self, devices, **kwargs):
+        """Poll device state with adaptive per-device intervals."""
+        self.stop_polling()
+        self.poller = UPBPollScheduler(self, loop=self.loop, logger=self.logger, **kwargs)
+        for network, device in devices:
+            self.poller.add_device(network, device)
+        self.poller.start()
+        return self.poller
+
+    def stop_polling(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+
+    def start_tec_evaluator(self, controllers=None, **kwargs):
+        """Predict device states from the event tables of timed event controllers."""
+        self.stop_tec_evaluator()
+        if controllers is None:
+            controllers = [(device.network_id, device.device_id) for device in self.devices
+                           if device.product in UPBKindTEC]
+        self.tec_evaluator = UPBTECEvaluator(self, loop=self.loop, logger=self.logger, **kwargs)
+        for network, device in controllers:
+            self.tec_evaluator.add_controller(network, device)
+        self.tec_evaluator.start()
+        return self.tec_evaluator
+
+    def stop_tec_evaluator(self):
+        if self.tec_evaluator is not None:
+            self.tec_evaluator.stop()
+            self.tec_evaluator = None
+
+    def load_register_store(self):
+        """Add the devices already held in the register store."""
+        for network, device_id in self.register_store.devices():
+            device = self.get_device(network, device_id)
+            signature = self.register_store.signature(network, device_id)
+            if signature is not None:
+                device.id_checksum, device.setup_checksum, device.ct_bytes = signature
+            self.devices.update_device(device)
+            self.link_index.update_device(device)
+
+    def close_register_store(self):
+        """Keep device registers in memory and close the register store."""
+        if self.register_store is not None:
+            self.devices.detach_store()
+            self.register_store.close()
+            self.register_store = None
+
+    def save_snapshot(self, path):
+        """Write signatures and registers of all known devices to a snapshot file."""
+        write_snapshot(path, [{
+            'network': device.network_id,
+            'device': device.device_id,
+            'id_checksum': device.id_checksum,
+            'setup_checksum': device.setup_checksum,
+            'ct_bytes': device.ct_bytes,
+            'registers': device.registers
+        } for device in self.devices])
+
+    def load_snapshot(self, path):
+        """Add the devices of a snapshot file."""
+        entries = read_snapshot(path)
+        for (network, device), entry in entries.items():
+            if entry['ct_bytes'] is not None:
+                self.handle_signature_update(network, device, entry['id_checksum'],
+                                             entry['setup_checksum'], entry['ct_bytes'])
+            self.handle_register_update(network, device, 0, entry['registers'])
+        return len(entries)
+
     def get_device(self, network_id, device_id):
-        if self.devices.get(network_id, {}).get(device_id, None) is None:
-            self.devices[network_id][device_id] = \
-                UPBDevice(self, network_id, device_id, logger=self.logger)
-        return self.devices[network_id][device_id]
+        return self.devices.get_or_create(network_id, device_id)
 
     def handle_register_update(self, network_id, device_id, position, data):
         """Receive register update."""
+        if (network_id, device_id) in self.extended_reads:
+            # Reports of extended reads start with a two byte address
+            return
         device = self.get_device(network_id, device_id)
         device.update_registers(position, data)
+        self.devices.update_device(device, position, position + len(data))
+        self.link_index.update_device(device, position, position + len(data))
 
     def handle_signature_update(self, network_id, device_id, id_checksum, setup_checksum, ct_bytes):
         """Receive register signature update."""
         device = self.get_device(network_id, device_id)
         device.update_signature(id_checksum, setup_checksum, ct_bytes)
+        if self.register_store is not None:
+            self.register_store.set_signature(network_id, device_id, id_checksum, setup_checksum, ct_bytes)
+        # Registers past ct_bytes were cleared
+        self.devices.update_device(device, ct_bytes, 256)
+        self.link_index.update_device(device, ct_bytes, 256)
+
+    def handle_packet(self, packet, transmitted):
+        if self.history is not None:
+            self.history.add(packet, transmitted)
+
+    def handle_message(self, response, transmitted):
+        """Track device state from decoded messages."""
+        for callback in self.message_callbacks:
+            try:
+                callback(response, transmitted)
+            except Exception:
+                self.logger.exception(f"message callback {callback!r} failed")
+        self.router.dispatch(response, transmitted)
+        network = response['network_id']
+        mdid_cmd = response['mdid_cmd']
+        if response['mdid_set'] == MdidSet.MDID_DEVICE_CONTROL_COMMANDS:
+            if response['link']:
+                link = response['destination_id']
+                if mdid_cmd == MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_ACTIVATELINK:
+                    predicted = self.link_index.predict(network, link)
+                elif mdid_cmd == MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_DEACTIVATELINK:
+                    predicted = dict.fromkeys(self.link_index.members(network, link), 0)
+                elif mdid_cmd == MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO and response['data']:
+                    predicted = dict.fromkeys(self.link_index.members(network, link), response['data'][0])
+                else:
+                    return
+                for (network, device, channel), level in predicted.items():
+                    self.handle_state_update(network, device, channel, level, 'link')
+            elif mdid_cmd == MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO and response['data']:
+                data = response['data']
+                channel = data[2] if len(data) > 2 else None
+                self.handle_state_update(network, response['destination_id'], channel, data[0], 'command')
+        elif response['mdid_set'] == MdidSet.MDID_CORE_REPORTS and \
+                mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESTATE:
+            levels = response['levels']
+            if len(levels) == 1:
+                self.handle_state_update(network, response['device_id'], None, levels[0], 'report')
+            else:
+                for channel, level in enumerate(levels, 1):
+                    self.handle_state_update(network, response['device_id'], channel, level, 'report')
+
+    def handle_state_update(self, network_id, device_id, channel, level, source):
+        """Receive a reported or predicted device level."""
+        device = self.get_device(network_id, device_id)
+        device.levels[channel] = level
+        for callback in self.state_callbacks:
+            try:
+                callback(network_id, device_id, channel, level, source)
+            except Exception:
+                self.logger.exception(f"state callback {callback!r} failed")
+
+    def handle_connection_lost(self):
+        if self.reconnect_task is not None and not self.reconnect_task.done():
+            # Lost again while reconnecting, start over on a fresh connection
+            self.reconnect_task.cancel()
+        self.reconnect_task = asyncio.ensure_future(self.handle_disconnect_callback())
 
     async def handle_disconnect_callback(self):
         """Reconnect automatically unless stopping."""
@@ -174,32 +388,169 @@ class UPBClient:
             self.logger.debug("Protocol disconnected...reconnecting")
             await self.setup()
 
+    async def _coalesce(self, key, request, ttl=0):
+        """Share one in-flight request between concurrent identical callers."""
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            if cached[0] > monotonic():
+                return cached[1]
+            del self.response_cache[key]
+        waiters = self.inflight.get(key)
+        if waiters is None:
+            fut = asyncio.ensure_future(request())
+            waiters = self.inflight[key] = [fut, 0]
+            fut.add_done_callback(lambda fut: self._coalesce_done(key, waiters, ttl))
+        fut = waiters[0]
+        waiters[1] += 1
+        try:
+            # A caller giving up must not cancel the request for the others
+            return await asyncio.shield(fut)
+        finally:
+            waiters[1] -= 1
+            if waiters[1] == 0 and not fut.done():
+                # The last caller gave up, take the request out of the PIM queue
+                if self.inflight.get(key) is waiters:
+                    del self.inflight[key]
+                fut.cancel()
+
+    def _coalesce_done(self, key, waiters, ttl):
+        fut = waiters[0]
+        if self.inflight.get(key) is waiters:
+            del self.inflight[key]
+        if ttl > 0 and not fut.cancelled() and fut.exception() is None:
+            self.response_cache[key] = (monotonic() + ttl, fut.result())
+
+    def invalidate_cache(self, network, device):
+        """Drop cached responses of a device."""
+        for key in [key for key in self.response_cache if key[0:2] == (network, device)]:
+            del self.response_cache[key]
+
     async def update_signature(self, network, device):
         """Fetch register signature from device."""
-        packet = encode_signature_request(network, device)
-        response = await self.pulse.send_packet(packet)
-        return response['id_checksum'], response['setup_checksum'], response['ct_bytes']
+        async def request():
+            packet = encode_signature_request(network, device)
+            response = await self.pulse.send_packet(packet)
+            return response['id_checksum'], response['setup_checksum'], response['ct_bytes']
+        return await self._coalesce((network, device, 'signature'), request, self.cache_ttl)
 
     async def get_setup_time(self, network, device):
-        packet = encode_setuptime_request(network, device)
-        response = await self.pulse.send_packet(packet)
-        return response
+        async def request():
+            packet = encode_setuptime_request(network, device)
+            return await self.pulse.send_packet(packet)
+        return await self._coalesce((network, device, 'setuptime'), request, self.cache_ttl)
+
+    async def report_link_state(self, network, link, priority=UpbPriority.NORMAL):
+        """Ask every device in a link to report its state."""
+        packet = encode_report_state(network, link, link=True)
+        await self.pulse.send_packet(packet, priority)
+
+    async def get_device_status(self, network, device, priority=UpbPriority.NORMAL):
+        packet = encode_device_status_request(network, device)
+        response = await self.pulse.send_packet(packet, priority)
+        return response['data']
+
+    async def get_signal_strength(self, network, device, priority=UpbPriority.NORMAL):
+        packet = encode_signal_strength_request(network, device)
+        response = await self.pulse.send_packet(packet, priority)
+        return response['signal_strength']
+
+    async def get_noise_level(self, network, device, priority=UpbPriority.NORMAL):
+        packet = encode_noise_level_request(network, device)
+        response = await self.pulse.send_packet(packet, priority)
+        return response['noise_level']
 
     async def test_password(self, network, device, password):
         packet = encode_startsetup_request(network, device, password)
         response = await self.pulse.send_packet(packet)
         assert(response['password'] == password)
+        # Setup mode has just changed, a cached setup time is stale
+        self.invalidate_cache(network, device)
         setup_time = await self.get_setup_time(network, device)
         if setup_time['setup_mode_timer'] != 0:
             return True
         return False
 
-    async def update_registers(self, network, device):
+    async def activate_link(self, network, link):
+        """Activate a link, all devices in it go to their preset levels."""
+        packet = encode_activate_link(network, link)
+        await self.pulse.send_packet(packet)
+
+    async def deactivate_link(self, network, link):
+        packet = encode_deactivate_link(network, link)
+        await self.pulse.send_packet(packet)
+
+    async def goto(self, network, device, level, rate=None, channel=None, link=False):
+        """Set a device or link to a level."""
+        packet = encode_goto(network, device, level, rate, channel, link)
+        await self.pulse.send_packet(packet)
+
+    async def fade_start(self, network, device, level, rate=None, channel=None, link=False):
+        packet = encode_fade_start(network, device, level, rate, channel, link)
+        await self.pulse.send_packet(packet)
+
+    async def fade_stop(self, network, device, link=False):
+        packet = encode_fade_stop(network, device, link)
+        await self.pulse.send_packet(packet)
+
+    async def blink(self, network, device, rate, channel=None, link=False):
+        packet = encode_blink(network, device, rate, channel, link)
+        await self.pulse.send_packet(packet)
+
+    async def report_state(self, network, device, priority=UpbPriority.NORMAL):
+        """Fetch the current channel levels of a device."""
+        packet = encode_report_state(network, device)
+        response = await self.pulse.send_packet(packet, priority)
+        return response['levels']
+
+    def plan_levels(self, levels, rate=None):
+        """Split requested levels into link activations and remaining direct commands.
+
+        levels maps (network, device, channel) to a level, channel is None for
+        single channel devices. A link is used when every known member of it
+        is part of the request with its preset level, and at least two
+        requested loads are covered by it.
+        """
+        remaining = dict(levels)
+        candidates = []
+        for network in {key[0] for key in levels}:
+            for link, members in self.link_index.network_links(network).items():
+                if len(members) < 2:
+                    continue
+                if all(levels.get(key) == level and (rate is None or fade_rate == rate)
+                       for key, (level, fade_rate) in members.items()):
+                    candidates.append(((network, link), set(members)))
+        links = []
+        while candidates:
+            candidates.sort(key=lambda candidate: len(candidate[1] & remaining.keys()))
+            link, members = candidates.pop()
+            if len(members & remaining.keys()) < 2:
+                break
+            links.append(link)
+            for key in members:
+                remaining.pop(key, None)
+        return links, remaining
+
+    async def set_levels(self, levels, rate=None):
+        """Set many loads, using link activations where existing presets match."""
+        links, remaining = self.plan_levels(levels, rate)
+        for network, link in links:
+            await self.activate_link(network, link)
+        for (network, device, channel), level in remaining.items():
+            await self.goto(network, device, level, rate, channel)
+        return links, remaining
+
+    async def update_registers(self, network, device, signature=None):
         """Fetch registers from device."""
+        await self._coalesce((network, device, 'registers', signature),
+            lambda: self._update_registers(network, device, signature))
+
+    async def _update_registers(self, network, device, signature):
         index = 0
         upbid_crc = 0
         setup_crc = 0
-        id_checksum, setup_checksum, ct_bytes = await self.update_signature(network, device)
+        if signature is None:
+            signature = await self.update_signature(network, device)
+        id_checksum, setup_checksum, ct_bytes = signature
         tasks = []
         while index < ct_bytes:
             start = index
@@ -335,6 +686,50 @@ class UPBClient:
                     password_test[1] -= 1
         self.logger.info(f"got good password = {hexdump(self.get_device(network, device).registers[2:4], sep='')}")
 
+    async def read_extended_registers(self, network, device, address, count, priority=UpbPriority.NORMAL):
+        """Read registers past 0xff with pipelined two byte address requests."""
+        tasks = []
+        for start in range(address, address + count, EXTENDED_READ_MAX):
+            req_len = min(EXTENDED_READ_MAX, address + count - start)
+            packet = encode_extended_register_request(network, device, start, req_len)
+            tasks.append(asyncio.ensure_future(self.pulse.send_packet(packet, priority)))
+        key = (network, device)
+        # Count overlapping reads of a device so one finishing does not unmark the others
+        self.extended_reads[key] = self.extended_reads.get(key, 0) + 1
+        try:
+            responses = await asyncio.gather(*tasks)
+        except BaseException:
+            # A failed or cancelled chunk leaves the others queued
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self.extended_reads[key] -= 1
+            if not self.extended_reads[key]:
+                del self.extended_reads[key]
+        data = bytearray(count)
+        for response in responses:
+            start, values = decode_extended_registers(response)
+            if not address <= start < address + count:
+                raise ValueError(f"unexpected extended register report at {start:#x} from {network}:{device}")
+            values = values[0:address + count - start]
+            data[start - address:start - address + len(values)] = values
+        return bytes(data)
+
+    async def update_tec_schedule(self, network, device, priority=UpbPriority.LOW):
+        """Read the flash of a timed event controller and decode its sun and DST tables."""
+        async def request():
+            flash = bytearray(TEC_FLASH_SIZE)
+            for offset, count in TEC_FLASH_RANGES:
+                flash[offset:offset + count] = await self.read_extended_registers(
+                    network, device, TEC_FLASH_START + offset, count, priority)
+            schedule = self.tec_schedules[(network, device)] = UPBTECSchedule(flash)
+            if self.tec_evaluator is not None and (network, device) in self.tec_evaluator.events:
+                # Sunrise and sunset events can be scheduled now
+                self.tec_evaluator.add_controller(network, device)
+            return schedule
+        return await self._coalesce((network, device, 'tec_flash'), request)
+
     async def get_registers(self, network, device):
         await self.update_registers(network, device)
         return bytes(self.get_device(network, device).registers)
@@ -343,14 +738,21 @@ async def create_upb_connection(port=None, host=None,
                                 disconnect_callback=None,
                                 reconnect_callback=None, loop=None,
                                 logger=None, timeout=None,
-                                reconnect_interval=10, username=None, password=None):
+                                reconnect_interval=10, username=None, password=None,
+                                trace_callback=None, airtime_share=0.5, airtime_burst=5.0,
+                                cache_ttl=0, queue_limits=None, history_size=0,
+                                register_store=None):
     """Create UPB Client class."""
     client = UPBClient(host, port=port,
                         disconnect_callback=disconnect_callback,
                         reconnect_callback=reconnect_callback,
                         loop=loop, logger=logger,
                         timeout=timeout, reconnect_interval=reconnect_interval,
-                        username=username, password=password)
+                        username=username, password=password,
+                        trace_callback=trace_callback,
+                        airtime_share=airtime_share, airtime_burst=airtime_burst,
+                        cache_ttl=cache_ttl, queue_limits=queue_limits,
+                        history_size=history_size, register_store=register_store)
     await client.setup()
 
     return client
\ No newline at end of file
@@ -44,6 +44,30 @@ class GatewayCmd(IntEnum):
     def has_value(cls, value):
         return value in cls._value2member_map_
 
+class UpbTraceEvent(IntEnum):
+    PULSE_ENQUEUE = 0x01
+    PULSE_WRITE = 0x02
+    PULSE_RESEND = 0x03
+    PULSE_PIM_ACCEPT = 0x04
+    PULSE_PIM_BUSY = 0x05
+    PULSE_TRANSMITTED = 0x06
+    PULSE_DECODED = 0x07
+    PULSE_RESOLVED = 0x08
+    GW_ENQUEUE = 0x11
+    GW_WRITE = 0x12
+    GW_RESEND = 0x13
+    GW_RESOLVED = 0x14
+    NT_ENQUEUE = 0x21
+    NT_WRITE = 0x22
+    NT_RESEND = 0x23
+    NT_RESOLVED = 0x24
+
+class UpbPriority(IntEnum):
+    URGENT = 0 # PIM setup, sent even while requests are held
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3 # Background polling and telemetry
+
 class UpbTransmission(IntEnum):
     UPB_MESSAGE = 0x55 # U
     UPB_PIM_ACCEPT = 0x41 # A
@@ -53,6 +77,10 @@ class UpbTransmission(IntEnum):
     UPB_TRANSMISSION_ACK = 0x4b # K
     UPB_TRANSMISSION_NAK = 0x4e # N
 
+    @classmethod
+    def has_value(cls, value):
+        return value in cls._value2member_map_
+
 class UpbMessage(IntEnum):
     UPB_MESSAGE_PIMREPORT = 0x50 # P
     UPB_MESSAGE_START = 0x58 # X
@@ -0,0 +1,555 @@
+"""
+Sans-IO UPB pulse mode protocol state machine
+"""
+
+import logging
+from binascii import hexlify, unhexlify
+from collections import deque, namedtuple
+from pprint import pformat
+from struct import pack, unpack
+from time import monotonic
+
+from upb.const import UpbMessage, UpbTransmission, UpbPriority, PimCommand, \
+    MdidSet, MdidCoreCmd, MdidDeviceControlCmd, MdidCoreReport, \
+    UPB_MESSAGE_TYPE, UPB_MESSAGE_PIMREPORT_TYPE, INITIAL_PIM_REG_QUERY_BASE
+from upb.util import cksum, hexdump
+
+PacketSent = namedtuple('PacketSent', ['token', 'cmd', 'packet', 'resend'])
+PimAccept = namedtuple('PimAccept', ['token'])
+PimBusy = namedtuple('PimBusy', ['token'])
+PimRegisters = namedtuple('PimRegisters', ['start', 'data'])
+MessageTransmitted = namedtuple('MessageTransmitted', ['response', 'packet', 'token'])
+MessageReceived = namedtuple('MessageReceived', ['response', 'packet', 'token'])
+MessageDropped = namedtuple('MessageDropped', [])
+MessageInvalid = namedtuple('MessageInvalid', ['response', 'packet', 'transmitted'])
+TransactionComplete = namedtuple('TransactionComplete', ['token', 'result'])
+
+MDID_CMD_TYPES = {
+    MdidSet.MDID_CORE_COMMANDS: MdidCoreCmd,
+    MdidSet.MDID_DEVICE_CONTROL_COMMANDS: MdidDeviceControlCmd,
+    MdidSet.MDID_CORE_REPORTS: MdidCoreReport,
+}
+
+# Control word, network, destination, source and MDID
+PACKET_HEADER = 6
+
+# Fewest message data bytes of messages with fixed fields
+MINIMUM_DATA = {
+    (MdidSet.MDID_CORE_REPORTS, MdidCoreReport.MDID_DEVICE_CORE_REPORT_REGISTERVALUES): 1,
+    (MdidSet.MDID_CORE_REPORTS, MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESIGNATURE): 17,
+    (MdidSet.MDID_CORE_REPORTS, MdidCoreReport.MDID_DEVICE_CORE_REPORT_SETUPTIME): 2,
+    (MdidSet.MDID_CORE_REPORTS, MdidCoreReport.MDID_DEVICE_CORE_REPORT_SIGNALSTRENGTH): 1,
+    (MdidSet.MDID_CORE_REPORTS, MdidCoreReport.MDID_DEVICE_CORE_REPORT_NOISELEVEL): 1,
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETREGISTERVALUES): 2,
+}
+
+# Report answering each request, keyed by the request MDID set and command
+REPLY_REPORTS = {
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETSETUPTIME):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_SETUPTIME,
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETDEVICESTATUS):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESTATUS,
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETSIGNALSTRENGTH):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_SIGNALSTRENGTH,
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETNOISELEVEL):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_NOISELEVEL,
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETDEVICESIGNATURE):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESIGNATURE,
+    (MdidSet.MDID_CORE_COMMANDS, MdidCoreCmd.MDID_CORE_COMMAND_GETREGISTERVALUES):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_REGISTERVALUES,
+    (MdidSet.MDID_DEVICE_CONTROL_COMMANDS, MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_REPORTSTATE):
+        MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESTATE,
+}
+
+
+def decode_mdid(mdid):
+    """Split a message data id into its set and command enums."""
+    mdid_set = MdidSet(mdid & 0xe0)
+    cmd_type = MDID_CMD_TYPES.get(mdid_set)
+    try:
+        mdid_cmd = cmd_type(mdid & 0x1f)
+    except (TypeError, ValueError):
+        mdid_cmd = mdid & 0x1f
+    return mdid_set, mdid_cmd
+
+
+def decode_packet(packet, verify=True):
+    """Decode a UPB packet into a response dict, crc_ok is None without verify.
+
+    Frames shorter than their header or their control word length decode
+    to a response with valid set to False and crc_ok False.
+    """
+    length = packet[0] & 0x1f if packet else 0
+    if length <= PACKET_HEADER or len(packet) < length:
+        return {'valid': False, 'length': len(packet), 'crc_ok': False}
+    control_word = packet[0:2]
+    data_len = length - 6
+    mdid_set, mdid_cmd = decode_mdid(packet[5])
+    if data_len - 1 < MINIMUM_DATA.get((mdid_set, mdid_cmd), 0):
+        return {'valid': False, 'length': len(packet), 'crc_ok': False}
+    response = {
+        'valid': True,
+        'packet': bytes(packet),
+        'link': (control_word[0] & 0x80) != 0,
+        'transmit_cnt': (control_word[1] & 0x0c) >> 2,
+        'transmit_seq': control_word[1] & 0x03,
+        'network_id': packet[2],
+        'destination_id': packet[3],
+        'device_id': packet[4],
+        'mdid_set': mdid_set,
+        'mdid_cmd': mdid_cmd,
+        'crc_ok': packet[data_len + 5] == cksum(packet[0:data_len + 5]) if verify else None
+    }
+    if mdid_set == MdidSet.MDID_CORE_REPORTS:
+        if mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_REGISTERVALUES:
+            response['setup_register'] = packet[6]
+            response['register_val'] = packet[7:data_len + 5]
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESIGNATURE:
+            ct_bytes = packet[14]
+            if ct_bytes == 0:
+                ct_bytes = 256
+            response['random_number'] = unpack('>H', packet[6:8])[0]
+            response['device_signal'] = packet[8]
+            response['device_noise'] = packet[9]
+            response['id_checksum'] = unpack('>H', packet[10:12])[0]
+            response['setup_checksum'] = unpack('>H', packet[12:14])[0]
+            response['ct_bytes'] = ct_bytes
+            response['diagnostic'] = packet[15:23]
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_SETUPTIME:
+            response['setup_mode_register'] = packet[6]
+            response['setup_mode_timer'] = packet[7]
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESTATE:
+            response['levels'] = list(packet[6:data_len + 5])
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_SIGNALSTRENGTH:
+            response['signal_strength'] = packet[6]
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_NOISELEVEL:
+            response['noise_level'] = packet[6]
+        else:
+            response['data'] = packet[6:data_len + 5]
+    elif mdid_set == MdidSet.MDID_CORE_COMMANDS:
+        if mdid_cmd == MdidCoreCmd.MDID_CORE_COMMAND_STARTSETUP:
+            response['password'] = packet[6:8]
+        elif mdid_cmd == MdidCoreCmd.MDID_CORE_COMMAND_GETREGISTERVALUES:
+            response['register_start'] = packet[6]
+            response['registers'] = packet[7]
+        else:
+            response['data'] = packet[6:data_len + 5]
+    else:
+        response['data'] = packet[6:data_len + 5]
+    return response
+
+
+def expected_report(response):
+    """Return the report answering a transmitted packet, or None if no reply is expected."""
+    if response['link']:
+        return None
+    return REPLY_REPORTS.get((response['mdid_set'], response['mdid_cmd']))
+
+
+def encode_pim_command(cmd, packet):
+    """Encode a PIM command line."""
+    return pack('B', cmd.value) + hexlify(packet).swapcase() + b'\r'
+
+
+class UPBPulseCore:
+    """Pulse mode protocol state without any I/O or event loop.
+
+    Feed received bytes to receive_data() and queue commands with send(),
+    both return the list of events produced. Bytes that need to be written
+    to the PIM are collected by data_to_send(). Transactions are identified
+    by an opaque token supplied by the caller.
+
+    Commands are queued per UpbPriority and sent highest priority first.
+    After a connection loss the active command is requeued and nothing is
+    sent until connection_made(), all but urgent commands are then held
+    until release() so the PIM can be checked first.
+
+    Devices send messages up to four times, repeats of a received message
+    within dedupe_window seconds are counted in duplicates and not decoded,
+    None keeps every copy. Only copies with a good checksum are remembered.
+    Without verify_checksums crc_ok is left None for the caller to check,
+    e.g. for many frames at once with validate_checksums(), and no repeats
+    are suppressed.
+    """
+
+    def __init__(self, logger=None, dedupe_window=1.0, clock=monotonic, verify_checksums=True):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.dedupe_window = dedupe_window
+        self.clock = clock
+        self.verify_checksums = verify_checksums
+        self.recent = {}
+        self.received = 0
+        self.duplicates = 0
+        self.buffer = b''
+        self.events = []
+        self.outgoing = []
+        self.last_transmitted = None
+        self.expected_report = None
+        self.idle_count = 0
+        self.idle_lines = 0
+        self.busy_lines = 0
+        self.in_flight = {}
+        self.in_flight_reg = {}
+        self.in_flight_write = None
+        self.transmitted = False
+        self.upb_packet = bytearray(64)
+        self.pulse_data_seq = 0
+        self.packet_byte = 0
+        self.packet_crumb = 0
+        self.queues = tuple(deque() for priority in UpbPriority)
+        self.active_packet = None
+        self.active_token = None
+        self.active_priority = None
+        self.in_transaction = False
+        self.connected = True
+        self.held = False
+
+    def _drain(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def data_to_send(self):
+        """Return and clear the bytes waiting to be written to the PIM."""
+        data = b''.join(self.outgoing)
+        self.outgoing = []
+        return data
+
+    def send(self, token, cmd, packet, priority=UpbPriority.NORMAL):
+        """Queue a PIM command."""
+        self.queues[priority].append((token, cmd, packet))
+        self._send_next_packet()
+        return self._drain()
+
+    def queued(self, priority=None):
+        """Return the number of commands waiting to be sent."""
+        if priority is None:
+            return sum(len(waiters) for waiters in self.queues)
+        return len(self.queues[priority])
+
+    def cancel(self, token):
+        """Abandon a queued or active transaction."""
+        for waiters in self.queues:
+            for waiter in waiters:
+                if waiter[0] == token:
+                    waiters.remove(waiter)
+                    return self._drain()
+        if self.active_token == token and self.in_transaction:
+            self._clear_active()
+            self._send_next_packet()
+        return self._drain()
+
+    def clear(self):
+        """Drop all queued and active commands."""
+        for waiters in self.queues:
+            waiters.clear()
+        self._clear_active()
+        self.outgoing = []
+        return self._drain()
+
+    def _clear_active(self):
+        self.in_flight.clear()
+        self.in_flight_reg.clear()
+        self.in_flight_write = None
+        self.last_transmitted = None
+        self.expected_report = None
+        self.in_transaction = False
+        self.active_packet = None
+        self.active_token = None
+        self.active_priority = None
+
+    def connection_lost(self):
+        """Requeue the active command and stop sending until reconnected."""
+        if self.in_transaction:
+            cmd, packet = self.active_packet
+            # All commands are safe to repeat, the PIM may not have seen it
+            self.queues[self.active_priority].appendleft((self.active_token, cmd, packet))
+            self._clear_active()
+        self.outgoing = []
+        self.connected = False
+        self.held = True
+        return self.reset()
+
+    def connection_made(self):
+        """Start sending urgent commands on a new connection."""
+        self.connected = True
+        self._send_next_packet()
+        return self._drain()
+
+    def release(self):
+        """Resume sending normal commands."""
+        self.held = False
+        self._send_next_packet()
+        return self._drain()
+
+    def timeout(self):
+        """Resend the active packet after a command timeout."""
+        if self.active_packet is not None:
+            cmd, packet = self.active_packet
+            self.logger.warning(f'resending packet due to timeout: {hexdump(packet)}')
+            self._write(cmd, packet, self.active_token, True)
+        return self._drain()
+
+    def reset(self):
+        """Drop partial input after a connection loss."""
+        self.buffer = b''
+        self.set_state_zero()
+        return self._drain()
+
+    def _write(self, cmd, packet, token, resend):
+        self.outgoing.append(encode_pim_command(cmd, packet))
+        self.events.append(PacketSent(token, cmd, packet, resend))
+
+    def _complete(self, token, result):
+        self.in_transaction = False
+        self.active_packet = None
+        self.active_token = None
+        self.events.append(TransactionComplete(token, result))
+
+    def _process_pim_accept(self):
+        self.events.append(PimAccept(self.active_token))
+        if self.in_flight_write is not None:
+            token = self.in_flight_write
+            self.in_flight_write = None
+            self._complete(token, True)
+
+    def _process_pim_busy(self):
+        if self.in_transaction:
+            cmd, packet = self.active_packet
+            self.logger.warning(f'resending packet: {hexdump(packet)}')
+            self.events.append(PimBusy(self.active_token))
+            self._write(cmd, packet, self.active_token, True)
+
+    def _process_received_packet(self, response):
+        token = self.in_flight.pop(self.last_transmitted, None)
+        self.last_transmitted = None
+        self.expected_report = None
+        if token is not None:
+            self._complete(token, response)
+
+    def _process_received_pim_reg(self, address, registers):
+        token = self.in_flight_reg.pop(address, None)
+        if token is not None:
+            self._complete(token, registers)
+
+    def _send_next_packet(self):
+        if not self.connected or self.in_transaction or len(self.in_flight) > 0 \
+            or len(self.in_flight_reg) > 0:
+            return
+        for priority, waiters in enumerate(self.queues):
+            if waiters and (priority == UpbPriority.URGENT or not self.held):
+                break
+        else:
+            return
+        token, cmd, packet = waiters.popleft()
+        if cmd == PimCommand.UPB_NETWORK_TRANSMIT:
+            self.in_flight[packet] = token
+        elif cmd == PimCommand.UPB_PIM_READ:
+            self.in_flight_reg[packet[0]] = token
+        elif cmd == PimCommand.UPB_PIM_WRITE:
+            self.in_flight_write = token
+        else:
+            self.logger.error(f"unknown command: {cmd.name}")
+        self.in_transaction = True
+        self.active_packet = (cmd, packet)
+        self.active_token = token
+        self.active_priority = priority
+        self._write(cmd, packet, token, False)
+
+    def set_state_zero(self):
+        self.transmitted = False
+        self.pulse_data_seq = 0
+        self.packet_crumb = 0
+        self.packet_byte = 0
+
+    def _dedupe_key(self, packet):
+        # Copies differ only in the transmit sequence bits and the checksum
+        return bytes((packet[0], packet[1] & 0xfc)) + packet[2:(packet[0] & 0x1f) - 1]
+
+    def is_duplicate(self, packet):
+        """Check if a packet repeats a recently received message."""
+        if len(packet) < 7:
+            return False
+        last = self.recent.get(self._dedupe_key(packet))
+        return last is not None and self.clock() - last[0] <= self.dedupe_window and (packet[1] & 0x03) > last[1]
+
+    def _remember(self, packet):
+        """Record a correctly received message so its later copies are suppressed."""
+        now = self.clock()
+        self.recent[self._dedupe_key(packet)] = (now, packet[1] & 0x03)
+        if len(self.recent) > 64:
+            self.recent = {k: v for k, v in self.recent.items() if now - v[0] <= self.dedupe_window}
+
+    def process_packet(self, packet):
+        self.received += 1
+        if self.dedupe_window is not None and self.is_duplicate(packet):
+            self.duplicates += 1
+            return
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Got upb message data: {hexdump(packet)}")
+        response = decode_packet(packet, self.verify_checksums)
+        if not response['valid']:
+            self.logger.error(f"short packet: {hexdump(packet)}")
+            self.events.append(MessageInvalid(response, packet, False))
+            return
+        if self.verify_checksums and not response['crc_ok']:
+            self.logger.error(f"crc mismatch in packet: {hexdump(packet)}")
+        elif self.dedupe_window is not None and response['crc_ok']:
+            # A corrupted copy must not suppress the intact copies after it
+            self._remember(packet)
+        reply = self.expected_report is not None and response['mdid_set'] == MdidSet.MDID_CORE_REPORTS \
+            and response['mdid_cmd'] == self.expected_report and response['device_id'] == self.last_transmitted[3]
+        # Only the reply completing a transaction carries its token
+        token = self.in_flight.get(self.last_transmitted) if reply else None
+        self.events.append(MessageReceived(response, packet, token))
+        if reply:
+            self._process_received_packet(response)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(pformat(response))
+
+    def process_transmitted(self, data):
+        mystery_header = data[0]
+        packet = data[1:]
+        response = decode_packet(packet, self.verify_checksums)
+        if not response['valid']:
+            # The active command is resent when it times out
+            self.logger.error(f"short transmitted packet: {hexdump(packet)}")
+            self.events.append(MessageInvalid(response, packet, True))
+            return
+        self.last_transmitted = packet
+        if self.verify_checksums and not response['crc_ok']:
+            self.logger.error(f"crc mismatch in transmitted packet: {hexdump(packet)}")
+        self.events.append(MessageTransmitted(response, packet, self.active_token))
+        self.expected_report = expected_report(response)
+        if self.expected_report is None:
+            self._process_received_packet(response)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(pformat(response))
+            self.logger.debug(f'pim transmitted packet: {hexdump(packet)}, with mystery_header: {hex(mystery_header)}')
+
+    def _process_crumb(self, two_bits, seq):
+        if seq != self.pulse_data_seq:
+            self.logger.warning(f"Got upb message data bad seq: {hex(seq)}, expected: {hex(self.pulse_data_seq)}")
+            self.set_state_zero()
+            return
+        if self.packet_byte >= len(self.upb_packet):
+            self.logger.error("upb message data overflow")
+            self.set_state_zero()
+            return
+        if self.packet_crumb == 0:
+            self.upb_packet[self.packet_byte] = (two_bits << 6)
+            self.packet_crumb += 1
+        elif self.packet_crumb == 1:
+            self.upb_packet[self.packet_byte] |= (two_bits << 4)
+            self.packet_crumb += 1
+        elif self.packet_crumb == 2:
+            self.upb_packet[self.packet_byte] |= (two_bits << 2)
+            self.packet_crumb += 1
+        elif self.packet_crumb == 3:
+            self.upb_packet[self.packet_byte] |= two_bits
+            self.packet_crumb = 0
+            self.packet_byte += 1
+        self.pulse_data_seq += 1
+        if self.pulse_data_seq > 0x0f:
+            self.pulse_data_seq = 0
+
+    def _process_pim_report(self, line):
+        if len(line) <= UPB_MESSAGE_PIMREPORT_TYPE:
+            self.logger.error(f'got corrupt pim report with len: {len(line)}')
+            return
+        if not UpbTransmission.has_value(line[UPB_MESSAGE_PIMREPORT_TYPE]):
+            self.logger.error(f'got unknown pim report: {hex(line[UPB_MESSAGE_PIMREPORT_TYPE])}')
+            return
+        transmission = UpbTransmission(line[UPB_MESSAGE_PIMREPORT_TYPE])
+        self.logger.debug(f"transmission: {transmission.name}")
+        if transmission == UpbTransmission.UPB_PIM_REGISTERS:
+            register_data = unhexlify(line[UPB_MESSAGE_PIMREPORT_TYPE + 1:])
+            start = register_data[0]
+            register_val = register_data[1:]
+            self.events.append(PimRegisters(start, register_val))
+            if self.active_packet is not None:
+                cmd, packet = self.active_packet
+                if cmd in (PimCommand.UPB_PIM_READ, PimCommand.UPB_PIM_WRITE) and start == packet[0]:
+                    self._process_received_pim_reg(start, register_val)
+                    self._send_next_packet()
+            if start == INITIAL_PIM_REG_QUERY_BASE:
+                self.logger.debug("got pim in initial phase query mode")
+        elif transmission == UpbTransmission.UPB_PIM_ACCEPT:
+            self._process_pim_accept()
+        elif transmission == UpbTransmission.UPB_PIM_BUSY:
+            self._process_pim_busy()
+
+    def _process_message_end(self):
+        message = bytes(self.upb_packet[0:self.packet_byte])
+        transmitted = self.transmitted
+        self.set_state_zero()
+        if len(message) != 0:
+            if transmitted:
+                self.process_transmitted(message)
+            else:
+                self.process_packet(message)
+
+    def _line_received(self, line):
+        if not UpbMessage.has_value(line[UPB_MESSAGE_TYPE]):
+            self.logger.error(f'PIM failed to parse line: {hexdump(line)}')
+            return
+        command = UpbMessage(line[UPB_MESSAGE_TYPE])
+        if command == UpbMessage.UPB_MESSAGE_IDLE:
+            self._send_next_packet()
+            self.idle_count += 1
+            self.idle_lines += 1
+            return
+        if self.idle_count != 0:
+            self.logger.debug(f"Received PIM idle count: {self.idle_count}")
+            self.idle_count = 0
+        data = line[1:]
+        if len(data) == 2 and command in (UpbMessage.UPB_MESSAGE_TRANSMITTED, UpbMessage.UPB_MESSAGE_DATA_0,
+                UpbMessage.UPB_MESSAGE_DATA_1, UpbMessage.UPB_MESSAGE_DATA_2, UpbMessage.UPB_MESSAGE_DATA_3):
+            try:
+                seq = int(data[1:2], 16)
+            except ValueError:
+                self.logger.error(f'PIM failed to parse line: {hexdump(line)}')
+                return
+        if UpbMessage.is_message_data(command):
+            self._send_next_packet()
+            self.busy_lines += 1
+            if len(data) == 2:
+                self._process_crumb(command.value - 0x30, seq)
+        elif command == UpbMessage.UPB_MESSAGE_TRANSMITTED:
+            self._send_next_packet()
+            self.busy_lines += 1
+            self.transmitted = True
+            if len(data) == 2:
+                self._process_crumb(data[0] - 0x30, seq)
+        elif command == UpbMessage.UPB_MESSAGE_SYNC or command == UpbMessage.UPB_MESSAGE_START:
+            self._send_next_packet()
+            self.packet_byte = 0
+            self.packet_crumb = 0
+        elif command == UpbMessage.UPB_MESSAGE_ACK or command == UpbMessage.UPB_MESSAGE_NAK:
+            self._send_next_packet()
+            self._process_message_end()
+        elif command == UpbMessage.UPB_MESSAGE_DROP:
+            self.logger.error('dropped message')
+            self.set_state_zero()
+            self.events.append(MessageDropped())
+        elif command == UpbMessage.UPB_MESSAGE_PIMREPORT:
+            self.logger.debug(f"PIM {command.name} data: {data}")
+            self._process_pim_report(line)
+
+    def receive_line(self, line):
+        """Process a single PIM line without its terminator."""
+        if len(line) > 0:
+            self._line_received(line)
+        return self._drain()
+
+    def receive_data(self, data):
+        """Process raw bytes received from the PIM."""
+        lines = (self.buffer + data).split(b'\r')
+        self.buffer = lines.pop()
+        for line in lines:
+            if len(line) > 1:
+                self._line_received(line)
+        return self._drain()
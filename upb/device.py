@@ -1,12 +1,12 @@
 from upb.util import hexdump
-from upb.register import UPBID, get_register_map
+from upb.register import UPBID, get_register_map, get_link_presets
 from upb.memory import *
 
 from pprint import pformat
 
 class UPBDevice:
 
-    def __init__(self, client, network_id, device_id, logger=None):
+    def __init__(self, client, network_id, device_id, logger=None, registers=None):
         if logger:
             self.logger = logger
         else:
@@ -15,11 +15,14 @@ class UPBDevice:
         self.protocol = client.protocol
         self.network_id = network_id
         self.device_id = device_id
-        self.registers = bytearray(256)
+        if registers is None:
+            registers = bytearray(256)
+        self.registers = registers
         self.signature = b''
         self.id_checksum = None
         self.setup_checksum = None
         self.ct_bytes = None
+        self.levels = {}
         self.upbid = UPBID.from_buffer(self.registers)
         self.upbid.net_id = network_id
         self.upbid.module_id = device_id
@@ -74,6 +77,18 @@ class UPBDevice:
     def password(self):
         return self.upbid.password
 
+    def link_presets(self):
+        """Return (channel, link_id, level, fade_rate) for each link this device responds to."""
+        return get_link_presets(get_register_map(self.product), self.registers)
+
+    def detach_registers(self):
+        """Move registers held in a shared register store into a private copy."""
+        registers = self.registers
+        if isinstance(registers, memoryview):
+            self.registers = bytearray(registers)
+            self.upbid = UPBID.from_buffer(self.registers)
+            registers.release()
+
     async def sync_registers(self):
         await self.client.update_registers(self.network_id, self.device_id)
 
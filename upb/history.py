@@ -0,0 +1,96 @@
+"""
+Compact ring buffer history of UPB frames indexed by source and destination
+"""
+
+from array import array
+from time import time
+
+# Longest UPB packet, the length field of the control word is at most 24
+PACKET_SLOT = 24
+# Flag in the stored length byte of frames transmitted by the PIM
+TRANSMITTED_FLAG = 0x80
+
+
+class UPBMessageHistory:
+    """Most recent frames kept as struct-of-arrays in fixed size slots.
+
+    Frames get increasing sequence numbers and live in slot seq % capacity.
+    Every frame stores how far back the previous frame from the same source
+    and to the same destination are, so the last N frames of a device are
+    found by walking N links instead of scanning the buffer. A frame costs
+    41 bytes, the default 100000 frames take about 4MB.
+    """
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.time = array('d', bytes(8 * capacity))
+        self.length = bytearray(capacity)
+        self.packets = bytearray(PACKET_SLOT * capacity)
+        self.prev_source = array('I', bytes(4 * capacity))
+        self.prev_destination = array('I', bytes(4 * capacity))
+        self.count = 0
+        self.last_source = {}
+        self.last_destination = {}
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _link(self, heads, key, seq):
+        last = heads.get(key)
+        heads[key] = seq
+        if last is None or seq - last >= self.capacity:
+            return 0
+        return seq - last
+
+    def add(self, packet, transmitted=False, timestamp=None):
+        """Store a frame and return its sequence number."""
+        if len(packet) < 6:
+            return None
+        seq = self.count
+        self.count += 1
+        slot = seq % self.capacity
+        length = min(len(packet), PACKET_SLOT)
+        self.time[slot] = time() if timestamp is None else timestamp
+        self.length[slot] = length | (TRANSMITTED_FLAG if transmitted else 0)
+        self.packets[slot * PACKET_SLOT:slot * PACKET_SLOT + length] = packet[0:length]
+        network = packet[2]
+        self.prev_source[slot] = self._link(self.last_source, (network, packet[4]), seq)
+        destination = (network, packet[3], (packet[0] & 0x80) != 0)
+        self.prev_destination[slot] = self._link(self.last_destination, destination, seq)
+        return seq
+
+    def _valid(self, seq):
+        return seq is not None and self.count - self.capacity <= seq < self.count
+
+    def get(self, seq):
+        """Return (seq, timestamp, packet, transmitted) for a stored frame."""
+        if not self._valid(seq):
+            return None
+        slot = seq % self.capacity
+        length = self.length[slot]
+        start = slot * PACKET_SLOT
+        packet = bytes(self.packets[start:start + (length & ~TRANSMITTED_FLAG)])
+        return seq, self.time[slot], packet, (length & TRANSMITTED_FLAG) != 0
+
+    def _walk(self, seq, prev, count):
+        frames = []
+        while len(frames) < count and self._valid(seq):
+            frames.append(self.get(seq))
+            back = prev[seq % self.capacity]
+            if back == 0:
+                break
+            seq -= back
+        return frames
+
+    def recent(self, count):
+        """Return up to count frames, newest first."""
+        oldest = self.count - min(count, len(self))
+        return [self.get(seq) for seq in range(self.count - 1, oldest - 1, -1)]
+
+    def from_device(self, network, device, count):
+        """Return up to count frames sent by a device, newest first."""
+        return self._walk(self.last_source.get((network, device)), self.prev_source, count)
+
+    def to_device(self, network, device, count, link=False):
+        """Return up to count frames addressed to a device or link, newest first."""
+        return self._walk(self.last_destination.get((network, device, link)), self.prev_destination, count)
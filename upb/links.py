@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+from upb.register import get_register_map, get_preset_tables
+
+# Registers holding the manufacturer and product id which select the register map
+PRODUCT_REGISTERS = (6, 10)
+
+
+class UPBLinkIndex:
+    """Network wide index from link id to the devices that respond to it."""
+
+    def __init__(self):
+        self.links = defaultdict(dict)
+        self.device_links = {}
+
+    def _touches_presets(self, device, start, end):
+        if start < PRODUCT_REGISTERS[1] and end > PRODUCT_REGISTERS[0]:
+            return True
+        reg_class = get_register_map(device.product)
+        if reg_class is None:
+            return False
+        for channel, offset, count, level_field in get_preset_tables(reg_class):
+            if start < offset + count * 3 and end > offset:
+                return True
+        return False
+
+    def update_device(self, device, start=0, end=256):
+        """Reindex a device after registers start to end changed."""
+        if (device.network_id, device.device_id) in self.device_links and \
+                not self._touches_presets(device, start, end):
+            return
+        self.remove_device(device.network_id, device.device_id)
+        link_keys = set()
+        for channel, link, level, fade_rate in device.link_presets():
+            link_key = (device.network_id, link)
+            self.links[link_key][(device.network_id, device.device_id, channel)] = (level, fade_rate)
+            link_keys.add(link_key)
+        self.device_links[(device.network_id, device.device_id)] = link_keys
+
+    def remove_device(self, network, device):
+        for link_key in self.device_links.pop((network, device), ()):
+            members = self.links[link_key]
+            for member in [member for member in members if member[1] == device]:
+                del members[member]
+            if not members:
+                del self.links[link_key]
+
+    def members(self, network, link):
+        """Return {(network, device, channel): (level, fade_rate)} for a link."""
+        return self.links.get((network, link), {})
+
+    def network_links(self, network):
+        """Return {link: members} for all indexed links of a network."""
+        return {link: members for (link_network, link), members in self.links.items()
+                if link_network == network}
+
+    def device_link_ids(self, network, device):
+        return {link for _, link in self.device_links.get((network, device), ())}
+
+    def predict(self, network, link):
+        """Return {(network, device, channel): level} a link activation leads to."""
+        return {member: level for member, (level, fade_rate) in self.members(network, link).items()}
@@ -0,0 +1,223 @@
+"""
+Adaptive per-device state polling
+"""
+
+import asyncio
+import heapq
+import logging
+from time import monotonic
+
+from upb.const import UpbPriority
+
+
+class UPBPollEntry:
+    """Polling state of a single device."""
+
+    def __init__(self, interval, due):
+        self.interval = interval
+        self.due = due
+        self.last_seen = None
+        self.levels = {}
+        self.polls = 0
+        self.changes = 0
+
+
+class UPBPollScheduler:
+    """Poll device state on intervals that adapt to observed activity.
+
+    Each device starts at min_interval. A poll or message that shows a level
+    change halves the interval, an unchanged poll doubles it up to
+    max_interval, and no device goes longer than staleness seconds without
+    being heard from. Any traffic from a device counts as a fresh reading and
+    pushes its next poll back. Devices due within coalesce_window of each
+    other that share a link are polled with a single link REPORTSTATE.
+    """
+
+    def __init__(self, client, min_interval=60, max_interval=3600, staleness=900,
+                 coalesce_window=30, timeout=30, command='report_state',
+                 loop=None, logger=None):
+        if loop:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = min(max_interval, staleness)
+        self.staleness = staleness
+        self.coalesce_window = coalesce_window
+        self.timeout = timeout
+        self.command = command
+        self.entries = {}
+        self.heap = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.link_polls = 0
+        self.device_polls = 0
+
+    def _schedule(self, key, due):
+        entry = self.entries[key]
+        entry.due = due
+        heapq.heappush(self.heap, (due, key))
+        if self.heap[0][1] == key:
+            self.wakeup.set()
+
+    def add_device(self, network, device):
+        key = (network, device)
+        if key not in self.entries:
+            self.entries[key] = UPBPollEntry(self.min_interval, monotonic())
+            self._schedule(key, monotonic())
+
+    def remove_device(self, network, device):
+        # Heap entries of removed devices are skipped when popped
+        self.entries.pop((network, device), None)
+
+    def _observe(self, key, channel, level):
+        """Record a level and adapt the device interval."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        now = monotonic()
+        entry.last_seen = now
+        if channel in entry.levels and entry.levels[channel] != level:
+            entry.changes += 1
+            entry.interval = max(self.min_interval, entry.interval / 2)
+        entry.levels[channel] = level
+        self._schedule(key, now + entry.interval)
+
+    def handle_state(self, network, device, channel, level, source):
+        # Predicted levels are not a reading from the device itself
+        if source == 'report':
+            self._observe((network, device), channel, level)
+        elif source == 'schedule':
+            # A scheduled change is expected, confirming it would waste a poll
+            entry = self.entries.get((network, device))
+            if entry is not None:
+                entry.levels[channel] = level
+                self._schedule((network, device), max(entry.due, monotonic() + entry.interval))
+
+    def handle_message(self, response, transmitted):
+        if transmitted:
+            return
+        key = (response['network_id'], response['device_id'])
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.last_seen = monotonic()
+            self._schedule(key, entry.last_seen + entry.interval)
+
+    def _pop_due(self, now):
+        """Pop all devices due before now plus the coalescing window."""
+        due = []
+        while self.heap and self.heap[0][0] <= now + self.coalesce_window:
+            when, key = heapq.heappop(self.heap)
+            entry = self.entries.get(key)
+            if entry is None or entry.due != when or key in due:
+                continue
+            due.append(key)
+        return due
+
+    def _plan_links(self, due):
+        """Pick links that each cover two or more due devices."""
+        remaining = set(due)
+        links = []
+        networks = {network for network, device in due}
+        for network in networks:
+            candidates = []
+            for link, members in self.client.link_index.network_links(network).items():
+                devices = {(member_network, device) for member_network, device, channel in members}
+                candidates.append((link, devices))
+            while True:
+                best = None
+                for link, devices in candidates:
+                    covered = len(devices & remaining)
+                    # Prefer links that wake the fewest devices which are not due
+                    score = (covered, -len(devices - remaining))
+                    if covered >= 2 and (best is None or score > best[0]):
+                        best = (score, link, devices)
+                if best is None:
+                    break
+                links.append((network, best[1], best[2] & remaining))
+                remaining -= best[2]
+        return links, sorted(remaining)
+
+    async def _poll_device(self, network, device):
+        if self.command == 'device_status':
+            request = self.client.get_device_status(network, device, UpbPriority.LOW)
+        else:
+            request = self.client.report_state(network, device, UpbPriority.LOW)
+        await asyncio.wait_for(request, self.timeout)
+
+    async def poll(self, due):
+        """Poll a batch of due devices, coalescing them onto links where possible."""
+        before = {key: (self.entries[key].last_seen, self.entries[key].changes) for key in due}
+        links, direct = self._plan_links(due)
+        for network, link, devices in links:
+            self.logger.debug(f"Polling {len(devices)} devices with link {network}:{link}")
+            self.link_polls += 1
+            try:
+                await asyncio.wait_for(self.client.report_link_state(network, link, UpbPriority.LOW), self.timeout)
+            except asyncio.TimeoutError:
+                self.logger.warning(f"Link {network}:{link} state poll timed out")
+            except ConnectionError as exc:
+                self.logger.warning(f"Link {network}:{link} state poll failed: {exc}")
+        for network, device in direct:
+            self.device_polls += 1
+            try:
+                await self._poll_device(network, device)
+            except asyncio.TimeoutError:
+                self.logger.warning(f"Device {network}:{device} state poll timed out")
+            except ConnectionError as exc:
+                self.logger.warning(f"Device {network}:{device} state poll failed: {exc}")
+        if links:
+            # Link members reply on their own after the link message is sent
+            await asyncio.sleep(min(self.timeout, 2))
+        for key, (last_seen, changes) in before.items():
+            self._poll_done(key, last_seen, changes)
+
+    def _poll_done(self, key, last_seen, changes):
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+        entry.polls += 1
+        if entry.last_seen == last_seen:
+            # No reply, retry on the shortest interval
+            entry.interval = self.min_interval
+            self._schedule(key, monotonic() + entry.interval)
+        elif entry.changes == changes:
+            entry.interval = min(self.max_interval, entry.interval * 2)
+            self._schedule(key, entry.last_seen + entry.interval)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = self.heap[0][0] - monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if not self.client.is_connected:
+                await asyncio.sleep(self.min_interval)
+                continue
+            await self.poll(self._pop_due(monotonic()))
+
+    def start(self):
+        self.client.state_callbacks.append(self.handle_state)
+        self.client.message_callbacks.append(self.handle_message)
+        self.task = self.loop.create_task(self.run())
+
+    def stop(self):
+        if self.handle_state in self.client.state_callbacks:
+            self.client.state_callbacks.remove(self.handle_state)
+        if self.handle_message in self.client.message_callbacks:
+            self.client.message_callbacks.remove(self.handle_message)
+        if self.task:
+            self.task.cancel()
+            self.task = None
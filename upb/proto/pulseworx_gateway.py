@@ -1,17 +1,19 @@
 import asyncio
+import logging
 import hmac
 from pprint import pformat
 from collections import deque
 from upb.util import cksum, hexdump
-from upb.const import GatewayCmd
+from upb.const import GatewayCmd, UpbTraceEvent
 from binascii import unhexlify
 from functools import reduce
 from struct import pack, unpack
+from time import monotonic
 
 
 class PulseworxGatewayProto(asyncio.Protocol):
 
-    def __init__(self, pulse, username, password, loop=None, logger=None):
+    def __init__(self, pulse, username, password, loop=None, logger=None, trace_callback=None):
         if loop:
             self.loop = loop
         else:
@@ -25,6 +27,7 @@ class PulseworxGatewayProto(asyncio.Protocol):
         self._gw_keep_alive = None
         self.pulse = pulse
         self.pulse_waiter = None
+        self.trace_callback = trace_callback
         self.username = username
         self.password = password
         self.pulse.protocol = self
@@ -33,6 +36,8 @@ class PulseworxGatewayProto(asyncio.Protocol):
         self.gw_cmd = None
         self.active_packet = None
         self.in_flight = None
+        self.active_txn = None
+        self.txn_count = 0
         self.wrapped = False
         self.waiters = deque()
         self.gw_waiters = deque()
@@ -55,8 +60,9 @@ class PulseworxGatewayProto(asyncio.Protocol):
         """Write next packet in send queue."""
         packet = self.active_packet
         self.logger.warning(f'resending packet due to timeout: {hexdump(packet)}')
-        self.transport.write(packet)
-        self.write_gateway(cmd, packet)
+        if self.trace_callback is not None:
+            self.trace_callback(UpbTraceEvent.NT_RESEND, monotonic(), self.active_txn, packet)
+        self.transport.write(packet + b'\x00')
         self._reset_nt_cmd_timeout()
 
     async def send_nt_packet(self, packet):
@@ -66,19 +72,25 @@ class PulseworxGatewayProto(asyncio.Protocol):
     def _send_nt_packet(self, packet):
         """Add packet to send queue."""
         fut = self.loop.create_future()
-        self.waiters.append((fut, packet))
+        self.txn_count += 1
+        if self.trace_callback is not None:
+            self.trace_callback(UpbTraceEvent.NT_ENQUEUE, monotonic(), self.txn_count, packet)
+        self.waiters.append((fut, packet, self.txn_count))
         self._send_next_nt_packet()
         return fut
 
     def _send_next_nt_packet(self):
         """Write next packet in send queue."""
         if self.waiters and self.in_transaction is False and self.in_flight is None:
-            waiter, packet = self.waiters.popleft()
+            waiter, packet, txn = self.waiters.popleft()
             self.in_flight = waiter
             self.in_transaction = True
             self.active_packet = packet
+            self.active_txn = txn
             msg = packet + b'\x00'
             self.logger.debug(f'sending nt packet: {hexdump(msg)}, msg: {msg}')
+            if self.trace_callback is not None:
+                self.trace_callback(UpbTraceEvent.NT_WRITE, monotonic(), txn, packet)
             self.transport.write(msg)
             self._reset_nt_cmd_timeout()
 
@@ -93,6 +105,8 @@ class PulseworxGatewayProto(asyncio.Protocol):
         cmd = self.gw_cmd
         packet = self.active_packet
         self.logger.warning(f'resending gw packet due to timeout: {hexdump(packet)}, msg: {packet}, cmd: {hex(cmd)}')
+        if self.trace_callback is not None:
+            self.trace_callback(UpbTraceEvent.GW_RESEND, monotonic(), self.active_txn, packet)
         self.write_gateway(cmd, packet)
         self._reset_gw_cmd_timeout()
 
@@ -103,18 +117,24 @@ class PulseworxGatewayProto(asyncio.Protocol):
     def _send_gw_packet(self, cmd, packet):
         """Add packet to send queue."""
         fut = self.loop.create_future()
-        self.gw_waiters.append((fut, cmd, packet))
+        self.txn_count += 1
+        if self.trace_callback is not None:
+            self.trace_callback(UpbTraceEvent.GW_ENQUEUE, monotonic(), self.txn_count, packet)
+        self.gw_waiters.append((fut, cmd, packet, self.txn_count))
         self._send_next_gw_packet()
         return fut
 
     def _send_next_gw_packet(self):
         """Write next packet in send queue."""
         if self.gw_waiters and self.in_transaction is False and self.in_flight is None:
-            waiter, cmd, packet = self.gw_waiters.popleft()
+            waiter, cmd, packet, txn = self.gw_waiters.popleft()
             self.gw_cmd = cmd
             self.in_flight = waiter
             self.in_transaction = True
             self.active_packet = packet
+            self.active_txn = txn
+            if self.trace_callback is not None:
+                self.trace_callback(UpbTraceEvent.GW_WRITE, monotonic(), txn, packet)
             self.write_gateway(cmd, packet)
             self._reset_gw_cmd_timeout()
 
@@ -132,7 +152,10 @@ class PulseworxGatewayProto(asyncio.Protocol):
                 self._gw_cmd_timeout.cancel()
                 self.in_transaction = False
                 self.in_flight.set_result(packet)
+                if self.trace_callback is not None:
+                    self.trace_callback(UpbTraceEvent.GW_RESOLVED, monotonic(), self.active_txn, packet)
                 self.in_flight = None
+                self.active_txn = None
                 self.gw_cmd = None
 
 
@@ -215,7 +238,10 @@ class PulseworxGatewayProto(asyncio.Protocol):
         if self.in_transaction:
             self.in_transaction = False
             self.in_flight.set_result(line)
+            if self.trace_callback is not None:
+                self.trace_callback(UpbTraceEvent.NT_RESOLVED, monotonic(), self.active_txn, line)
             self.in_flight = None
+            self.active_txn = None
 
     def write_packet(self, packet):
         assert(self.wrapped)
@@ -260,6 +286,12 @@ class PulseworxGatewayProto(asyncio.Protocol):
                 if len(line) > 0:
                     self.nt_line_received(bytes(line))
 
+    def pause_writing(self):
+        self.pulse.pause_writing()
+
+    def resume_writing(self):
+        self.pulse.resume_writing()
+
     def connection_lost(self, *args):
         self.wrapped = False
         if self._gw_keep_alive:
@@ -1,4 +1,5 @@
 import asyncio
+import logging
 
 
 class UPBTCPProto(asyncio.Protocol):
@@ -27,6 +28,12 @@ class UPBTCPProto(asyncio.Protocol):
     def data_received(self, data):
         self.pulse.upb_data_received(data)
 
+    def pause_writing(self):
+        self.pulse.pause_writing()
+
+    def resume_writing(self):
+        self.pulse.resume_writing()
+
     def connection_lost(self, *args):
         if self.pulse.handle_disconnect_callback:
             self.pulse.handle_disconnect_callback()
@@ -594,6 +594,7 @@ class TECFlash(BigEndianStructure):
         ('dst_stop_month', c_uint8), # 0x10e
         ('dst_stop_day', c_uint8),
         ('suntime_table', c_uint8 * 366), # 0x110
+        ('reserved1', c_char * 130), # 0x27e
         ('dst_table', DSTDate * 30) # 0x300  [0] = 2006
     ]
 
@@ -686,6 +687,52 @@ class UPBRFI(BigEndianStructure, Dictionary):
         ('remote_8_id', c_uint8 * 4)
     ]
 
+MAX_LINK_ID = 250
+
+preset_table_cache = {}
+
+def get_preset_tables(reg_class):
+    """Return (channel, offset, count, level_field) for each link preset table of a register map.
+
+    Link tables are declared as separate link id, level and fade arrays but are
+    stored in the device as (link id, level, fade) triplets starting at the
+    offset of the link id array.
+    """
+    tables = preset_table_cache.get(reg_class)
+    if tables is None:
+        tables = []
+        names = {name for name, _ in reg_class._fields_}
+        for name, field_type in reg_class._fields_:
+            if not name.startswith('link_ids'):
+                continue
+            suffix = name[len('link_ids'):]
+            channel = int(suffix[1:]) if suffix else None
+            if 'preset_level_table' + suffix in names:
+                level_field = 'preset_level_table'
+            elif 'state' + suffix in names:
+                level_field = 'state'
+            else:
+                continue
+            tables.append((channel, getattr(reg_class, name).offset, field_type._length_, level_field))
+        preset_table_cache[reg_class] = tables
+    return tables
+
+def get_link_presets(reg_class, registers):
+    """Return (channel, link_id, level, fade_rate) for each link a device responds to."""
+    presets = []
+    if reg_class is None:
+        return presets
+    for channel, offset, count, level_field in get_preset_tables(reg_class):
+        for index in range(offset, offset + count * 3, 3):
+            link_id, level, fade_rate = registers[index:index + 3]
+            if link_id == 0 or link_id > MAX_LINK_ID:
+                continue
+            if level_field == 'state':
+                level = 100 if level else 0
+                fade_rate = None
+            presets.append((channel, link_id, level, fade_rate))
+    return presets
+
 def get_register_map(product):
     if product in UPBKindSwitch:
         return UPBSwitch
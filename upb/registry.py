@@ -0,0 +1,133 @@
+from upb.const import PRODUCTS, UpbReg
+from upb.device import UPBDevice
+
+# Registers 0x00 to 0x3f hold the UPBID with product, firmware and names
+UPBID_END = UpbReg.UPB_REG_RESERVED1
+
+INDEXES = ('network', 'manufacturer', 'product', 'kind', 'firmware', 'network_name', 'room', 'name')
+
+
+def decode_name(value):
+    return value.split(b'\x00', 1)[0].decode('ascii', errors='replace').strip()
+
+
+class UPBDeviceRegistry:
+    """Devices keyed by (network, device) with secondary indexes.
+
+    Indexes map a value to the set of device keys having it. A device is
+    reindexed when registers of its UPBID change, find() intersects the
+    smallest matching sets first.
+    """
+
+    def __init__(self, client, logger=None, store=None):
+        self.client = client
+        self.logger = logger
+        self.store = store
+        self.devices = {}
+        self.indexes = {name: {} for name in INDEXES}
+        self.indexed = {}
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __contains__(self, key):
+        return key in self.devices
+
+    def get(self, network, device):
+        return self.devices.get((network, device))
+
+    def get_or_create(self, network, device):
+        key = (network, device)
+        upb_device = self.devices.get(key)
+        if upb_device is None:
+            registers = None
+            if self.store is not None:
+                registers = self.store.registers(network, device)
+            upb_device = self.devices[key] = UPBDevice(self.client, network, device,
+                                                       logger=self.logger, registers=registers)
+            self._index(key, self.index_values(upb_device))
+        return upb_device
+
+    def detach_store(self):
+        """Copy the registers of every device out of the register store so it can be closed."""
+        for upb_device in self.devices.values():
+            upb_device.detach_registers()
+        self.store = None
+
+    def remove(self, network, device):
+        key = (network, device)
+        self._unindex(key)
+        return self.devices.pop(key, None)
+
+    @staticmethod
+    def index_values(device):
+        """Return the value of every index for a device."""
+        upbid = device.upbid
+        manufacturer = upbid.manufacturer_id
+        product = upbid.product_id
+        kind = PRODUCTS.get(f"{manufacturer}/{product}", (None, None))[1]
+        return {
+            'network': device.network_id,
+            'manufacturer': manufacturer,
+            'product': (manufacturer, product),
+            'kind': kind,
+            'firmware': (upbid.firmware_major_version, upbid.firmware_minor_version),
+            'network_name': decode_name(upbid.network_name),
+            'room': decode_name(upbid.room_name),
+            'name': decode_name(upbid.device_name),
+        }
+
+    def _index(self, key, values):
+        for name, value in values.items():
+            self.indexes[name].setdefault(value, set()).add(key)
+        self.indexed[key] = values
+
+    def _unindex(self, key):
+        for name, value in self.indexed.pop(key, {}).items():
+            keys = self.indexes[name][value]
+            keys.discard(key)
+            if not keys:
+                del self.indexes[name][value]
+
+    def update_device(self, device, start=0, end=256):
+        """Reindex a device after registers start to end changed."""
+        if start >= UPBID_END:
+            return
+        key = (device.network_id, device.device_id)
+        values = self.index_values(device)
+        if values == self.indexed.get(key):
+            return
+        self._unindex(key)
+        self._index(key, values)
+
+    def values(self, name):
+        """Return the distinct values of an index."""
+        return list(self.indexes[name])
+
+    def find(self, **filters):
+        """Return devices matching all filters, e.g. find(kind='Keypad', room='Kitchen')."""
+        sets = []
+        for name, value in filters.items():
+            if name not in self.indexes:
+                raise ValueError(f"unknown index: {name}")
+            sets.append(self.indexes[name].get(value, set()))
+        if not sets:
+            return list(self.devices.values())
+        sets.sort(key=len)
+        keys = set(sets[0])
+        for other in sets[1:]:
+            keys &= other
+        return [self.devices[key] for key in sorted(keys)]
+
+    def firmware_below(self, version):
+        """Return devices with a (major, minor) firmware version below version."""
+        if isinstance(version, int):
+            version = (version, 0)
+        keys = set()
+        for firmware, firmware_keys in self.indexes['firmware'].items():
+            if firmware < version:
+                keys |= firmware_keys
+        return [self.devices[key] for key in sorted(keys)]
@@ -0,0 +1,168 @@
+"""
+Batched SQLite log of decoded messages and device state changes
+"""
+
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS messages (time REAL, network INTEGER, device INTEGER, "
+    "destination INTEGER, link INTEGER, mdid_set INTEGER, mdid_cmd INTEGER, "
+    "transmitted INTEGER, packet BLOB)",
+    "CREATE INDEX IF NOT EXISTS messages_device_time ON messages (network, device, time)",
+    "CREATE INDEX IF NOT EXISTS messages_time ON messages (time)",
+    "CREATE TABLE IF NOT EXISTS states (time REAL, network INTEGER, device INTEGER, "
+    "channel INTEGER, level INTEGER, source TEXT)",
+    "CREATE INDEX IF NOT EXISTS states_device_time ON states (network, device, time)",
+    "CREATE INDEX IF NOT EXISTS states_time ON states (time)",
+)
+
+
+class UPBSQLiteSink:
+    """Buffer messages and state changes and write them to SQLite in batches.
+
+    Rows are collected on the event loop and written on a single worker
+    thread, one transaction per batch, every flush_interval seconds or as
+    soon as flush_size rows are waiting. Rows older than retention seconds
+    are deleted every retention_interval seconds, None keeps everything.
+    Messages are stored with their raw packet so any report can be decoded
+    again. A batch that fails to write is kept and retried with the next
+    one, while more than max_buffered rows wait the oldest are dropped and
+    counted in dropped.
+    """
+
+    def __init__(self, path, flush_interval=1.0, flush_size=500, retention=30 * 86400,
+                 retention_interval=3600, max_buffered=100000, loop=None, logger=None):
+        if loop:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.retention = retention
+        self.retention_interval = retention_interval
+        self.max_buffered = max_buffered
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upb-sink')
+        self.db = None
+        self.messages = []
+        self.states = []
+        self.flush_needed = asyncio.Event()
+        self.last_purge = 0
+        self.written = 0
+        self.dropped = 0
+        self.client = None
+        self.subscription = None
+        self.task = None
+        self.stopping = False
+
+    def handle_message(self, response, transmitted):
+        self.messages.append((time(), response['network_id'], response['device_id'],
+                              response['destination_id'], int(response['link']),
+                              int(response['mdid_set']), int(response['mdid_cmd']),
+                              int(transmitted), response.get('packet')))
+        self._check_size()
+
+    def handle_state(self, network, device, channel, level, source):
+        self.states.append((time(), network, device, channel, level, source))
+        self._check_size()
+
+    def _check_size(self):
+        if len(self.messages) + len(self.states) >= self.flush_size:
+            self.flush_needed.set()
+
+    def _open(self):
+        self.db = sqlite3.connect(self.path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def _write(self, messages, states, purge_before):
+        """Write one batch, runs on the worker thread."""
+        if self.db is None:
+            self._open()
+        with self.db:
+            self.db.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", messages)
+            self.db.executemany("INSERT INTO states VALUES (?, ?, ?, ?, ?, ?)", states)
+            if purge_before is not None:
+                self.db.execute("DELETE FROM messages WHERE time < ?", (purge_before,))
+                self.db.execute("DELETE FROM states WHERE time < ?", (purge_before,))
+
+    def _close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    async def flush(self):
+        """Write all buffered rows."""
+        messages, self.messages = self.messages, []
+        states, self.states = self.states, []
+        self.flush_needed.clear()
+        purge_before = None
+        now = time()
+        if self.retention is not None and now - self.last_purge >= self.retention_interval:
+            self.last_purge = now
+            purge_before = now - self.retention
+        if messages or states or purge_before is not None:
+            try:
+                await self.loop.run_in_executor(self.executor, self._write, messages, states, purge_before)
+            except sqlite3.Error:
+                self._requeue(messages, states)
+                raise
+            self.written += len(messages) + len(states)
+
+    def _requeue(self, messages, states):
+        """Put back rows of a failed batch ahead of the rows collected since."""
+        self.messages = messages + self.messages
+        self.states = states + self.states
+        excess = len(self.messages) + len(self.states) - self.max_buffered
+        if excess > 0:
+            dropped_messages = min(excess, len(self.messages))
+            del self.messages[0:dropped_messages]
+            del self.states[0:excess - dropped_messages]
+            self.dropped += excess
+            self.logger.warning(f"traffic log buffer full, dropped {excess} rows")
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except sqlite3.Error as exc:
+                self.logger.error(f"failed to write traffic log: {exc}")
+
+    def start(self, client):
+        """Log messages and state changes of a client."""
+        self.client = client
+        self.subscription = client.subscribe(self.handle_message)
+        client.state_callbacks.append(self.handle_state)
+        self.task = self.loop.create_task(self.run())
+
+    async def stop(self):
+        """Flush remaining rows and close the database."""
+        if self.subscription is not None:
+            self.subscription.cancel()
+            self.subscription = None
+        if self.client is not None and self.handle_state in self.client.state_callbacks:
+            self.client.state_callbacks.remove(self.handle_state)
+        try:
+            if self.task:
+                # Let a flush in progress finish instead of losing the rows it took
+                self.stopping = True
+                self.flush_needed.set()
+                task, self.task = self.task, None
+                await task
+            await self.flush()
+        finally:
+            await self.loop.run_in_executor(self.executor, self._close)
+            self.executor.shutdown()
@@ -0,0 +1,136 @@
+"""
+Versioned binary snapshot of device signatures and register images
+
+A snapshot is a header, one record per device and an index of record
+offsets sorted by (network, device) at the end of the file, so a single
+device can be read by seeking without parsing the rest.
+"""
+
+import os
+from bisect import bisect_left
+from struct import Struct
+from time import time
+from zlib import crc32
+
+SNAPSHOT_MAGIC = b'UPBS'
+SNAPSHOT_VERSION = 1
+# magic, version, flags, device count, index offset, created, crc32 of records and index
+SNAPSHOT_HEADER = Struct('>4sHHIIII')
+# network, device, flags, id_checksum, setup_checksum, ct_bytes, register count
+SNAPSHOT_RECORD = Struct('>BBBxHHHH')
+# network, device, record offset
+SNAPSHOT_INDEX = Struct('>BBI')
+RECORD_SIGNATURE = 0x01
+
+
+def write_snapshot(path, entries):
+    """Write entries with network, device, id_checksum, setup_checksum, ct_bytes and registers."""
+    body = bytearray()
+    index = []
+    for entry in sorted(entries, key=lambda entry: (entry['network'], entry['device'])):
+        registers = bytes(entry['registers'])
+        flags = 0
+        ct_bytes = entry.get('ct_bytes')
+        if ct_bytes is not None:
+            flags |= RECORD_SIGNATURE
+            # Registers past ct_bytes are always zero
+            registers = registers[0:ct_bytes]
+        index.append((entry['network'], entry['device'], SNAPSHOT_HEADER.size + len(body)))
+        body += SNAPSHOT_RECORD.pack(entry['network'], entry['device'], flags,
+                                     entry.get('id_checksum') or 0, entry.get('setup_checksum') or 0,
+                                     ct_bytes or 0, len(registers))
+        body += registers
+    index_offset = SNAPSHOT_HEADER.size + len(body)
+    for key in index:
+        body += SNAPSHOT_INDEX.pack(*key)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(index), index_offset,
+                                  int(time()), crc32(body))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as snapshot:
+        snapshot.write(header)
+        snapshot.write(body)
+    os.replace(tmp_path, path)
+
+
+class UPBSnapshot:
+    """Random access reader of a snapshot file."""
+
+    def __init__(self, path, verify=False):
+        self.file = open(path, 'rb')
+        try:
+            self._load_index(path, verify)
+        except Exception:
+            self.close()
+            raise
+
+    def _load_index(self, path, verify):
+        header = self.file.read(SNAPSHOT_HEADER.size)
+        if len(header) < SNAPSHOT_HEADER.size:
+            raise ValueError(f"{path} is not a UPB snapshot")
+        magic, version, flags, count, index_offset, self.created, checksum = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a UPB snapshot")
+        if version > SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has unsupported snapshot version {version}")
+        if verify:
+            if crc32(self.file.read()) != checksum:
+                raise ValueError(f"{path} is corrupt")
+        self.file.seek(index_offset)
+        index = self.file.read(count * SNAPSHOT_INDEX.size)
+        self.keys = []
+        self.offsets = []
+        for network, device, offset in SNAPSHOT_INDEX.iter_unpack(index):
+            self.keys.append((network, device))
+            self.offsets.append(offset)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        position = bisect_left(self.keys, key)
+        return position < len(self.keys) and self.keys[position] == key
+
+    def _read(self, offset):
+        self.file.seek(offset)
+        network, device, flags, id_checksum, setup_checksum, ct_bytes, count = \
+            SNAPSHOT_RECORD.unpack(self.file.read(SNAPSHOT_RECORD.size))
+        registers = self.file.read(count)
+        entry = {
+            'network': network,
+            'device': device,
+            'id_checksum': None,
+            'setup_checksum': None,
+            'ct_bytes': None,
+            'registers': registers + bytes(256 - len(registers))
+        }
+        if flags & RECORD_SIGNATURE:
+            entry['id_checksum'] = id_checksum
+            entry['setup_checksum'] = setup_checksum
+            entry['ct_bytes'] = ct_bytes
+        return entry
+
+    def get(self, network, device):
+        """Return the entry of a device or None."""
+        position = bisect_left(self.keys, (network, device))
+        if position == len(self.keys) or self.keys[position] != (network, device):
+            return None
+        return self._read(self.offsets[position])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield self._read(offset)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_snapshot(path, verify=True):
+    """Return {(network, device): entry} of every device in a snapshot."""
+    with UPBSnapshot(path, verify=verify) as snapshot:
+        return {(entry['network'], entry['device']): entry for entry in snapshot}
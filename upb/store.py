@@ -0,0 +1,99 @@
+"""
+Register images of all devices in one memory-mapped file
+"""
+
+import mmap
+import os
+from struct import Struct
+
+STORE_MAGIC = b'UPBR'
+STORE_VERSION = 1
+STORE_HEADER = Struct('>4sHH')
+SLOT_SIZE = 256
+SLOT_COUNT = 256 * 256
+# Per slot flags, ct_bytes, id_checksum and setup_checksum
+SLOT_META = Struct('>BxHHH')
+SLOT_PRESENT = 0x01
+SLOT_SIGNATURE = 0x02
+META_OFFSET = 4096
+REGISTERS_OFFSET = META_OFFSET + SLOT_META.size * SLOT_COUNT
+STORE_SIZE = REGISTERS_OFFSET + SLOT_SIZE * SLOT_COUNT
+
+
+class UPBRegisterStore:
+    """Fixed 256 byte register slots for every network and device id.
+
+    Slot network * 256 + device holds the registers of a device, a metadata
+    table records which slots are in use and the last known signature. With
+    a path the map is backed by a sparse file shared with other processes
+    and kept across restarts, without it the map is anonymous memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.fd = None
+            self.map = mmap.mmap(-1, STORE_SIZE)
+            STORE_HEADER.pack_into(self.map, 0, STORE_MAGIC, STORE_VERSION, SLOT_SIZE)
+        else:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, STORE_SIZE)
+                os.pwrite(self.fd, STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, SLOT_SIZE), 0)
+            self.map = mmap.mmap(self.fd, STORE_SIZE)
+            magic, version, slot_size = STORE_HEADER.unpack_from(self.map, 0)
+            if magic != STORE_MAGIC or version != STORE_VERSION or slot_size != SLOT_SIZE:
+                self.close()
+                raise ValueError(f"{path} is not a version {STORE_VERSION} register store")
+
+    @staticmethod
+    def slot(network, device):
+        return network * 256 + device
+
+    def registers(self, network, device):
+        """Return a writable view of the registers of a device and mark the slot in use."""
+        slot = self.slot(network, device)
+        meta_offset = META_OFFSET + slot * SLOT_META.size
+        flags = self.map[meta_offset]
+        if not flags & SLOT_PRESENT:
+            self.map[meta_offset] = flags | SLOT_PRESENT
+        start = REGISTERS_OFFSET + slot * SLOT_SIZE
+        return memoryview(self.map)[start:start + SLOT_SIZE]
+
+    def set_signature(self, network, device, id_checksum, setup_checksum, ct_bytes):
+        meta_offset = META_OFFSET + self.slot(network, device) * SLOT_META.size
+        flags = self.map[meta_offset] | SLOT_PRESENT | SLOT_SIGNATURE
+        SLOT_META.pack_into(self.map, meta_offset, flags, ct_bytes, id_checksum, setup_checksum)
+
+    def signature(self, network, device):
+        """Return (id_checksum, setup_checksum, ct_bytes) or None if not known."""
+        meta_offset = META_OFFSET + self.slot(network, device) * SLOT_META.size
+        flags, ct_bytes, id_checksum, setup_checksum = SLOT_META.unpack_from(self.map, meta_offset)
+        if not flags & SLOT_SIGNATURE:
+            return None
+        return id_checksum, setup_checksum, ct_bytes
+
+    def devices(self):
+        """Return (network, device) of every slot in use."""
+        flags = self.map[META_OFFSET:REGISTERS_OFFSET:SLOT_META.size]
+        return [divmod(slot, 256) for slot, flag in enumerate(flags) if flag & SLOT_PRESENT]
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        """Release the map.
+
+        Devices still using register views of the store must be detached
+        first with UPBDeviceRegistry.detach_store(), otherwise BufferError
+        is raised and the store stays open.
+        """
+        if not self.map.closed:
+            try:
+                self.map.close()
+            except BufferError:
+                raise BufferError("register store is still used by device registers, "
+                                  "detach them before closing") from None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
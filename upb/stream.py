@@ -0,0 +1,87 @@
+"""
+Buffered async iteration over decoded UPB messages
+"""
+
+import asyncio
+from collections import deque
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+
+class UPBMessageStream:
+    """Async iterator of decoded messages matching a subscription filter.
+
+    Messages are queued by the decoder without waiting, so a slow consumer
+    never delays the protocol. When the queue is full drop_oldest discards
+    the oldest queued message, drop_newest discards the incoming one and
+    block holds up to overflow_size more messages aside until the consumer
+    catches up, defaulting to maxsize. Messages past that are dropped.
+    """
+
+    def __init__(self, router, maxsize=256, policy=DROP_OLDEST, include_transmitted=False,
+                 network=None, source=None, destination=None, link=None, mdid=None,
+                 overflow_size=None):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError(f"unknown drop policy: {policy}")
+        self.policy = policy
+        self.include_transmitted = include_transmitted
+        self.queue = asyncio.Queue(maxsize)
+        self.overflow = deque()
+        self.overflow_size = maxsize if overflow_size is None else overflow_size
+        self.received = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.closed = False
+        self.subscription = router.subscribe(self._put, network, source, destination, link, mdid)
+
+    def _put(self, response, transmitted):
+        if transmitted and not self.include_transmitted:
+            return
+        self.received += 1
+        if self.overflow or (self.queue.full() and self.policy == BLOCK):
+            if len(self.overflow) >= self.overflow_size:
+                self.dropped += 1
+                return
+            self.blocked += 1
+            self.overflow.append(response)
+            return
+        if self.queue.full():
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(response)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed and self.queue.empty():
+            raise StopAsyncIteration
+        response = await self.queue.get()
+        if response is None:
+            raise StopAsyncIteration
+        if self.overflow:
+            self.queue.put_nowait(self.overflow.popleft())
+        return response
+
+    def close(self):
+        """Stop receiving, messages already queued are still returned."""
+        if self.closed:
+            return
+        self.closed = True
+        self.subscription.cancel()
+        # The end marker waits aside like a blocked message if the queue is full
+        if self.overflow or self.queue.full():
+            self.overflow.append(None)
+        else:
+            self.queue.put_nowait(None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
@@ -0,0 +1,104 @@
+"""
+Indexed subscriptions to decoded UPB messages
+"""
+
+import logging
+
+
+class UPBSubscription:
+    """Handle of a registered subscription."""
+
+    def __init__(self, router, key, callback):
+        self.router = router
+        self.key = key
+        self.callback = callback
+
+    @property
+    def active(self):
+        return self.router is not None
+
+    def cancel(self):
+        if self.router is not None:
+            self.router.remove(self)
+            self.router = None
+
+
+class UPBSubscriptionRouter:
+    """Route messages to subscribers filtered by network, source, destination and MDID.
+
+    Subscriptions are indexed by their filter with None for each unset field,
+    so a message only costs one dict lookup for every combination of fields
+    some subscriber leaves unset, plus a call per matching subscriber.
+    An exception raised by a subscriber is logged and does not stop the
+    dispatch to the others.
+    """
+
+    def __init__(self, logger=None):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.index = {}
+        self.masks = {}
+
+    @staticmethod
+    def make_key(network=None, source=None, destination=None, link=None, mdid=None):
+        if destination is not None and link is not None:
+            raise ValueError("destination and link filters are exclusive")
+        if link is not None:
+            target = (True, link)
+        elif destination is not None:
+            target = (False, destination)
+        else:
+            target = None
+        return (network, source, target, mdid)
+
+    def subscribe(self, callback, network=None, source=None, destination=None, link=None, mdid=None):
+        """Call callback(response, transmitted) for matching messages.
+
+        mdid is a (mdid_set, mdid_cmd) tuple. Returns a UPBSubscription that
+        is cancelled to unsubscribe.
+        """
+        key = self.make_key(network, source, destination, link, mdid)
+        subscription = UPBSubscription(self, key, callback)
+        subscribers = self.index.get(key)
+        if subscribers is None:
+            subscribers = self.index[key] = []
+        subscribers.append(subscription)
+        mask = tuple(field is not None for field in key)
+        self.masks[mask] = self.masks.get(mask, 0) + 1
+        return subscription
+
+    def remove(self, subscription):
+        key = subscription.key
+        subscribers = self.index.get(key)
+        if subscribers is None or subscription not in subscribers:
+            return
+        # Copy on write so a dispatch in progress is not disturbed
+        subscribers = [other for other in subscribers if other is not subscription]
+        if subscribers:
+            self.index[key] = subscribers
+        else:
+            del self.index[key]
+        mask = tuple(field is not None for field in key)
+        self.masks[mask] -= 1
+        if self.masks[mask] == 0:
+            del self.masks[mask]
+
+    def __len__(self):
+        return sum(len(subscribers) for subscribers in self.index.values())
+
+    def dispatch(self, response, transmitted):
+        if not self.index:
+            return
+        fields = (response['network_id'], response['device_id'],
+                  (response['link'], response['destination_id']),
+                  (response['mdid_set'], response['mdid_cmd']))
+        for mask in list(self.masks):
+            key = tuple(field if used else None for field, used in zip(fields, mask))
+            for subscription in self.index.get(key, ()):
+                try:
+                    subscription.callback(response, transmitted)
+                except Exception:
+                    self.logger.exception(f"subscriber {subscription.callback!r} failed")
+
@@ -0,0 +1,146 @@
+"""
+Thread-safe synchronous client running the asyncio client on its own loop thread
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+from upb.client import UPBClient
+
+
+class UPBSyncClient:
+    """Share one PIM connection between any number of threads.
+
+    The client runs on an event loop owned by a background thread. Every
+    request method blocks until the result is available, the submit_* variants
+    return a concurrent.futures.Future instead so callers can issue requests
+    without waiting on each other. Requests from all threads go through the
+    same priority queue. Callbacks registered on the client run on the loop
+    thread.
+    """
+
+    def __init__(self, host, port=2101, request_timeout=None, logger=None, **kwargs):
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.request_timeout = request_timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name='upb-loop', daemon=True)
+        self.thread.start()
+        self.client = None
+        try:
+            self._submit(self._connect(host, port, kwargs)).result()
+        except BaseException:
+            self._stop_loop()
+            raise
+
+    async def _connect(self, host, port, kwargs):
+        self.client = UPBClient(host, port=port, loop=self.loop, logger=self.logger, **kwargs)
+        try:
+            # Timed out on the loop so the cancelled setup has finished when this raises
+            await asyncio.wait_for(self.client.setup(), self.request_timeout)
+        except asyncio.TimeoutError:
+            raise concurrent.futures.TimeoutError() from None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _call(self, coro, timeout=None):
+        future = self._submit(coro)
+        try:
+            return future.result(self.request_timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def run(self, func, *args, **kwargs):
+        """Call a plain function on the loop thread and return its result."""
+        async def call():
+            return func(*args, **kwargs)
+        return self._call(call())
+
+    def submit(self, method, *args, **kwargs):
+        """Start a client coroutine method by name, returns a concurrent.futures.Future."""
+        return self._submit(getattr(self.client, method)(*args, **kwargs))
+
+    def call(self, method, *args, timeout=None, **kwargs):
+        """Run a client coroutine method by name and wait for its result."""
+        return self._call(getattr(self.client, method)(*args, **kwargs), timeout)
+
+    def submit_report_state(self, network, device):
+        return self.submit('report_state', network, device)
+
+    def report_state(self, network, device, timeout=None):
+        """Fetch the current channel levels of a device."""
+        return self.call('report_state', network, device, timeout=timeout)
+
+    def submit_update_signature(self, network, device):
+        return self.submit('update_signature', network, device)
+
+    def update_signature(self, network, device, timeout=None):
+        return self.call('update_signature', network, device, timeout=timeout)
+
+    def submit_get_registers(self, network, device):
+        return self.submit('get_registers', network, device)
+
+    def get_registers(self, network, device, timeout=None):
+        """Dump the registers of a device."""
+        return self.call('get_registers', network, device, timeout=timeout)
+
+    def activate_link(self, network, link, timeout=None):
+        return self.call('activate_link', network, link, timeout=timeout)
+
+    def deactivate_link(self, network, link, timeout=None):
+        return self.call('deactivate_link', network, link, timeout=timeout)
+
+    def goto(self, network, device, level, rate=None, channel=None, link=False, timeout=None):
+        return self.call('goto', network, device, level, rate, channel, link, timeout=timeout)
+
+    def set_levels(self, levels, rate=None, timeout=None):
+        return self.call('set_levels', levels, rate, timeout=timeout)
+
+    def get_signal_strength(self, network, device, timeout=None):
+        return self.call('get_signal_strength', network, device, timeout=timeout)
+
+    def get_noise_level(self, network, device, timeout=None):
+        return self.call('get_noise_level', network, device, timeout=timeout)
+
+    def get_levels(self, network, device):
+        """Return a copy of the last known channel levels of a device."""
+        return self.run(lambda: dict(self.client.get_device(network, device).levels))
+
+    def close(self):
+        """Disconnect and stop the loop thread."""
+        if self.loop.is_closed():
+            return
+        self._stop_loop()
+
+    async def _shutdown(self):
+        """Stop the client and wait for the tasks left on the loop."""
+        if self.client is not None:
+            self.client.stop()
+        # Let the closed transport report the lost connection
+        await asyncio.sleep(0)
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _stop_loop(self):
+        self._submit(self._shutdown()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,305 @@
+"""
+Timed event controller flash memory and sunrise, sunset and DST lookup
+
+The TEC keeps its clock, sun times and DST dates in memory from 0x100,
+past the 256 registers reachable with the one byte register address.
+Extended reads send a two byte big endian address followed by the
+register count and the report echoes the two byte address before the
+values.
+
+Suntime entries hold the signed change in minutes from the previous day,
+sunrise in the high nibble and sunset in the low nibble, starting from the
+January 1 times. Days are indexed in a leap year so February 29 always
+has an entry.
+
+Timed events fire on the days set in time1, bit 0 is Sunday. time2 holds
+the hour in its low five bits and the time reference in its top two bits,
+clock time, sunrise or sunset. Times relative to the sun are an offset of
+hours and minutes, negative when bit 5 of time2 is set. vary is the random
+variation in minutes and transmit_cmd the MDID sent to transmit_link.
+"""
+
+import asyncio
+import heapq
+import logging
+from array import array
+from ctypes import sizeof
+from datetime import datetime, time, timedelta
+
+from upb.const import MdidSet, MdidDeviceControlCmd
+from upb.core import decode_mdid
+from upb.memory import UPBKindTEC
+from upb.register import TECFlash, UPBTEC
+
+TEC_FLASH_START = 0x100
+TEC_FLASH_SIZE = sizeof(TECFlash)
+# (offset, count) of the flash that is read, the gap before the DST table is skipped
+TEC_FLASH_RANGES = (
+    (0, TECFlash.reserved1.offset),
+    (TECFlash.dst_table.offset, TEC_FLASH_SIZE - TECFlash.dst_table.offset),
+)
+# Values per extended read, the two byte address leaves 15 in a 24 byte packet
+EXTENDED_READ_MAX = 15
+DST_FIRST_YEAR = 2006
+# Leap year day index of the first day of each month
+MONTH_START = (0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335)
+
+
+def decode_extended_registers(response):
+    """Return (address, values) of an extended register report."""
+    register_val = response['register_val']
+    return (response['setup_register'] << 8) | register_val[0], register_val[1:]
+
+
+def day_index(month, day):
+    """Return the leap year day index of a month and day, or None if unset."""
+    if not 1 <= month <= 12 or day < 1:
+        return None
+    return MONTH_START[month - 1] + day - 1
+
+
+def nibble(value):
+    return value - 16 if value & 0x08 else value
+
+
+class UPBTECSchedule:
+    """Sun times and DST dates of a TEC decoded once into lookup arrays.
+
+    sunrise and sunset hold standard time minutes after midnight for each
+    leap year day index, dst_start and dst_end hold the day index DST
+    begins and ends for each year from 2006.
+    """
+
+    def __init__(self, flash):
+        flash = TECFlash.from_buffer_copy(bytes(flash[0:TEC_FLASH_SIZE]))
+        self.clock = bytes(flash.clock)
+        self.sunrise = array('H')
+        self.sunset = array('H')
+        sunrise = flash.jan_1_sunrise_hours * 60 + flash.jan_1_sunrise_minutes
+        sunset = flash.jan_1_sunset_hours * 60 + flash.jan_1_sunset_minutes
+        for day, delta in enumerate(flash.suntime_table):
+            if day:
+                sunrise += nibble(delta >> 4)
+                sunset += nibble(delta & 0x0f)
+            self.sunrise.append(sunrise % 1440)
+            self.sunset.append(sunset % 1440)
+        self.dst_start = array('h')
+        self.dst_end = array('h')
+        for dst in flash.dst_table:
+            self._add_dst(dst.start_month, dst.start_day, dst.end_month, dst.end_day)
+        self.current_dst = (day_index(flash.dst_start_month, flash.dst_start_day),
+                            day_index(flash.dst_stop_month, flash.dst_stop_day))
+
+    def _add_dst(self, start_month, start_day, end_month, end_day):
+        start = day_index(start_month, start_day)
+        end = day_index(end_month, end_day)
+        if start is None or end is None:
+            start = end = -1
+        self.dst_start.append(start)
+        self.dst_end.append(end)
+
+    def dst_days(self, year):
+        """Return the (start, end) day index of DST in a year, or None without DST."""
+        position = year - DST_FIRST_YEAR
+        if 0 <= position < len(self.dst_start):
+            start = self.dst_start[position]
+            end = self.dst_end[position]
+            if start < 0:
+                return None
+            return start, end
+        start, end = self.current_dst
+        if start is None or end is None:
+            return None
+        return start, end
+
+    def is_dst(self, date):
+        days = self.dst_days(date.year)
+        if days is None:
+            return False
+        start, end = days
+        day = day_index(date.month, date.day)
+        if start <= end:
+            return start <= day < end
+        # Southern hemisphere, DST spans the new year
+        return day >= start or day < end
+
+    def sun_times(self, date):
+        """Return local (sunrise, sunset) minutes after midnight on a date."""
+        day = day_index(date.month, date.day)
+        offset = 60 if self.is_dst(date) else 0
+        return self.sunrise[day] + offset, self.sunset[day] + offset
+
+
+EVENT_CLOCK = 0
+EVENT_SUNRISE = 1
+EVENT_SUNSET = 2
+
+
+class UPBTimedEvent:
+    """A decoded entry of a TEC event table."""
+
+    def __init__(self, network, device, index, event):
+        self.network = network
+        self.device = device
+        self.index = index
+        self.days = event.time1 & 0x7f
+        self.reference = event.time2 >> 6
+        self.offset = (event.time2 & 0x1f) * 60 + event.minute
+        if self.reference != EVENT_CLOCK and event.time2 & 0x20:
+            self.offset = -self.offset
+        self.vary = event.vary
+        self.link = event.transmit_link
+        self.mdid_set, self.mdid_cmd = decode_mdid(event.transmit_cmd)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({self.network}:{self.device}[{self.index}] "
+                f"days={self.days:#04x} reference={self.reference} offset={self.offset} link={self.link})")
+
+    def minutes(self, date, schedule):
+        """Return the minutes after midnight the event fires on a date, or None."""
+        if self.reference == EVENT_CLOCK:
+            return self.offset
+        if schedule is None:
+            return None
+        sunrise, sunset = schedule.sun_times(date)
+        if self.reference == EVENT_SUNRISE:
+            return sunrise + self.offset
+        if self.reference == EVENT_SUNSET:
+            return sunset + self.offset
+        return None
+
+    def next_fire(self, after, schedule=None):
+        """Return the first time after a datetime the event fires, or None."""
+        if not self.days:
+            return None
+        for day in range(8):
+            date = after.date() + timedelta(days=day)
+            # Python weeks start on Monday, event days on Sunday
+            if not self.days & (1 << ((date.weekday() + 1) % 7)):
+                continue
+            minutes = self.minutes(date, schedule)
+            if minutes is None:
+                return None
+            fire = datetime.combine(date, time()) + timedelta(minutes=minutes)
+            if fire > after:
+                return fire
+        return None
+
+
+class UPBTECEvaluator:
+    """Predict link activations of timed event controllers.
+
+    The next fire time of every event of every controller is kept in one
+    min-heap. When an event comes due the levels its link presets lead to
+    are reported as state updates with source 'schedule', before the TEC
+    transmits and without polling the devices. Controllers whose sun and
+    DST tables were read with update_tec_schedule() also evaluate sunrise
+    and sunset events, others only clock events.
+    """
+
+    def __init__(self, client, clock=datetime.now, loop=None, logger=None):
+        if loop:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.clock = clock
+        self.events = {}
+        self.generations = {}
+        self.heap = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.fired = 0
+
+    def add_controller(self, network, device):
+        """Decode the event table of a TEC and schedule its events."""
+        key = (network, device)
+        upb_device = self.client.get_device(network, device)
+        if upb_device.product not in UPBKindTEC:
+            raise ValueError(f"{network}:{device} is not a timed event controller")
+        reg = UPBTEC.from_buffer(upb_device.registers)
+        count = min(reg.ct_events_in_use, len(reg.event_table))
+        self.events[key] = [UPBTimedEvent(network, device, index, reg.event_table[index])
+                            for index in range(count)]
+        # Heap entries of an older generation are skipped when popped
+        self.generations[key] = self.generations.get(key, 0) + 1
+        now = self.clock()
+        for event in self.events[key]:
+            self._schedule(event, now)
+        self.wakeup.set()
+
+    def remove_controller(self, network, device):
+        key = (network, device)
+        self.events.pop(key, None)
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def _schedule(self, event, after):
+        key = (event.network, event.device)
+        fire = event.next_fire(after, self.client.tec_schedules.get(key))
+        if fire is not None:
+            heapq.heappush(self.heap, (fire, event.network, event.device, event.index, self.generations[key]))
+
+    def _current(self, entry):
+        fire, network, device, index, generation = entry
+        return self.generations.get((network, device)) == generation
+
+    def upcoming(self, until):
+        """Return (fire time, event) of the next firing of each event due before until."""
+        entries = sorted(entry for entry in self.heap if entry[0] < until and self._current(entry))
+        return [(fire, self.events[(network, device)][index]) for fire, network, device, index, generation in entries]
+
+    def predict_event(self, event):
+        """Return {(network, device, channel): level} an event leads to."""
+        if event.mdid_set != MdidSet.MDID_DEVICE_CONTROL_COMMANDS:
+            return {}
+        link_index = self.client.link_index
+        if event.mdid_cmd == MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_ACTIVATELINK:
+            return link_index.predict(event.network, event.link)
+        if event.mdid_cmd == MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_DEACTIVATELINK:
+            return dict.fromkeys(link_index.members(event.network, event.link), 0)
+        return {}
+
+    def predict(self, until):
+        """Return {(network, device, channel): (fire time, level)} of the first change of each device."""
+        predicted = {}
+        for fire, event in self.upcoming(until):
+            for member, level in self.predict_event(event).items():
+                predicted.setdefault(member, (fire, level))
+        return predicted
+
+    def _fire(self, fire, event):
+        self.fired += 1
+        self.logger.debug(f"Timed event {event!r} due at {fire}")
+        for (network, device, channel), level in self.predict_event(event).items():
+            self.client.handle_state_update(network, device, channel, level, 'schedule')
+        self._schedule(event, fire)
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            while self.heap and not self._current(self.heap[0]):
+                heapq.heappop(self.heap)
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = (self.heap[0][0] - self.clock()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            fire, network, device, index, generation = heapq.heappop(self.heap)
+            self._fire(fire, self.events[(network, device)][index])
+
+    def start(self):
+        self.task = self.loop.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
@@ -0,0 +1,201 @@
+"""
+Signal and noise telemetry kept in fixed size array ring buffers
+"""
+
+import asyncio
+import logging
+from array import array
+from time import time
+
+from upb.airtime import UPBAirtimeBudget, packet_airtime
+from upb.const import MdidSet, MdidCoreReport, UpbPriority
+from upb.util import encode_signal_strength_request, encode_noise_level_request
+
+
+class UPBRingBuffer:
+    """Fixed size ring buffer backed by an array."""
+
+    def __init__(self, size, typecode='f'):
+        self.size = size
+        self.data = array(typecode, [0] * size)
+        self.index = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        self.data[self.index] = value
+        self.index += 1
+        if self.index == self.size:
+            self.index = 0
+        if self.count < self.size:
+            self.count += 1
+
+    def values(self):
+        """Return the stored values from oldest to newest."""
+        if self.count < self.size:
+            return self.data[0:self.count].tolist()
+        return self.data[self.index:].tolist() + self.data[0:self.index].tolist()
+
+
+class UPBTelemetryTier:
+    """Min, max and average of a series downsampled to fixed periods."""
+
+    def __init__(self, period, size):
+        self.period = period
+        self.start = UPBRingBuffer(size, 'd')
+        self.min = UPBRingBuffer(size, 'f')
+        self.max = UPBRingBuffer(size, 'f')
+        self.avg = UPBRingBuffer(size, 'f')
+        self.bucket = None
+        self.bucket_min = 0
+        self.bucket_max = 0
+        self.bucket_sum = 0
+        self.bucket_count = 0
+
+    def add(self, timestamp, value):
+        bucket = timestamp - timestamp % self.period
+        if self.bucket_count and bucket != self.bucket:
+            self.flush()
+        if self.bucket_count == 0:
+            self.bucket = bucket
+            self.bucket_min = value
+            self.bucket_max = value
+        else:
+            self.bucket_min = min(self.bucket_min, value)
+            self.bucket_max = max(self.bucket_max, value)
+        self.bucket_sum += value
+        self.bucket_count += 1
+
+    def flush(self):
+        """Store the current period."""
+        if self.bucket_count:
+            self.start.append(self.bucket)
+            self.min.append(self.bucket_min)
+            self.max.append(self.bucket_max)
+            self.avg.append(self.bucket_sum / self.bucket_count)
+            self.bucket_sum = 0
+            self.bucket_count = 0
+
+    def samples(self):
+        """Return (period start, min, max, avg) tuples including the current period."""
+        samples = list(zip(self.start.values(), self.min.values(), self.max.values(), self.avg.values()))
+        if self.bucket_count:
+            samples.append((self.bucket, self.bucket_min, self.bucket_max, self.bucket_sum / self.bucket_count))
+        return samples
+
+
+class UPBTelemetrySeries:
+    """Raw readings plus hourly and daily downsampled tiers."""
+
+    def __init__(self, raw_size=256, tiers=((3600, 744), (86400, 1096))):
+        self.time = UPBRingBuffer(raw_size, 'd')
+        self.value = UPBRingBuffer(raw_size, 'f')
+        self.tiers = [UPBTelemetryTier(period, size) for period, size in tiers]
+
+    def add(self, timestamp, value):
+        self.time.append(timestamp)
+        self.value.append(value)
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+
+    def samples(self):
+        """Return (timestamp, value) tuples of the raw readings."""
+        return list(zip(self.time.values(), self.value.values()))
+
+
+class UPBTelemetrySampler:
+    """Periodically sample device signal and noise levels on a low airtime budget.
+
+    Series are keyed by (network, device, 'signal'), (network, device, 'noise')
+    and ('pim', 'noisefloor'). Signal and noise values in device signatures
+    seen on the network are recorded as well.
+    """
+
+    def __init__(self, client, devices=(), interval=900, airtime_share=0.02,
+                 max_utilization=0.3, timeout=30, quiet_timeout=60, loop=None, logger=None):
+        if loop:
+            self.loop = loop
+        else:
+            self.loop = asyncio.get_event_loop()
+        if logger:
+            self.logger = logger
+        else:
+            self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.devices = list(devices)
+        self.interval = interval
+        self.max_utilization = max_utilization
+        self.timeout = timeout
+        self.quiet_timeout = quiet_timeout
+        self.budget = UPBAirtimeBudget(airtime_share, burst=1.0, loop=self.loop)
+        self.series = {}
+        self.task = None
+
+    def record(self, key, value, timestamp=None):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = UPBTelemetrySeries()
+        series.add(time() if timestamp is None else timestamp, value)
+
+    def handle_message(self, response, transmitted):
+        if transmitted or response['mdid_set'] != MdidSet.MDID_CORE_REPORTS:
+            return
+        key = (response['network_id'], response['device_id'])
+        mdid_cmd = response['mdid_cmd']
+        if mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_DEVICESIGNATURE:
+            self.record(key + ('signal',), response['device_signal'])
+            self.record(key + ('noise',), response['device_noise'])
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_SIGNALSTRENGTH:
+            self.record(key + ('signal',), response['signal_strength'])
+        elif mdid_cmd == MdidCoreReport.MDID_DEVICE_CORE_REPORT_NOISELEVEL:
+            self.record(key + ('noise',), response['noise_level'])
+
+    async def _wait_for_quiet_line(self):
+        """Wait up to quiet_timeout seconds for utilization to drop, return False if it did not."""
+        deadline = self.loop.time() + self.quiet_timeout
+        while self.client.pulse.sample_utilization() > self.max_utilization:
+            # No new lines on an idle or disconnected link leave utilization unchanged
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(self.interval / 20, remaining))
+        return True
+
+    async def sample_device(self, network, device):
+        """Request signal strength and noise level, replies are recorded by handle_message."""
+        for encode, request in ((encode_signal_strength_request, self.client.get_signal_strength),
+                                (encode_noise_level_request, self.client.get_noise_level)):
+            if not await self._wait_for_quiet_line():
+                self.logger.warning(f"Device {network}:{device} telemetry skipped, line busy")
+                return
+            await self.budget.acquire(packet_airtime(encode(network, device)))
+            try:
+                await asyncio.wait_for(request(network, device, UpbPriority.LOW), self.timeout)
+            except asyncio.TimeoutError:
+                self.logger.warning(f"Device {network}:{device} telemetry request timed out")
+            except ConnectionError as exc:
+                self.logger.warning(f"Device {network}:{device} telemetry request failed: {exc}")
+
+    async def run(self):
+        while True:
+            if self.client.is_connected:
+                try:
+                    self.record(('pim', 'noisefloor'), await self.client.pim_get_noisefloor(UpbPriority.LOW))
+                except ConnectionError as exc:
+                    self.logger.warning(f"PIM noise floor request failed: {exc}")
+                for network, device in list(self.devices):
+                    await self.sample_device(network, device)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.client.message_callbacks.append(self.handle_message)
+        self.task = self.loop.create_task(self.run())
+
+    def stop(self):
+        if self.handle_message in self.client.message_callbacks:
+            self.client.message_callbacks.remove(self.handle_message)
+        if self.task:
+            self.task.cancel()
+            self.task = None
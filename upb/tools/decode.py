@@ -0,0 +1,150 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from enum import Enum
+
+from upb.const import UpbMessage
+from upb.core import UPBPulseCore, MessageReceived, MessageTransmitted, MessageInvalid
+from upb.util import validate_checksums
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['line', 'direction', 'network_id', 'destination_id', 'device_id', 'link',
+           'mdid_set', 'mdid_cmd', 'transmit_cnt', 'transmit_seq', 'valid', 'crc_ok', 'packet', 'error']
+
+MESSAGE_START = (UpbMessage.UPB_MESSAGE_START.value, UpbMessage.UPB_MESSAGE_SYNC.value)
+
+
+def iter_chunks(capture, chunk_lines, block_size=1 << 20):
+    """Read a capture file and yield (first line number, lines) chunks split at message start lines."""
+    pending = b''
+    lines = []
+    start = 0
+    while True:
+        block = capture.read(block_size)
+        split = (pending + block.replace(b'\n', b'\r')).split(b'\r')
+        # The last line of a block may continue in the next one
+        pending = split.pop() if block else b''
+        for line in split:
+            if len(lines) >= chunk_lines and len(line) > 0 and line[0] in MESSAGE_START:
+                yield start, lines
+                start += len(lines)
+                lines = []
+            lines.append(line)
+        if not block:
+            break
+    yield start, lines
+
+
+def message_record(line_no, direction, response, packet):
+    record = {'line': line_no, 'direction': direction, 'packet': packet.hex()}
+    for key, value in response.items():
+        if isinstance(value, Enum):
+            value = value.name
+        elif isinstance(value, (bytes, bytearray)):
+            value = value.hex()
+        record[key] = value
+    return record
+
+
+def decode_chunk(chunk):
+    """Decode the lines of one chunk into message records."""
+    first_line, lines = chunk
+    # Checksums of the whole chunk are validated in one batch below. Every
+    # copy is kept, suppressing repeats by time would depend on decode speed
+    core = UPBPulseCore(logger=logger, dedupe_window=None, verify_checksums=False)
+    records = []
+    checked = []
+    packets = bytearray()
+    offsets = []
+    for line_no, line in enumerate(lines, first_line + 1):
+        try:
+            events = core.receive_line(line)
+        except Exception as exc:
+            # Keep decoding, the frame in progress is lost
+            core.set_state_zero()
+            records.append({'line': line_no, 'direction': 'error', 'valid': False,
+                            'crc_ok': False, 'error': repr(exc)})
+            continue
+        for event in events:
+            if type(event) is MessageInvalid:
+                direction = 'tx' if event.transmitted else 'rx'
+                records.append(message_record(line_no, direction, event.response, event.packet))
+                continue
+            if type(event) is MessageReceived:
+                direction = 'rx'
+            elif type(event) is MessageTransmitted:
+                direction = 'tx'
+            else:
+                continue
+            record = message_record(line_no, direction, event.response, event.packet)
+            records.append(record)
+            checked.append(record)
+            offsets.append(len(packets))
+            packets += event.packet
+    for record, crc_ok in zip(checked, validate_checksums(packets, offsets)):
+        record['crc_ok'] = crc_ok
+    return records
+
+
+def decode_chunks(executor, chunks, max_pending):
+    """Decode chunks in capture order with at most max_pending chunks submitted at once."""
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(decode_chunk, chunk))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UPB Decode PIM Capture')
+
+    parser.add_argument('capture', type=str,
+                        help='Raw PIM capture file to decode')
+
+    parser.add_argument('--output', dest='output', type=str, default=None,
+                        help='Output file, defaults to stdout')
+
+    parser.add_argument('--format', dest='format', choices=['ndjson', 'csv'], default='ndjson',
+                        help='Output format')
+
+    parser.add_argument('--jobs', dest='jobs', type=int, default=os.cpu_count(),
+                        help='Number of decoder processes')
+
+    parser.add_argument('--chunk-lines', dest='chunk_lines', type=int, default=200000,
+                        help='Approximate number of capture lines per chunk')
+
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    with ExitStack() as stack:
+        capture = stack.enter_context(open(options.capture, 'rb'))
+        if options.output is None:
+            output = sys.stdout
+        else:
+            output = stack.enter_context(open(options.output, 'w', newline=''))
+        if options.format == 'csv':
+            writer = csv.DictWriter(output, fieldnames=COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+        invalid = 0
+        with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+            chunks = iter_chunks(capture, options.chunk_lines)
+            for records in decode_chunks(executor, chunks, (options.jobs or 1) * 2):
+                invalid += sum(1 for record in records if not record['valid'])
+                if options.format == 'csv':
+                    writer.writerows(records)
+                else:
+                    output.writelines(json.dumps(record) + '\n' for record in records)
+        if invalid:
+            logger.warning(f"{invalid} invalid frames")
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,12 @@
 import asyncio
 import argparse
+import json
 import logging
-from pprint import pformat
+import os
+from time import monotonic
 from upb import create_upb_connection
+from upb.snapshot import read_snapshot, write_snapshot
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 parser = argparse.ArgumentParser(description='UPB Dump Registers')
@@ -19,8 +21,8 @@ parser.add_argument('--port', dest='port', type=int, default=2101,
 parser.add_argument('--network', dest='network', type=int,
                     help='Network device is on')
 
-parser.add_argument('--device', dest='device', type=int,
-                    help='Device to connect to')
+parser.add_argument('--device', dest='device', type=str,
+                    help='Devices to dump, e.g. 5 or 1-10,12 or 2:7 for another network')
 
 parser.add_argument('--user', dest='username', type=str,
                     help='Username for pulseworx gateway')
@@ -28,23 +30,132 @@ parser.add_argument('--user', dest='username', type=str,
 parser.add_argument('--pass', dest='password', type=str,
                     help='Password for pulseworx gateway')
 
-options = parser.parse_args()
+parser.add_argument('--concurrency', dest='concurrency', type=int, default=4,
+                    help='Maximum number of devices queued at once')
 
+parser.add_argument('--timeout', dest='timeout', type=float, default=120,
+                    help='Seconds to wait for a single device')
 
-async def main():
+parser.add_argument('--output', dest='output', type=str,
+                    help='Write registers to a .json file or a binary snapshot')
+
+parser.add_argument('--previous', dest='previous', type=str,
+                    help='Previous output, devices with unchanged signatures are not dumped again')
+
+parser.add_argument('--verbose', dest='verbose', action='store_true',
+                    help='Enable debug logging')
+
+
+def parse_device_list(spec, network):
+    """Parse a device list like 1-5,9,2:7 into (network, device) tuples."""
+    devices = []
+    for item in spec.split(','):
+        item_network = network
+        if ':' in item:
+            item_network, item = item.split(':', 1)
+            item_network = int(item_network)
+        if '-' in item:
+            first, last = item.split('-', 1)
+            device_range = range(int(first), int(last) + 1)
+        else:
+            device_range = [int(item)]
+        for device in device_range:
+            if (item_network, device) not in devices:
+                devices.append((item_network, device))
+    return devices
+
+
+def read_archive(path):
+    if path.endswith('.json'):
+        results = {}
+        with open(path) as archive:
+            for entry in json.load(archive)['devices']:
+                entry['registers'] = bytes.fromhex(entry['registers'])
+                results[(entry['network'], entry['device'])] = entry
+        return results
+    return read_snapshot(path)
+
+
+def write_archive(path, results):
+    if path.endswith('.json'):
+        tmp_path = path + '.tmp'
+        entries = []
+        for key in sorted(results):
+            entry = dict(results[key])
+            entry['registers'] = entry['registers'].hex()
+            entries.append(entry)
+        with open(tmp_path, 'w') as archive:
+            json.dump({'devices': entries}, archive, indent=1)
+        os.replace(tmp_path, path)
+    else:
+        write_snapshot(path, results.values())
+
+
+async def dump_device(client, network, device, previous, semaphore, timeout):
+    async with semaphore:
+        start = monotonic()
+        entry = {'network': network, 'device': device}
+        try:
+            signature = await asyncio.wait_for(client.update_signature(network, device), timeout)
+            entry['id_checksum'], entry['setup_checksum'], entry['ct_bytes'] = signature
+            old = previous.get((network, device))
+            if old is not None and \
+                    (old['id_checksum'], old['setup_checksum'], old['ct_bytes']) == signature:
+                entry['registers'] = old['registers']
+                client.handle_register_update(network, device, 0, old['registers'])
+                entry['status'] = 'unchanged'
+            else:
+                await asyncio.wait_for(client.update_registers(network, device, signature=signature), timeout)
+                entry['registers'] = bytes(client.get_device(network, device).registers)
+                entry['status'] = 'dumped'
+        except asyncio.TimeoutError:
+            entry['status'] = 'timeout'
+        except Exception as exc:
+            # One failing device must not abort the others
+            logger.exception(f"Device {network}:{device} failed")
+            entry['status'] = 'error'
+            entry['error'] = repr(exc)
+        entry['elapsed'] = monotonic() - start
+        logger.info(f"Device {network}:{device} {entry['status']} in {entry['elapsed']:.2f}s")
+        return entry
+
+
+async def main(options):
     loop = asyncio.get_event_loop()
+    devices = parse_device_list(options.device, options.network)
+    previous = {}
+    if options.previous:
+        previous = read_archive(options.previous)
     client = await create_upb_connection(
         host=options.host, port=options.port, logger=logger, loop=loop,
         username=options.username, password=options.password
         )
-    device = client.get_device(options.network, options.device)
-    await device.sync_registers()
+    semaphore = asyncio.Semaphore(options.concurrency)
+    start = monotonic()
+    entries = await asyncio.gather(*[
+        dump_device(client, network, device, previous, semaphore, options.timeout)
+        for network, device in devices])
     client.stop()
+    results = dict(previous)
+    results.update({(entry['network'], entry['device']): entry for entry in entries if 'registers' in entry})
+    counts = {}
+    for entry in entries:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    logger.info(f"Processed {len(entries)} devices in {monotonic() - start:.2f}s: {counts}")
+    if options.output:
+        write_archive(options.output, results)
 
 if __name__ == '__main__':
+    options = parser.parse_args()
+    if options.device is None:
+        parser.error('--device is required')
+    if options.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
     loop = asyncio.get_event_loop()
     try:
-        loop.run_until_complete(main())
+        loop.run_until_complete(main(options))
 
     except KeyboardInterrupt:
         loop.close()
@@ -0,0 +1,39 @@
+from collections import defaultdict, deque
+
+
+class UPBTraceRecorder:
+    """Collect trace hook events into per transaction timelines."""
+
+    def __init__(self, maxlen=None):
+        self.maxlen = maxlen
+        self.events = deque(maxlen=maxlen)
+
+    def __call__(self, event, timestamp, txn, data):
+        self.events.append((event, timestamp, txn))
+
+    def clear(self):
+        self.events.clear()
+
+    def timelines(self):
+        """Return {(layer, txn): [(event, timestamp), ...]} for traced transactions."""
+        timelines = defaultdict(list)
+        for event, timestamp, txn in self.events:
+            if txn is None:
+                continue
+            timelines[(event.value & 0xf0, txn)].append((event, timestamp))
+        return dict(timelines)
+
+    def spans(self, timeline):
+        """Return the time spent between consecutive events of a timeline."""
+        spans = []
+        for (start, start_ts), (end, end_ts) in zip(timeline, timeline[1:]):
+            spans.append((start, end, end_ts - start_ts))
+        return spans
+
+    def folded(self):
+        """Return aggregated spans in folded stack format for flame graph tools."""
+        totals = defaultdict(float)
+        for timeline in self.timelines().values():
+            for start, end, duration in self.spans(timeline):
+                totals[f"{start.name};{end.name}"] += duration
+        return "\n".join(f"{stack} {int(total * 1000000)}" for stack, total in sorted(totals.items()))
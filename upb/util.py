@@ -1,12 +1,45 @@
 from struct import pack
-from functools import reduce
 from binascii import hexlify
 
-from upb.const import UpbDeviceId, UpbReqRepeater, UpbReqAck, MdidSet, MdidCoreCmd, PimCommand
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from upb.const import MINIMUM_BLINK_RATE, UpbDeviceId, UpbReqRepeater, UpbReqAck, MdidSet, MdidCoreCmd, MdidDeviceControlCmd, PimCommand
+
+
+# Fewer frames are checked faster without numpy
+NUMPY_BATCH_MIN = 64
 
 
 def cksum(data):
-    return (256 - reduce(lambda x, y: x + y, data)) % 256
+    return -sum(data) & 0xff
+
+def validate_checksums(buffer, offsets):
+    """Check the checksums of frames packed in a buffer at the given offsets.
+
+    The length of every frame is taken from its control word, a frame is
+    valid when all its bytes including the checksum sum to 0 mod 256.
+    Return a list of booleans, one per offset.
+    """
+    if numpy is not None and len(offsets) >= NUMPY_BATCH_MIN:
+        data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+        starts = numpy.asarray(offsets, dtype=numpy.int64)
+        ends = starts + (data[starts] & 0x1f)
+        complete = (ends <= len(data)) & (ends - starts >= 7)
+        # Sum of each frame from a running total with a leading zero
+        totals = numpy.zeros(len(data) + 1, dtype=numpy.uint64)
+        numpy.cumsum(data, dtype=numpy.uint64, out=totals[1:])
+        ends = numpy.minimum(ends, len(data))
+        sums = totals[ends] - totals[starts]
+        return (complete & (sums & 0xff == 0)).tolist()
+    view = memoryview(buffer)
+    valid = []
+    for start in offsets:
+        end = start + (view[start] & 0x1f)
+        valid.append(end <= len(view) and end - start >= 7 and sum(view[start:end]) & 0xff == 0)
+    return valid
 
 def format_transmit_packet(network, device, cmd, data=None, link=False, ack=UpbReqAck.REQ_ACKNOREQUEUEONNAK,
     repeat=UpbReqRepeater.REP_NONREPEATER, cnt=0, seq=0):
@@ -25,6 +58,8 @@ def format_transmit_packet(network, device, cmd, data=None, link=False, ack=UpbR
     control_word = pack('BB', *[data_len | link_bit | repeater_request, ack_request | transmit_cnt | transmit_seq])
     if isinstance(cmd, MdidCoreCmd):
         mdid_set = MdidSet.MDID_CORE_COMMANDS.value
+    elif isinstance(cmd, MdidDeviceControlCmd):
+        mdid_set = MdidSet.MDID_DEVICE_CONTROL_COMMANDS.value
     mdid_cmd = cmd.value
     msg = control_word
     msg += pack('B', network_id)
@@ -43,6 +78,13 @@ def encode_register_request(network, device, register_start=0, registers=16):
     packet = format_transmit_packet(network, device, mdid_cmd, data)
     return packet
 
+def encode_extended_register_request(network, device, address, registers):
+    """Encode a request for registers past 0xff with a two byte address"""
+    mdid_cmd = MdidCoreCmd.MDID_CORE_COMMAND_GETREGISTERVALUES
+    data = pack('>HB', address, registers)
+    packet = format_transmit_packet(network, device, mdid_cmd, data)
+    return packet
+
 def encode_signature_request(network, device):
     """Encode a message for the PIM"""
     mdid_cmd = MdidCoreCmd.MDID_CORE_COMMAND_GETDEVICESIGNATURE
@@ -62,6 +104,86 @@ def encode_setuptime_request(network, device):
     packet = format_transmit_packet(network, device, mdid_cmd)
     return packet
 
+def encode_device_status_request(network, device):
+    """Encode a message for the PIM"""
+    mdid_cmd = MdidCoreCmd.MDID_CORE_COMMAND_GETDEVICESTATUS
+    packet = format_transmit_packet(network, device, mdid_cmd)
+    return packet
+
+def encode_signal_strength_request(network, device):
+    """Encode a message for the PIM"""
+    mdid_cmd = MdidCoreCmd.MDID_CORE_COMMAND_GETSIGNALSTRENGTH
+    packet = format_transmit_packet(network, device, mdid_cmd)
+    return packet
+
+def encode_noise_level_request(network, device):
+    """Encode a message for the PIM"""
+    mdid_cmd = MdidCoreCmd.MDID_CORE_COMMAND_GETNOISELEVEL
+    packet = format_transmit_packet(network, device, mdid_cmd)
+    return packet
+
+def encode_activate_link(network, link):
+    """Encode a link activation for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_ACTIVATELINK
+    packet = format_transmit_packet(network, link, mdid_cmd, link=True)
+    return packet
+
+def encode_deactivate_link(network, link):
+    """Encode a link deactivation for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_DEACTIVATELINK
+    packet = format_transmit_packet(network, link, mdid_cmd, link=True)
+    return packet
+
+def encode_level_args(level, rate=None, channel=None):
+    """Encode level, optional fade rate and optional channel arguments"""
+    data = pack('B', level)
+    if rate is not None or channel is not None:
+        data += pack('B', 0xff if rate is None else rate)
+    if channel is not None:
+        data += pack('B', channel)
+    return data
+
+def encode_goto(network, device, level, rate=None, channel=None, link=False):
+    """Encode a goto level command for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_GOTO
+    data = encode_level_args(level, rate, channel)
+    packet = format_transmit_packet(network, device, mdid_cmd, data, link=link)
+    return packet
+
+def encode_fade_start(network, device, level, rate=None, channel=None, link=False):
+    """Encode a fade start command for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_FADESTART
+    data = encode_level_args(level, rate, channel)
+    packet = format_transmit_packet(network, device, mdid_cmd, data, link=link)
+    return packet
+
+def encode_fade_stop(network, device, link=False):
+    """Encode a fade stop command for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_FADESTOP
+    packet = format_transmit_packet(network, device, mdid_cmd, link=link)
+    return packet
+
+def encode_blink(network, device, rate, channel=None, link=False):
+    """Encode a blink command for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_BLINK
+    data = pack('B', max(rate, MINIMUM_BLINK_RATE))
+    if channel is not None:
+        data += pack('B', channel)
+    packet = format_transmit_packet(network, device, mdid_cmd, data, link=link)
+    return packet
+
+def encode_report_state(network, device, link=False):
+    """Encode a report state command for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_REPORTSTATE
+    packet = format_transmit_packet(network, device, mdid_cmd, link=link)
+    return packet
+
+def encode_store_state(network, link):
+    """Encode a store state command for the PIM to transmit"""
+    mdid_cmd = MdidDeviceControlCmd.MDID_DEVICE_CONTROL_COMMAND_STORESTATE
+    packet = format_transmit_packet(network, link, mdid_cmd, link=True)
+    return packet
+
 def hexdump(data, length=None, sep=':'):
     if length is not None:
         lines = ""